@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014-2016 Oleh Prypin <blaxpirit@gmail.com>
+# 
+# This file is part of SixCells.
+# 
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Solve many levels without a GUI and report how far the solver gets in each of them"""
+
+from __future__ import division, print_function
+
+import sys
+import os.path
+import glob
+import argparse
+import collections
+import multiprocessing
+import timeit
+import json
+import csv
+import contextlib
+import sqlite3
+
+import model
+from model import Cell
+import solver
+
+
+fields = ['file', 'index', 'title', 'solved', 'steps', 'propagated', 'milp_found', 'cells_left', 'remaining', 'time', 'error']
+# With --rate: for every tier, the number of steps that used it and the number of cells they found
+rate_fields = ['file', 'index', 'title', 'solved', 'score', 'hardest'] + [
+    name for tier in solver.rating_tiers for name in [tier, tier+'_cells']
+] + ['cells_left', 'time', 'error']
+
+
+def find_files(paths):
+    "Expand directories and glob patterns into .hexcells and .hexpack files"
+    for path in paths:
+        if os.path.isdir(path):
+            for fn in sorted(glob.glob(os.path.join(path, '*.hexcells')) + glob.glob(os.path.join(path, '*.hexpack'))):
+                yield fn
+        elif os.path.exists(path):
+            yield path
+        else:
+            found = sorted(glob.glob(path))
+            if not found:
+                print("No such file:", path, file=sys.stderr)
+            for fn in found:
+                yield fn
+
+def find_levels(paths):
+    "Yield (file name, index of the level in the file, level text) for every level found"
+    for fn in find_files(paths):
+        try:
+            pack = model.open_pack(fn)
+        except ValueError as e:
+            print("{}: {}".format(fn, e), file=sys.stderr)
+            continue
+        try:
+            for index in range(len(pack)):
+                yield fn, index, pack[index]
+        finally:
+            pack.close()
+
+
+def solve_level(job):
+    fn, index, text = job
+    result = collections.OrderedDict([('file', fn), ('index', index)])
+    start = timeit.default_timer()
+    try:
+        level = model.load(text)
+    except ValueError as e:
+        result['error'] = str(e)
+        return result
+    result['title'] = level.title
+    result['steps'] = solver.solve_complete(level)
+    hits = level.session.hits
+    result['propagated'] = hits['propagation']
+    result['milp_found'] = hits['milp']
+    result['solved'] = level.remaining == 0
+    result['cells_left'] = sum(1 for cell in level.all_cells if cell.display is Cell.unknown)
+    result['remaining'] = level.remaining
+    result['time'] = round(timeit.default_timer() - start, 3)
+    return result
+
+def rate_level(job):
+    fn, index, text = job
+    result = collections.OrderedDict([('file', fn), ('index', index)])
+    start = timeit.default_timer()
+    try:
+        level = model.load(text)
+    except ValueError as e:
+        result['error'] = str(e)
+        return result
+    result['title'] = level.title
+    rating = solver.rate(level)
+    result['solved'] = rating.solved
+    result['score'] = round(rating.score, 3)
+    result['hardest'] = rating.hardest
+    for tier, (steps, cells) in rating.tiers().items():
+        result[tier] = steps
+        result[tier+'_cells'] = cells
+    result['cells_left'] = sum(1 for cell in level.all_cells if cell.display is Cell.unknown)
+    result['time'] = round(timeit.default_timer() - start, 3)
+    return result
+
+def difficulty(result):
+    "Sort key: failed to load, then solvable levels from easiest to hardest, then the ones that get stuck"
+    if 'error' in result:
+        return (0, 0, 0)
+    return (2 if not result['solved'] else 1, result['score'], result['time'])
+
+
+def init_worker(solver_name, threads, encoding=None, cache=None):
+    if cache:
+        solver.deduction_cache.database = lambda: contextlib.closing(sqlite3.connect(cache))
+    if solver_name:
+        solver.set_solver(solver_name)
+    if encoding:
+        solver.together_encoding = encoding
+    if threads:
+        solver.threads = threads
+
+
+def run(jobs, function, processes, initializer=None, initargs=()):
+    """Apply the function to each of the jobs, using a pool of worker processes.
+    Yield the results as soon as they're ready, not necessarily in order."""
+    if processes == 1:
+        if initializer:
+            initializer(*initargs)
+        for job in jobs:
+            yield function(job)
+        return
+    pool = multiprocessing.Pool(processes or None, initializer, initargs)
+    try:
+        for result in pool.imap_unordered(function, jobs):
+            yield result
+        pool.close()
+    except BaseException:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+class JsonLinesWriter(object):
+    def __init__(self, f, fields):
+        self.f = f
+    def write(self, result):
+        self.f.write(json.dumps(result) + '\n')
+
+class CsvWriter(object):
+    def __init__(self, f, fields):
+        self.writer = csv.DictWriter(f, fields, extrasaction='ignore')
+        self.writer.writeheader()
+    def write(self, result):
+        self.writer.writerow(result)
+
+writers = collections.OrderedDict([('jsonl', JsonLinesWriter), ('csv', CsvWriter)])
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Solve levels without a GUI. "
+        "For each level, report whether it could be solved completely, "
+        "how many steps needed the full solver, how many cells were found by propagation "
+        "and by the full solver, how many cells were left and how long it took.")
+    parser.add_argument('paths', metavar='PATH', nargs='+',
+        help="a .hexcells file (may contain multiple levels), a directory of them or a glob pattern")
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('-f', '--format', choices=list(writers), default='jsonl',
+        help="output format (default: jsonl)")
+    parser.add_argument('-o', '--output', metavar='FILE',
+        help="write the results into this file instead of standard output")
+    parser.add_argument('-s', '--solver', choices=list(solver.backends),
+        help="MILP solver to use (default: the first available one of these)")
+    parser.add_argument('-e', '--encoding', choices=solver.together_encodings,
+        help="how the MILP encodes {n} columns (default: pairs)")
+    parser.add_argument('-r', '--rate', action='store_true',
+        help="rate how hard the levels are instead: solve them using the weakest kind of deduction "
+        "that works at each step and report how many steps needed each kind")
+    parser.add_argument('--sort', action='store_true',
+        help="with --rate, wait for all levels and report them from easiest to hardest")
+    parser.add_argument('-c', '--cache', metavar='FILE',
+        help="remember what the MILP found in this SQLite database, to reuse it in later runs")
+    args = parser.parse_args(args)
+    if args.solver:
+        try:
+            solver.set_solver(args.solver)
+        except ValueError as e:
+            parser.error(str(e))
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    writer = writers[args.format](out, rate_fields if args.rate else fields)
+    counts = collections.Counter()
+    try:
+        # The processes already keep all the CPUs busy, one thread each is enough
+        threads = None if args.jobs == 1 else 1
+        results = run(
+            find_levels(args.paths), rate_level if args.rate else solve_level,
+            args.jobs, init_worker, (args.solver, threads, args.encoding, args.cache)
+        )
+        if args.rate and args.sort:
+            results = sorted(results, key=difficulty)
+        for result in results:
+            writer.write(result)
+            out.flush()
+            counts['error' if 'error' in result else 'solved' if result['solved'] else 'stuck'] += 1
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print("{} levels: {} solved, {} stuck, {} failed to load".format(
+        sum(counts.values()), counts['solved'], counts['stuck'], counts['error']
+    ), file=sys.stderr)
+    return 1 if counts['error'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
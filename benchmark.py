@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014-2016 Oleh Prypin <blaxpirit@gmail.com>
+# 
+# This file is part of SixCells.
+# 
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Time loading, saving, displaying and solving levels, and compare the times with a baseline"""
+
+from __future__ import division, print_function
+
+import sys
+import os
+import os.path
+import argparse
+import collections
+import platform
+import timeit
+import json
+
+import model
+import solver
+from batch import find_levels
+
+
+here = os.path.dirname(os.path.abspath(__file__))
+corpus = os.path.join(here, 'benchmark-levels')
+
+
+# The Qt parts are only measured if Qt can be loaded.
+# No window is shown, so it doesn't need a display either.
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+try:
+    import common
+except Exception:
+    common = None
+
+
+def fresh_level(text):
+    "A level that is loaded anew, with nothing remembered by the solver"
+    solver.deduction_cache.memory.clear()
+    return model.load(text)
+
+def fresh_session(text):
+    level = fresh_level(text)
+    solver.get_session(level)
+    return level
+
+def scene_of(text):
+    scene = common.Scene()
+    common.load(text, scene)
+    return scene
+
+
+# Name -> (whether it needs Qt, setup, function).
+# For every run, setup(text) prepares what is passed to the function; only the function is timed.
+benchmarks = collections.OrderedDict([
+    ('load', (True, lambda text: text, lambda text: common.load(text, common.Scene()))),
+    ('save', (True, scene_of, lambda scene: common.save(scene, padding=False))),
+    ('save_padded', (True, scene_of, lambda scene: common.save(scene, padding=True))),
+    ('full_upd', (True, scene_of, lambda scene: scene.full_upd())),
+    ('solve_simple', (False, fresh_session, lambda level: list(solver.solve_simple(level)))),
+    ('solve', (False, fresh_session, solver.solve)),
+    ('solve_complete', (False, fresh_level, solver.solve_complete)),
+])
+
+
+def percentile(values, q):
+    "The q-th percentile of sorted values, interpolated linearly"
+    k = (len(values)-1) * q/100
+    i = int(k)
+    if i+1 >= len(values):
+        return values[-1]
+    return values[i] + (values[i+1]-values[i]) * (k-i)
+
+def summarize(times, lp_solves):
+    times = sorted(times)
+    return collections.OrderedDict([
+        ('runs', len(times)),
+        ('min', times[0]),
+        ('median', percentile(times, 50)),
+        ('p90', percentile(times, 90)),
+        ('max', times[-1]),
+        ('lp_solves', lp_solves),
+    ])
+
+
+def measure(setup, function, text, repeat):
+    """Run the function `repeat` times, each time on a new setup(text).
+    Return the summary of the times (in seconds) and the number of LP solves per run."""
+    times = []
+    for i in range(repeat):
+        arg = setup(text)
+        solver.stats.clear()
+        start = timeit.default_timer()
+        function(arg)
+        times.append(timeit.default_timer() - start)
+    return summarize(times, solver.stats['lp_solves'])
+
+def run(names, levels, repeat, log=None):
+    """Measure the benchmarks on the levels, a list of (name, text).
+    Return the results, ready to be written as JSON."""
+    results = collections.OrderedDict()
+    for name in names:
+        needs_qt, setup, function = benchmarks[name]
+        if needs_qt and common is None:
+            if log:
+                print("{}: skipped, Qt is not available".format(name), file=log)
+            continue
+        per_level = collections.OrderedDict()
+        for level_name, text in levels:
+            per_level[level_name] = measure(setup, function, text, repeat)
+        results[name] = collections.OrderedDict([
+            # The sum over all levels is what is compared with the baseline
+            ('total', sum(r['median'] for r in per_level.values())),
+            ('lp_solves', sum(r['lp_solves'] for r in per_level.values())),
+            ('levels', per_level),
+        ])
+        if log:
+            print("{:16} {:9.2f} ms  {:5} LP solves".format(
+                name, results[name]['total']*1000, results[name]['lp_solves']
+            ), file=log)
+    return results
+
+
+def compare(results, baseline, thresholds, default_threshold):
+    """Find the benchmarks that are slower than in the baseline by more than their threshold (a fraction).
+    Return a list of (name, baseline total, new total)."""
+    regressions = []
+    for name, result in results.items():
+        try:
+            old = baseline[name]['total']
+        except KeyError:
+            continue
+        new = result['total']
+        if new > old * (1 + thresholds.get(name, default_threshold)):
+            regressions.append((name, old, new))
+    return regressions
+
+
+def parse_threshold(s):
+    "'25' or 'solve=25' (percent) -> (name or None, fraction)"
+    name, _, percent = s.rpartition('=')
+    try:
+        return name or None, float(percent.rstrip('%')) / 100
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid threshold: {!r}".format(s))
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Time loading, saving, displaying and solving levels. "
+        "For each benchmark and level, report the median and other percentiles of the time "
+        "and the number of LP solves, as JSON. Optionally compare the totals with a baseline.")
+    parser.add_argument('paths', metavar='PATH', nargs='*',
+        help="a .hexcells file (may contain multiple levels), a directory of them or a glob pattern "
+        "(default: the levels in benchmark-levels)")
+    parser.add_argument('-b', '--bench', metavar='NAME', action='append', choices=list(benchmarks),
+        help="run only this benchmark (can be repeated): " + ", ".join(benchmarks))
+    parser.add_argument('-r', '--repeat', type=int, default=5,
+        help="number of runs of each benchmark on each level (default: 5)")
+    parser.add_argument('-o', '--output', metavar='FILE',
+        help="write the results into this file instead of standard output; it can be used as a baseline later")
+    parser.add_argument('-s', '--solver', choices=list(solver.backends),
+        help="MILP solver to use (default: the first available one of these)")
+    parser.add_argument('-e', '--encoding', choices=solver.together_encodings,
+        help="how the MILP encodes {n} columns (default: pairs)")
+    parser.add_argument('-c', '--compare', metavar='FILE',
+        help="compare with the results in this file and fail if something got slower")
+    parser.add_argument('-t', '--threshold', metavar='[NAME=]PERCENT', action='append', type=parse_threshold, default=[],
+        help="how much slower than the baseline a benchmark may get (default: 25); "
+        "with NAME, only for that benchmark. Can be repeated")
+    args = parser.parse_args(args)
+    if args.solver:
+        try:
+            solver.set_solver(args.solver)
+        except ValueError as e:
+            parser.error(str(e))
+    if args.encoding:
+        solver.together_encoding = args.encoding
+    if args.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    thresholds = dict(args.threshold)
+    default_threshold = thresholds.pop(None, 0.25)
+
+    levels = [
+        ('{}:{}'.format(os.path.relpath(fn), index) if index else os.path.relpath(fn), text)
+        for fn, index, text in find_levels(args.paths or [corpus])
+    ]
+    if not levels:
+        parser.error("no levels found")
+
+    results = collections.OrderedDict([
+        ('python', platform.python_version()),
+        ('solver', solver.get_solver().name),
+        ('encoding', solver.together_encoding),
+        ('repeat', args.repeat),
+        ('benchmarks', run(args.bench or list(benchmarks), levels, args.repeat, log=sys.stderr)),
+    ])
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        json.dump(results, out, indent=2)
+        out.write('\n')
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['benchmarks']
+        regressions = compare(results['benchmarks'], baseline, thresholds, default_threshold)
+        for name, old, new in regressions:
+            print("{}: {:.2f} ms -> {:.2f} ms ({:+.0f}%)".format(name, old*1000, new*1000, (new/old-1)*100), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -24,19 +24,23 @@ import sys
 import os.path
 import math
 import collections
-import itertools
 import contextlib
+import threading
 
 from util import *
 
 from universal_qt import PySide, PyQt4, PyQt5
 import qt
-from qt.core import QByteArray, QEvent, QPointF, QRect, QUrl
+from qt import Signal
+from qt.core import QByteArray, QEvent, QObject, QPointF, QUrl
 from qt.gui import QBrush, QColor, QCursor, QDesktopServices, QMouseEvent, QPainter, QPen, QPolygonF
 from qt.widgets import QAction, QActionGroup, QApplication, QFileDialog, QGraphicsPolygonItem, QGraphicsScene, QGraphicsSimpleTextItem, QGraphicsView, QMainWindow, QMessageBox, QGraphicsItem
 
 from config import *
 
+import model
+from model import Level
+
 app = QApplication(sys.argv)
 
 
@@ -59,6 +63,7 @@ class Color(object):
     flower = QColor(255, 255, 255, 90)
     flower_border = QColor(128, 128, 128, 192)
     revealed_border = QColor(0, 230, 80)
+    undetermined = QColor(230, 30, 30)
     selection = qt.black
 
 
@@ -86,6 +91,69 @@ def multiply_font_size(font, k):
         font.setPixelSize(round(font.pixelSize()*k))
 
 
+class Worker(QObject):
+    """Runs a function in a background thread, one job at a time.
+    The function gets a threading.Event as its first argument, which is set when the job is cancelled;
+    it should stop soon after that, and whatever it returns is ignored.
+    Starting a job cancels the previous one.
+    The result of a job that finished without being cancelled is emitted by `finished`,
+    in the GUI thread. If the function raised an exception, the exception is emitted instead.
+    While running, the job can pass values to `report`, they're emitted by `progress`."""
+    finished = Signal(object)
+    progress = Signal(object)
+    # From the thread: the job's event and its result or a reported value
+    _done = Signal(object)
+    _progress = Signal(object)
+
+    def __init__(self):
+        QObject.__init__(self)
+        self.cancelled = None
+        self._done.connect(self._finish)
+        self._progress.connect(self._report)
+
+    @property
+    def running(self):
+        return self.cancelled is not None
+
+    def start(self, function, *args):
+        self.cancel()
+        cancelled = self.cancelled = threading.Event()
+        def run():
+            try:
+                result = function(cancelled, *args)
+            except Exception as e:
+                result = e
+            if not cancelled.is_set():
+                self._done.emit((cancelled, result))
+        thread = threading.Thread(target=run)
+        # Don't wait for a job that is still running when the program exits
+        thread.daemon = True
+        thread.start()
+
+    def cancel(self):
+        if self.cancelled is not None:
+            self.cancelled.set()
+            self.cancelled = None
+
+    def _finish(self, job):
+        cancelled, result = job
+        # It might have been cancelled after it finished
+        if cancelled is self.cancelled:
+            self.cancelled = None
+            self.finished.emit(result)
+
+    def report(self, cancelled, value):
+        "Called from the job's thread with its event"
+        if not cancelled.is_set():
+            self._progress.emit((cancelled, value))
+
+    def _report(self, job):
+        cancelled, value = job
+        # Nothing arrives after the job is cancelled, even if it was sent before
+        if cancelled is self.cancelled:
+            self.progress.emit(value)
+
+
 def make_check_action(text, obj, *args):
     action = QAction(text, obj)
     action.setCheckable(True)
@@ -130,16 +198,42 @@ def hex1():
     return result
 hex1 = hex1()
 
+class forward_property(object):
+    "Attribute that is actually stored in another object, e.g. the item's model"
+    def __init__(self, target, attr):
+        self.target = target
+        self.attr = attr
+    
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        return getattr(getattr(obj, self.target), self.attr)
+    
+    def __set__(self, obj, value):
+        setattr(getattr(obj, self.target), self.attr, value)
+
+
 class Item(object):
     placed = False
     
+    id = forward_property('model', 'id')
+    show_info = forward_property('model', 'show_info')
+    
     def _remove_from_grid(self):
         try:
-            if self.scene().grid[tuple(self.coord)] is self:
-                del self.scene().grid[tuple(self.coord)]
+            scene = self.scene()
+            scene.level.remove(self.model)
+            if scene.grid[tuple(self.coord)] is self:
+                del scene.grid[tuple(self.coord)]
         except (AttributeError, KeyError):
             pass
     
+    def _views(self, items):
+        "Graphics items that show the given model items"
+        if items is not None:
+            grid = self.scene().grid
+            return [grid[it.coord] for it in items]
+    
     @setter_property
     def coord(self, value):
         x, y = value
@@ -150,11 +244,9 @@ class Item(object):
         self._remove_from_grid()
         if coord is not None:
             self.coord = coord
-        self.scene().grid[self.coord.x, self.coord.y] = self
-        try:
-            del self.scene().grid_bounds
-        except AttributeError:
-            pass
+        scene = self.scene()
+        scene.grid[self.coord.x, self.coord.y] = self
+        scene.level.place(self.model, self.coord)
         self.placed = True
     
     def remove(self):
@@ -190,27 +282,24 @@ def _cell_polys():
     return poly, inner_poly
 _cell_outer, _cell_inner = _cell_polys()
 
-_flower_deltas = [ # order: (clockwise, closest) starting from north
-    ( 0, -2), ( 0, -4), ( 1, -3),
-    ( 1, -1), ( 2, -2), ( 2,  0),
-    ( 1,  1), ( 2,  2), ( 1,  3),
-    ( 0,  2), ( 0,  4), (-1,  3),
-    (-1,  1), (-2,  2), (-2,  0),
-    (-1, -1), (-2, -2), (-1, -3),
-]
-_neighbors_deltas = _flower_deltas[::3] # order: clockwise starting from north
-_columns_deltas = _neighbors_deltas[-1], _neighbors_deltas[0], _neighbors_deltas[1]
 _colliding_deltas = [(0, 0), (0, -1), (0, 1), (-1, 0), (1, 0)]
 
 class Cell(QGraphicsPolygonItem, Item):
     "Hexagonal cell"
-    unknown = Entity('Cell.unknown')
-    empty = Entity('Cell.empty')
-    full = Entity('Cell.full')
+    unknown = model.Cell.unknown
+    empty = model.Cell.empty
+    full = model.Cell.full
+    
+    kind = forward_property('model', 'kind')
+    revealed = forward_property('model', 'revealed')
+    value = forward_property('model', 'value')
+    together = forward_property('model', 'together')
     
     def __init__(self):
         QGraphicsPolygonItem.__init__(self, _cell_outer)
         
+        self.model = model.Cell()
+        
         self._inner = QGraphicsPolygonItem(_cell_inner)
         self._inner.setPen(no_pen)
 
@@ -231,48 +320,21 @@ class Cell(QGraphicsPolygonItem, Item):
     def display(self):
         return self.kind
     
-    @cached_property
+    @property
     def neighbors(self):
-        return list(self._find_neighbors(_neighbors_deltas, Cell))
-    @cached_property
+        return self._views(self.model.neighbors)
+    @property
     def flower_neighbors(self):
-        return list(self._find_neighbors(_flower_deltas, Cell))
-    @cached_property
+        return self._views(self.model.flower_neighbors)
+    @property
     def columns(self):
-        result = []
-        for col in self._find_neighbors(_columns_deltas, Column):
-            sgn = col.angle//60
-            if sgn == col.coord.x-self.coord.x:
-                result.append(col)
-        return result
-    
-    @cached_property
+        return self._views(self.model.columns)
+    @property
     def members(self):
-        if self.show_info:
-            if self.kind is Cell.empty:
-                return self.neighbors
-            if self.kind is Cell.full:
-                return self.flower_neighbors
+        return self._views(self.model.members)
 
     def is_neighbor(self, other):
-        return other in self.neighbors
-
-    @cached_property
-    def value(self):
-        if self.show_info:
-            return sum(1 for it in self.members if it.kind is Cell.full)
-    
-    @cached_property
-    def together(self):
-        if self.show_info == 2:
-            full_items = {it for it in self.members if it.kind is Cell.full}
-            return all_grouped(full_items, key=Cell.is_neighbor)
-
-    def reset_cache(self):
-        for attr in ['neighbors', 'flower_neighbors', 'columns', 'members', 'value', 'together']:
-            try:
-                delattr(self, attr)
-            except AttributeError: pass
+        return self.model.is_neighbor(other.model)
     
     @property
     def extra_text(self):
@@ -296,8 +358,6 @@ class Cell(QGraphicsPolygonItem, Item):
                 self.extra_text = ''
     
     def upd(self, first=False):
-        self.reset_cache()
-        
         if self.display is Cell.unknown:
             self.setBrush(Color.yellow_border)
             self._inner.setBrush(Color.yellow)
@@ -342,11 +402,16 @@ class Cell(QGraphicsPolygonItem, Item):
     def upd_neighbors(self):
         neighbors = list(self.flower_neighbors)
         scene = self.scene()
+        level = scene.level
+        columns = set(level.columns_through(self.coord))
         yield
+        if self.placed:
+            columns.update(level.columns_through(self.coord))
         for it in neighbors:
             it.upd()
-        for it in scene.all(Column):
-            it.upd()
+        for col in columns:
+            if col.level is level:
+                scene.item_of(col).upd()
     
     def paint(self, g, option, widget):
         QGraphicsPolygonItem.paint(self, g, option, widget)
@@ -378,13 +443,17 @@ _col_poly = QPolygonF()
 for x, y in [(-0.25, 0.48), (-0.25, 0.02), (0.25, 0.02), (0.25, 0.48)]:
     _col_poly.append(QPointF(x, y))
 
-_col_angle_deltas = {-60: (1, 1), 0: (0, 1), 60: (-1, 1)}
-
 class Column(QGraphicsPolygonItem, Item):
     "Column number marker"
+    angle = forward_property('model', 'angle')
+    value = forward_property('model', 'value')
+    together = forward_property('model', 'together')
+    
     def __init__(self):
         QGraphicsPolygonItem.__init__(self, _col_poly)
 
+        self.model = model.Column()
+        
         self.show_info = False
 
         self.setBrush(QColor(255, 255, 255, 0))
@@ -396,53 +465,15 @@ class Column(QGraphicsPolygonItem, Item):
         fit_inside(self, self._text, 0.86)
         #self._text.setY(self._text.y()+0.2)
     
-    @setter_property
-    def angle(self, value):
-        if value not in (-60, 0, 60):
-            raise ValueError(value)
-        yield value
-    
     @property
     def cell(self):
         return self.members[0]
 
-    @cached_property
+    @property
     def members(self):
-        try:
-            x, y = self.coord
-        except AttributeError:
-            return
-        result = []
-        dx, dy = _col_angle_deltas[self.angle]
-        while True:
-            x += dx
-            y += dy
-            it = self.scene().grid.get((x, y))
-            if not it and not self.scene().grid_bounds.contains(x, y, False):
-                break
-            if isinstance(it, Cell):
-                result.append(it)
-        return result
-
-    @cached_property
-    def value(self):
-        return sum(1 for it in self.members if it.kind is Cell.full)
-
-    @cached_property
-    def together(self):
-        if self.show_info:
-            groups = itertools.groupby(self.members, key=lambda it: it.kind is Cell.full)
-            return sum(1 for full, _ in groups if full) <= 1
-
-    def reset_cache(self):
-        for attr in ['members', 'value', 'together']:
-            try:
-                delattr(self, attr)
-            except AttributeError: pass
+        return self._views(self.model.members)
 
     def upd(self):
-        self.reset_cache()
-        
         self.setRotation(self.angle or 1e-3) # not zero so font doesn't look different from rotated variants
         
         if not self.placed:
@@ -474,30 +505,31 @@ class Column(QGraphicsPolygonItem, Item):
 
 
 class Scene(QGraphicsScene):
+    title = forward_property('level', 'title')
+    author = forward_property('level', 'author')
+    information = forward_property('level', 'information')
+    
     def __init__(self):
         QGraphicsScene.__init__(self)
         self.grid = dict()
+        self.level = Level()
     
     def all(self, types=(Cell, Column)):
         return (it for it in self.grid.values() if isinstance(it, types))
     
-    @cached_property
-    def grid_bounds(self):
-        #return QRect(-100, -100, 200, 200)
-        it = iter(self.grid)
-        try:
-            minx, miny = next(it)
-            maxx = minx
-            maxy = miny
-        except StopIteration:
-            return QRect()
-        for x, y in it:
-            if   x < minx: minx = x
-            elif x > maxx: maxx = x
-            if   y < miny: miny = y
-            elif y > maxy: maxy = y
-        return QRect(minx, miny, maxx-minx+1, maxy-miny+1)
-
+    def item_of(self, it):
+        "The graphics item that shows the given model item"
+        return self.grid[it.coord]
+
+    def place_all(self, items):
+        "Add new graphics items to the scene at their coordinates, all at once: pairs of (item, coord)"
+        for item, coord in items:
+            self.addItem(item)
+            item.coord = coord
+            self.grid[item.coord] = item
+            item.placed = True
+        self.level.place_all((item.model, item.coord) for item, coord in items)
+    
     def full_upd(self):
         for cell in self.all(Cell):
             cell.upd(False)
@@ -506,6 +538,7 @@ class Scene(QGraphicsScene):
 
     def clear(self):
         self.grid = dict()
+        self.level.clear()
         QGraphicsScene.clear(self)
 
 
@@ -559,150 +592,62 @@ class View(QGraphicsView):
             QGraphicsView.keyReleaseEvent(self, e)
 
 
-hexcells_ui_area = [
-    '     *************************   ',
-    '     *#######################*   ',
-    '    *########################*   ',
-    '    *########################*   ',
-    '   *#########################*   ',
-    '   ##########################*   ',
-    '  *##########################****',
-    ' *###############################',
-    ' *###############################',
-    '*################################',
-    '*################################'
-] + [
-    '#'*33
-]*22
+level_center = model.level_center
 
 def save(scene, display=False, padding=True):
-    ret = None
-    
-    grid = scene.grid
-    all_cells = [(x, y) for (x, y), it in grid.items() if isinstance(it, Cell)]
-    min_x, max_x = minmax([x for x, y in grid] or [0])
-    min_y, max_y = minmax([y for x, y in grid] or [0])
-    if padding:
-        mid_x, mid_y = (min_x + max_x)//2, (min_y + max_y)//2
-        max_tx = max_ty = 32
-
-        if max_x - min_x > max_tx:
-            ret = "This level is too wide to fit into Hexcells format."
-        if max_y - min_y > max_tx:
-            ret = "This level is too high to fit into Hexcells format."
-        if ret:
-            ret += '\n' + "The data will be malformed, but still readable by SixCells."
-            max_tx = max_x - min_x
-            max_ty = max_y - min_y
-
-        mid_t = (0 + max_tx)//2, (0 + max_ty)//2
-        mid_d = mid_t[0] - mid_x, mid_t[1] - mid_y
-
-        ui_area = list(hexcells_ui_area)
-        d = len(scene.information.splitlines())*2 - 2
-        if d > 0:
-            ui_area[-d:] = [' '*33]*d
-
-        possibilities = []
-        for dy in range(-min_y, -min_y + max_ty - (max_y - min_y) + 1):
-            for dx in range(-min_x, -min_x + max_tx - (max_x - min_x) + 1):
-                overlaps = 0
-                if not ret:
-                    for (x, y), it in grid.items():
-                        c = ui_area[y+dy][x+dx]
-                        if isinstance(it, Cell):
-                            overlaps += {'#': 0, '*': 0.9, ' ': 1}[c]
-                        if isinstance(it, Column):
-                            overlaps += {'#': 0, '*': 0.001, ' ': 0.85}[c]
-                dist = (
-                    sum(distance(mid_t, (x+dx, y+dy), squared=True) for x, y in all_cells)/(len(all_cells) or 1)+
-                    distance(mid_d, (dx, dy), squared=True)/2
-                )
-                possibilities.append((overlaps, dist, (dy, dx)))
-        assert possibilities
-        overlaps, _, (dy, dx) = min(possibilities)
-        global level_center
-        level_center = (16-dx, 16-dy)
-        if overlaps > 0.8:
-            ret = "This level (barely) fits, but may overlap some UI elements of Hexcells."
-    else:
-        dx, dy = -min_x, -min_y
-        max_tx, max_ty = max_x+dx, max_y+dy
-    
-    level = [[['.', '.'] for x in range(max_tx+1)] for y in range(max_ty+1)]
-    for (x, y), it in grid.items():
-        r = level[y+dy][x+dx]
-        if isinstance(it, Column):
-            r[0] = {-60: '\\', 0: '|', 60: '/'}[int(it.angle)]
-        else:
-            kind = it.display if display and it.display is not Cell.unknown else it.kind
-            r[0] = 'x' if kind is Cell.full else 'o'
-        if it.value is not None:
-            if it.together is not None:
-                r[1] = 'c' if it.together else 'n'
-            else:
-                r[1] = '+'
-        if isinstance(it, Cell) and (it.revealed or (display and it.display is not Cell.unknown)):
-            r[0] = r[0].upper()
-    level = [''.join(''.join(part) for part in line) for line in level]
-    
-    headers = [
-        'Hexcells level v1',
-        scene.title,
-        scene.author,
-        ('\n' if '\n' not in scene.information else '') + scene.information,
-    ]
-    
-    level = '\n'.join(headers + level)
-    if padding:
-        return level, ret
-    else:
-        return level
+    global level_center
+    result = model.save(scene.level, display=display, padding=padding)
+    level_center = model.level_center
+    return result
 
 def load(level, scene, Cell=Cell, Column=Column):
-    lines = iter(level.strip().splitlines())
-
-    try:
-        header = next(lines).strip()
-        if header != 'Hexcells level v1':
-            raise ValueError("Can read only Hexcells level v1")
-
-        scene.title = next(lines).strip()
-        scene.author = next(lines).strip()
-        scene.information = '\n'.join(line for line in [next(lines).strip(), next(lines).strip()] if line)
-    except StopIteration:
-        raise ValueError("Level data stopped abruptly")
-
-    for y, line in enumerate(lines):
-        line = line.strip().replace(' ', '')
-        
-        row = []
-        
-        for x in range(0, len(line)//2):
-            kind, value = line[x*2:x*2+2]
-            
-            if kind.lower() in 'ox':
-                item = Cell()
-            elif kind in '\\|/':
-                item = Column()
-            else:
-                continue
-            
-            if isinstance(item, Cell):
-                item.kind = Cell.full if kind.lower() == 'x' else Cell.empty
-                item.revealed = kind.isupper()
-                item.show_info = 0 if value == '.' else 1 if value == '+' else 2
-            else:
-                item.angle = (-60 if kind == '\\' else 60 if kind == '/' else 0)
-                item.show_info = False if value == '+' else True
-            
-            scene.addItem(item)
-            item.place((x, y))
-        
+    data = model.parse(level)
+    
+    scene.title = data.title
+    scene.author = data.author
+    scene.information = data.information
+    
+    items = []
+    for coord, kind, show_info, revealed in data.cells:
+        item = Cell()
+        item.kind = kind
+        item.revealed = revealed
+        item.show_info = show_info
+        items.append((item, coord))
+    for coord, angle, show_info in data.columns:
+        item = Column()
+        item.angle = angle
+        item.show_info = show_info
+        items.append((item, coord))
+    scene.place_all(items)
+    
     scene.full_upd()
     
 
 class MainWindow(QMainWindow):
+    open_filter = "Hexcells Level (*.hexcells)"
+    
+    @property
+    def status(self):
+        return self.statusBar().currentMessage()
+    @status.setter
+    def status(self, value):
+        if not value:
+            self.statusBar().clearMessage()
+        elif isinstance(value, tuple):
+            self.statusBar().showMessage(value[0], int(value[1]*1000))
+        else:
+            self.statusBar().showMessage(value)
+        # Show it now, even if what follows keeps the event loop busy
+        self.statusBar().repaint()
+    
+    @property
+    def statusbar_visible(self):
+        return self.statusBar().isVisible()
+    @statusbar_visible.setter
+    def statusbar_visible(self, value):
+        self.statusBar().setVisible(value)
+    
     def load(self, level):
         if not self.close_file():
             return
@@ -717,18 +662,27 @@ class MainWindow(QMainWindow):
         self.status = "Done", 1
         return True
 
+    def read_file(self, fn):
+        "What `load` gets for the file"
+        with open(fn, 'rb') as f:
+            return f.read().decode('utf-8')
+
     def load_file(self, fn=None):
         if not fn:
             try:
                 dialog = QFileDialog.getOpenFileNameAndFilter
             except AttributeError:
                 dialog = QFileDialog.getOpenFileName
-            fn, _ = dialog(self, "Open", self.last_used_folder, "Hexcells Level (*.hexcells)")
+            fn, _ = dialog(self, "Open", self.last_used_folder, self.open_filter)
         if not fn:
             return
         self.status = "Loading a level..."
-        with open(fn, 'rb') as f:
-            level = f.read().decode('utf-8')
+        try:
+            level = self.read_file(fn)
+        except ValueError as e:
+            QMessageBox.critical(None, "Error", str(e))
+            self.status = "Failed", 1
+            return
         if self.load(level):
             if isinstance(fn, basestring):
                 self.current_file = fn
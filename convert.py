@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014-2016 Oleh Prypin <blaxpirit@gmail.com>
+# 
+# This file is part of SixCells.
+# 
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+
+"""Convert levels between the .hexcells text format and the packed binary format"""
+
+from __future__ import division, print_function
+
+import sys
+import os
+import argparse
+
+import model
+import batch
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Convert levels between the .hexcells text format and "
+        "the packed format: a compact binary file where any level can be read without reading the others.")
+    parser.add_argument('paths', metavar='PATH', nargs='+',
+        help="a .hexcells or .hexpack file, a directory of them or a glob pattern")
+    parser.add_argument('-o', '--output', metavar='FILE',
+        help="write the levels into this file instead of standard output; "
+        "a .hexpack file gets the packed format, anything else the text format")
+    args = parser.parse_args(args)
+    packed = (args.output or '').endswith('.hexpack')
+
+    current = [None]
+    def levels():
+        for fn in batch.find_files(args.paths):
+            current[0] = fn
+            pack = model.open_pack(fn)
+            try:
+                for index in range(len(pack)):
+                    current[0] = "{} #{}".format(fn, index+1)
+                    yield pack.level(index) if packed else pack[index]
+            finally:
+                pack.close()
+
+    out = open(args.output, 'wb' if packed else 'w') if args.output else sys.stdout
+    try:
+        if packed:
+            count = model.save_packed(levels(), out)
+        else:
+            count = 0
+            for text in levels():
+                out.write(text.strip() + '\n')
+                count += 1
+    except ValueError as e:
+        # Nothing is left out silently: a converted file has all of the levels or none
+        print("{}: {}".format(current[0], e), file=sys.stderr)
+        count = None
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    if count is None:
+        if args.output:
+            os.remove(args.output)
+        return 1
+    print("{} levels converted".format(count), file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
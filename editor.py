@@ -26,9 +26,14 @@ import os.path
 
 import common
 from common import *
+try:
+    import solver
+    import minimize
+except ImportError:
+    solver = None
 
 from qt.core import QPoint, QPointF, QRectF, QTimer
-from qt.gui import QIcon, QKeySequence, QMouseEvent, QPainterPath, QPen, QTransform, QPolygonF
+from qt.gui import QBrush, QIcon, QKeySequence, QMouseEvent, QPainterPath, QPen, QTransform, QPolygonF
 from qt.widgets import QDialog, QDialogButtonBox, QFileDialog, QGraphicsPathItem, QGraphicsView, QLabel, QLineEdit, QMessageBox, QShortcut, QVBoxLayout
 
 
@@ -199,6 +204,8 @@ class Scene(common.Scene):
         self.ignore_release = False
         self.undo_history_length = 16
         self.undo_step()
+        # Coordinates of the cells that the solver couldn't deduce, see MainWindow.check
+        self.undetermined = set()
     
     def reset(self):
         self.clear()
@@ -227,6 +234,16 @@ class Scene(common.Scene):
         self.preview.upd()
         self.preview._text.setText('')
     
+    def drawForeground(self, g, rect):
+        if not self.undetermined:
+            return
+        pen = QPen(Color.undetermined, 0.08)
+        g.setPen(pen)
+        g.setBrush(QBrush(qt.NoBrush))
+        for it in self.all(Cell):
+            if it.coord in self.undetermined:
+                g.drawPolygon(common._cell_inner.translated(it.scenePos()))
+    
     def mousePressEvent(self, e):
         if self.supress:
             return
@@ -357,6 +374,7 @@ class Scene(common.Scene):
         for it in self.items():
             self.removeItem(it)
         self.grid = {}
+        self.level.clear()
         for (x, y), it in grid.items():
             self.addItem(it)
             it.place((x, y))
@@ -489,6 +507,14 @@ class MainWindow(common.MainWindow):
         action.setStatusTip("Playtest this level from the beginning (discarding all progress).")
         action = menu.addAction("&Resume", lambda: self.play(resume=True), QKeySequence('Tab'))
         action.setStatusTip("Continue playtesting this level from where you left off.")
+        menu.addSeparator()
+        self.check_action = action = make_check_action("&Check Solvability", self, 'check_solvability')
+        action.setStatusTip("After every change, solve the level in the background and mark the cells that can't be deduced without guessing.")
+        action.setEnabled(solver is not None)
+        menu.addAction(action)
+        action = menu.addAction("Remove Unneeded &Hints", self.minimize)
+        action.setStatusTip("Remove the numbers, columns and {n}/-n- markers that aren't needed to solve the level without guessing (in the background).")
+        action.setEnabled(solver is not None)
         
         
         menu = self.menuBar().addMenu("Preference&s")
@@ -555,6 +581,21 @@ class MainWindow(common.MainWindow):
         self.addAction(action)
 
 
+        # The level is checked once there have been no changes for a while
+        self.check_timer = QTimer()
+        self.check_timer.setSingleShot(True)
+        self.check_timer.setInterval(700)
+        self.check_timer.timeout.connect(self.check)
+        self.checker = Worker()
+        self.checker.finished.connect(self.checked)
+        self.checked_level = None
+        self.check_label = QLabel()
+        self.statusBar().addPermanentWidget(self.check_label)
+        self.check_solvability = False
+        self.minimizer = Worker()
+        self.minimizer.finished.connect(self.minimized)
+        self.minimized_level = None
+
         self.current_file = None
         self.any_changes = False
         self.scene.changed.connect(self.changed)
@@ -572,6 +613,7 @@ class MainWindow(common.MainWindow):
         default_blue = next(v for v, a in blue_show_info_group.items() if a.isChecked()); blue_show_info_group[v].setChecked(True)
         hexcells_ui = enable_hexcells_ui_action.isChecked(); enable_hexcells_ui_action.setChecked(v)
         status_bar = enable_statusbar_action.isChecked(); enable_statusbar_action.setChecked(v)
+        check_solvability = check_action.isChecked(); check_action.setChecked(v and solver is not None)
         undo_history_length = scene.undo_history_length; scene.undo_history_length = v
         antialiasing = view.antialiasing; view.antialiasing = v
         default_author
@@ -583,25 +625,14 @@ class MainWindow(common.MainWindow):
     def changed(self, rects=None):
         if rects is None or any((rect.width() or rect.height()) for rect in rects):
             self.any_changes = True
+            if self.check_solvability:
+                self.check_timer.start()
     def no_changes(self):
         self.any_changes = False
         def no_changes():
             self.any_changes = False
         QTimer.singleShot(0, no_changes)
     
-    @property
-    def status(self):
-        return self.statusBar().currentMessage()
-    @status.setter
-    def status(self, value):
-        if not value:
-            self.statusBar().clearMessage()
-        elif isinstance(value, tuple):
-            self.statusBar().showMessage(value[0], int(value[1]*1000))
-        else:
-            self.statusBar().showMessage(value)
-        app.processEvents()
-    
     @property
     def hexcells_ui(self):
         self.view.hexcells_ui
@@ -609,13 +640,91 @@ class MainWindow(common.MainWindow):
     def hexcells_ui(self, value):
         self.view.hexcells_ui = value
     
-    @property
-    def statusbar_visible(self):
-        return self.statusBar().isVisible()
-    @statusbar_visible.setter
-    def statusbar_visible(self, value):
-        self.statusBar().setVisible(value)
+    @event_property
+    def check_solvability(self):
+        if self.check_solvability:
+            self.check()
+        else:
+            self.checker.cancel()
+            self.checked_level = None
+            self.scene.undetermined = set()
+            self.view.viewport().update()
+            self.check_label.setText('')
+
+    def check(self):
+        "Start solving the level in the background, if it changed since it was last checked"
+        if not self.check_solvability:
+            return
+        level = self.scene.level
+        text = model.save(level, padding=False)
+        if text == self.checked_level:
+            return
+        self.checked_level = text
+        grid = level.grid
+        if not grid:
+            self.checker.cancel()
+            self.checked([])
+            return
+        # The saved level starts at the top left
+        offset = (min(x for x, y in grid), min(y for x, y in grid))
+        self.check_label.setText("Checking...")
+        self.checker.start(check_level, text, offset)
+
+    def checked(self, result):
+        if model.save(self.scene.level, padding=False) != self.checked_level:
+            # The level was changed since, it will be checked again
+            return
+        if isinstance(result, Exception):
+            self.scene.undetermined = set()
+            self.check_label.setText("Couldn't check the level: {}".format(result))
+        else:
+            self.scene.undetermined = set(result)
+            if not self.scene.grid:
+                self.check_label.setText('')
+            elif not result:
+                self.check_label.setText("Solvable without guessing")
+            else:
+                self.check_label.setText("{} cell{} can't be deduced".format(len(result), '' if len(result) == 1 else 's'))
+        # Not the scene's update, it would count as a change of the level
+        self.view.viewport().update()
     
+    def minimize(self):
+        "Start removing the hints that aren't needed, in the background"
+        level = self.scene.level
+        grid = level.grid
+        if not grid:
+            return
+        self.minimized_level = model.save(level, padding=False)
+        offset = (min(x for x, y in grid), min(y for x, y in grid))
+        self.status = "Removing unneeded hints..."
+        self.minimizer.start(find_unneeded_hints, self.minimized_level, offset)
+
+    def minimized(self, result):
+        if isinstance(result, Exception):
+            self.status = "Couldn't remove hints: {}".format(result)
+            return
+        if model.save(self.scene.level, padding=False) != self.minimized_level:
+            self.status = "The level was changed while looking for unneeded hints", 5
+            return
+        if result is None:
+            self.status = "The level can't be solved without guessing, so no hints can be removed", 5
+            return
+        removed, essential = result
+        # The items are replaced, so that undoing brings back the old ones
+        for coord, kind in removed:
+            old = self.scene.grid[coord]
+            old.remove()
+            if kind == 'column':
+                continue
+            new = type(old)()
+            old.copyattrs(new)
+            new.show_info = 0 if kind == 'number' else 1 if isinstance(new, Cell) else False
+            self.scene.addItem(new)
+            new.place(coord)
+        self.scene.full_upd()
+        self.scene.undo_step()
+        self.status = "Removed {} hint{}, the other {} are needed".format(len(removed), '' if len(removed) == 1 else 's', essential), 5
+
     @event_property
     def current_file(self):
         title = self.title
@@ -791,11 +900,35 @@ class MainWindow(common.MainWindow):
         if not self.close_file():
             e.ignore()
             return
+        self.checker.cancel()
+        self.minimizer.cancel()
         
         save_config_to_file(self, self.config_format, 'sixcells', 'editor.cfg')
 
 
 
+def check_level(cancelled, text, offset):
+    """Solve the level from the start, as far as possible without guessing.
+    Return the coordinates of the cells that can't be deduced (shifted by `offset`)."""
+    level = model.load(text)
+    solver.solve_complete(level, cancelled)
+    ox, oy = offset
+    return [(cell.coord.x+ox, cell.coord.y+oy) for cell in level.all_cells if cell.display is model.Cell.unknown]
+
+def find_unneeded_hints(cancelled, text, offset):
+    """Find which hints can be removed from the level, so that it can still be solved without guessing.
+    Return the removed hints as (coordinates shifted by `offset`, kind of hint)
+    and the number of hints that are left; or None if the level can't be solved to begin with."""
+    level = model.load(text)
+    before = minimize.all_hints(level)
+    essential = minimize.minimize(level, cancelled)
+    if essential is None:
+        return None
+    ox, oy = offset
+    removed = minimize.removed_hints(before, minimize.all_hints(level))
+    return [((it.coord.x+ox, it.coord.y+oy), kind) for it, kind in removed], len(minimize.all_hints(level))
+
+
 def main(f=None):
     global window
 
@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014-2016 Oleh Prypin <blaxpirit@gmail.com>
+# 
+# This file is part of SixCells.
+# 
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Generate random levels that can be solved completely without guessing"""
+
+from __future__ import division, print_function
+
+import sys
+import random
+import argparse
+import itertools
+import timeit
+
+import model
+from model import Cell, Column, Level
+import solver
+import batch
+
+
+# The line of cells that a column at the given angle points along:
+# angle -> (step from a cell to the next one, function that gives the same value for all cells of a line)
+_lines = {
+    -60: ((1, 1), lambda x, y: x-y),
+    0: ((0, 1), lambda x, y: x),
+    60: ((-1, 1), lambda x, y: x+y),
+}
+
+class Options(object):
+    "What the generated levels look like"
+    def __init__(self, width=15, height=12, density=0.4, fill=0.85,
+                 numbers=0.85, flowers=0.15, columns=0.4, together=0.3, revealed=0.25, hardest='global', tries=10):
+        # Size of the board: columns of cells and cells in a column
+        self.width, self.height = width, height
+        # Fraction of the board's places that have cells, and fraction of the cells that are blue
+        self.fill, self.density = fill, density
+        # Fraction of the black cells that show a number, of the blue cells that show one,
+        # of the lines of cells that get a column number, and of the numbers that also show {n} or -n-
+        self.numbers, self.flowers, self.columns, self.together = numbers, flowers, columns, together
+        # A level is thrown away if more than this fraction of its cells has to be revealed at the start
+        self.revealed = revealed
+        # The hardest kind of deduction that solving may need (see solver.rating_tiers)
+        self.hardest = hardest
+        # Cells tried as a reveal until one of them leads to a deduction
+        self.tries = tries
+
+def _layout(rnd, options):
+    "Make a random level with all its information, but nothing revealed"
+    level = Level()
+    for x in range(options.width):
+        for y in range(options.height):
+            if rnd.random() < options.fill:
+                kind = Cell.full if rnd.random() < options.density else Cell.empty
+                show_info = 0
+                if rnd.random() < (options.flowers if kind is Cell.full else options.numbers):
+                    show_info = 1
+                # Cells are in every other row; every other column is shifted down by one
+                level.place(Cell(kind, show_info), (x+1, y*2 + x%2 + 2))
+
+    for angle, ((dx, dy), line_of) in sorted(_lines.items()):
+        first = {}
+        for (x, y) in sorted(level.grid, key=lambda coord: coord[1]):
+            if isinstance(level.grid[x, y], Cell):
+                first.setdefault(line_of(x, y), (x, y))
+        for line, (x, y) in sorted(first.items()):
+            coord = (x-dx, y-dy)
+            if coord not in level.grid and rnd.random() < options.columns:
+                level.place(Column(angle), coord)
+
+    # {n} and -n- say something only about 2 or more blue cells (and, around a cell, not too many)
+    for it in level.all(Column):
+        if it.value >= 2 and rnd.random() < options.together:
+            it.show_info = True
+    for it in level.all_cells:
+        if it.show_info and it.kind is Cell.empty and 2 <= it.value <= 4 and rnd.random() < options.together:
+            it.show_info = 2
+    level.prepare()
+    return level
+
+def _reveal(level, steps, rnd, tries):
+    """Reveal a covered cell at the start of the level. Cells are tried in random order
+    until revealing one of them lets propagation find something.
+    Return what propagation found."""
+    covered = [cell for cell in level.all_cells if cell.display is Cell.unknown]
+    rnd.shuffle(covered)
+    for i, cell in enumerate(covered[:tries]):
+        cell.revealed = True
+        steps.display(cell, cell.kind)
+        found = steps.session.propagate()
+        if found or i == min(tries, len(covered))-1:
+            return found
+        # Taken back; the session forgets what followed from it
+        cell.revealed = False
+        steps.display(cell, Cell.unknown)
+    return []
+
+def generate(seed, options):
+    """Make a level from the seed, choosing which cells to reveal at the start
+    so that everything else can be deduced.
+    Return the level (with nothing but the revealed cells displayed),
+    or None if it needs too many revealed cells."""
+    rnd = random.Random(seed)
+    level = _layout(rnd, options)
+    level.title = "Generated {}".format(seed)
+    cells = level.all_cells
+    if not cells:
+        return None
+    limit = options.revealed * len(cells)
+
+    # Solve it, and whenever that gets stuck, reveal a cell.
+    # The same solver session goes on after every reveal, so nothing is solved twice.
+    # Revealing cells only adds information, so what was deduced before
+    # can still be deduced when they're revealed from the start.
+    tiers = list(solver.rating_tiers)
+    tiers = tiers[:tiers.index(options.hardest)+1]
+    if 'global' in tiers:
+        # It finds everything that pairs would, and looking at the pairs first takes longer than it saves
+        tiers.remove('pair')
+    steps = solver.StepSolver(level, tiers)
+    revealed = 0
+    while True:
+        tier, found = steps.step()
+        if not found:
+            if all(cell.display is not Cell.unknown for cell in cells):
+                break
+            revealed += 1
+            if revealed > limit:
+                return None
+            found = _reveal(level, steps, rnd, options.tries)
+        for cell, kind in found:
+            steps.display(cell, kind)
+
+    level.prepare()
+    return level
+
+def generate_level(job):
+    "Return (seed, level text or None)"
+    seed, options = job
+    level = generate(seed, options)
+    if level is None:
+        return seed, None
+    text, warning = model.save(level)
+    return seed, text
+
+
+def size(s):
+    try:
+        width, height = (int(n) for n in s.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected WIDTHxHEIGHT, e.g. 15x12")
+    # Hexcells levels are at most 33 by 33, with room left for the column numbers
+    if not (1 <= width <= 31 and 1 <= height <= 14):
+        raise argparse.ArgumentTypeError("the size can be at most 31x14")
+    return width, height
+
+def fraction(s):
+    value = float(s)
+    if not 0 <= value <= 1:
+        raise argparse.ArgumentTypeError("expected a number between 0 and 1")
+    return value
+
+def main(args=None):
+    defaults = Options()
+    parser = argparse.ArgumentParser(description="Generate random levels that can be solved completely "
+        "from the cells revealed at the start, without guessing, and write them as one level pack.")
+    parser.add_argument('count', type=int, nargs='?', default=1,
+        help="number of levels to generate (default: 1)")
+    parser.add_argument('--size', type=size, default=(defaults.width, defaults.height), metavar='WxH',
+        help="columns of cells and cells in each column (default: {}x{})".format(defaults.width, defaults.height))
+    for name, help in [
+        ('density', "fraction of the cells that are blue"),
+        ('fill', "fraction of the board that has cells"),
+        ('numbers', "fraction of the black cells that show a number"),
+        ('flowers', "fraction of the blue cells that show a number"),
+        ('columns', "fraction of the lines of cells that get a column number"),
+        ('together', "fraction of the numbers (of 2 or more) that also show {n} or -n-"),
+        ('revealed', "throw away levels where more than this fraction of cells has to be revealed at the start"),
+    ]:
+        parser.add_argument('--'+name, type=fraction, default=getattr(defaults, name),
+            help="{} (default: {})".format(help, getattr(defaults, name)))
+    parser.add_argument('--hardest', choices=list(solver.rating_tiers), default=defaults.hardest,
+        help="the hardest kind of deduction that solving the levels may need, see batch.py --rate "
+        "(default: {}; the others are much faster)".format(defaults.hardest))
+    parser.add_argument('--seed', type=int, default=None,
+        help="seed of the first level, the next ones get the following numbers (default: random)")
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('-o', '--output', metavar='FILE',
+        help="write the levels into this file instead of standard output")
+    parser.add_argument('-s', '--solver', choices=list(solver.backends),
+        help="MILP solver to use (default: the first available one of these)")
+    args = parser.parse_args(args)
+    if args.solver:
+        try:
+            solver.set_solver(args.solver)
+        except ValueError as e:
+            parser.error(str(e))
+
+    options = Options(
+        args.size[0], args.size[1], args.density, args.fill,
+        args.numbers, args.flowers, args.columns, args.together, args.revealed, args.hardest,
+    )
+    seeds = itertools.count(random.randrange(10**9) if args.seed is None else args.seed)
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    start = timeit.default_timer()
+    made = tried = 0
+    try:
+        threads = None if args.jobs == 1 else 1
+        # Seeds are handed out in rounds, as many as levels are still missing
+        while made < args.count:
+            jobs = [(next(seeds), options) for i in range(args.count - made)]
+            for seed, text in batch.run(jobs, generate_level, args.jobs, batch.init_worker, (args.solver, threads)):
+                tried += 1
+                if text is not None and made < args.count:
+                    made += 1
+                    out.write(text + '\n')
+                    out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    elapsed = timeit.default_timer() - start
+    print("{} levels generated in {:.2f} s ({:.1f} per second), {} thrown away".format(
+        made, elapsed, made/elapsed if elapsed else 0, tried - made
+    ), file=sys.stderr)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+# Copyright (C) 2014-2016 Oleh Prypin <blaxpirit@gmail.com>
+# 
+# This file is part of SixCells.
+# 
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Remove the hints of levels that aren't needed to solve them"""
+
+from __future__ import division, print_function
+
+import sys
+import argparse
+import collections
+import timeit
+
+import model
+from model import Cell, Column
+import solver
+import batch
+
+
+# Kinds of hints, in the order they're tried for the same item:
+# a number (with its {n} or -n-, if any), a column (with its {n} or -n-),
+# and just the {n} or -n- of a number or a column
+def all_hints(level):
+    "List (item, kind of hint) for every hint of the level"
+    result = []
+    for it in level.all_cells:
+        if it.show_info:
+            result.append((it, 'number'))
+            if it.show_info == 2:
+                result.append((it, 'together'))
+    for it in level.all_columns:
+        result.append((it, 'column'))
+        if it.show_info:
+            result.append((it, 'together'))
+    return result
+
+def _remove(level, item, kind):
+    "Remove the hint; return a function that puts it back"
+    if kind == 'column':
+        coord = item.coord
+        level.remove(item)
+        return lambda: level.place(item, coord)
+    show_info = item.show_info
+    item.show_info = 0 if kind == 'number' else 1 if isinstance(item, Cell) else False
+    def restore():
+        item.show_info = show_info
+    return restore
+
+def removed_hints(before, after):
+    """The hints that are in the first list of hints (see `all_hints`) but not in the second,
+    except the {n} or -n- of a number or column that is removed anyway"""
+    after = set(after)
+    gone = {item for item, kind in before if kind != 'together' and (item, kind) not in after}
+    return [(item, kind) for item, kind in before if (item, kind) not in after and not (kind == 'together' and item in gone)]
+
+def describe(item, kind):
+    x, y = item.coord
+    what = {'number': "number", 'column': "column", 'together': "{n}/-n- of"}[kind]
+    if kind == 'together':
+        what += " column" if isinstance(item, Column) else " number"
+    return "{} at ({}, {})".format(what, x, y)
+
+def _solve(level, prefix, component_cache):
+    """Solve the level from the start, displaying the cells of the steps in `prefix` first.
+    The parts of the level that are the same as in an earlier try aren't solved again,
+    they're in `component_cache` (see solver.Session).
+    Return a list of steps, each of them a list of the cells found in it
+    (the first one is the revealed cells), or None if the level can't be solved completely."""
+    level.prepare()
+    level.session = solver.Session(level, component_cache)
+    steps = [[cell for cell in level.all_cells if cell.revealed]]
+    for step in prefix:
+        for cell in step:
+            cell.display = cell.kind
+        steps.append(step)
+    solver.solve_complete(level, callback=lambda found, profile: steps.append([cell for cell, kind in found]))
+    if level.remaining or any(cell.display is Cell.unknown for cell in level.all_cells):
+        return None
+    return steps
+
+def minimize(level, cancelled=None):
+    """Remove the hints of the level one by one, keeping each removal only if the level
+    can still be solved completely. Return the list of hints that turned out to be essential
+    (see `all_hints`), or None if the level can't be solved completely to begin with.
+    The level is left with only its revealed cells displayed.
+    If `cancelled` (a threading.Event) is given, no more hints are tried after it's set."""
+    component_cache = solver.DeductionCache(size=10000)
+    steps = _solve(level, [], component_cache)
+    if steps is None:
+        level.prepare()
+        return None
+
+    # The information of a cell is used only after the step that found the cell, so the steps until then
+    # are the same without it. Checking without a hint goes on from there: the hints that are used
+    # last are tried first, when there's most to skip. Columns are used from the start.
+    # Taking a hint away never makes another one unnecessary, so one pass is enough.
+    def step_of(steps):
+        return {cell: i for i, step in enumerate(steps) for cell in step}
+    found_in = step_of(steps)
+    hints = all_hints(level)
+    hints.sort(key=lambda hint: -found_in.get(hint[0], 0))
+    essential = []
+    removed = set()
+    for item, kind in hints:
+        if cancelled is not None and cancelled.is_set():
+            break
+        if item in removed:
+            # The column is gone along with its {n} or -n-, or the number along with its {n} or -n-
+            continue
+        restore = _remove(level, item, kind)
+        prefix = steps[1:found_in.get(item, 0)+1]
+        result = _solve(level, prefix, component_cache)
+        if result is None:
+            restore()
+            essential.append((item, kind))
+        else:
+            steps = result
+            found_in = step_of(steps)
+            if kind != 'together':
+                removed.add(item)
+    level.prepare()
+    return essential
+
+def minimize_level(job):
+    fn, index, text = job
+    result = collections.OrderedDict([('file', fn), ('index', index)])
+    start = timeit.default_timer()
+    try:
+        level = model.load(text)
+    except ValueError as e:
+        result['error'] = str(e)
+        return result
+    result['title'] = level.title
+    hints = len(all_hints(level))
+    essential = minimize(level)
+    if essential is None:
+        result['error'] = "The level can't be solved completely"
+        return result
+    result['hints'] = hints
+    result['removed'] = hints - len(all_hints(level))
+    result['essential'] = [describe(*hint) for hint in essential]
+    result['level'], warning = model.save(level)
+    result['time'] = round(timeit.default_timer() - start, 3)
+    return result
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Remove the numbers, columns and {n}/-n- markers of levels "
+        "that aren't needed to solve them completely, and report which of the remaining hints are essential. "
+        "The levels must be solvable completely to begin with.")
+    parser.add_argument('paths', metavar='PATH', nargs='+',
+        help="a .hexcells file (may contain multiple levels), a directory of them or a glob pattern")
+    parser.add_argument('-o', '--output', metavar='FILE',
+        help="write the minimized levels into this file instead of standard output")
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+        help="number of worker processes (default: number of CPUs)")
+    parser.add_argument('-s', '--solver', choices=list(solver.backends),
+        help="MILP solver to use (default: the first available one of these)")
+    parser.add_argument('-q', '--quiet', action='store_true',
+        help="don't list the essential hints")
+    args = parser.parse_args(args)
+    if args.solver:
+        try:
+            solver.set_solver(args.solver)
+        except ValueError as e:
+            parser.error(str(e))
+
+    out = open(args.output, 'w') if args.output else sys.stdout
+    failed = 0
+    try:
+        threads = None if args.jobs == 1 else 1
+        jobs = batch.find_levels(args.paths)
+        for result in batch.run(jobs, minimize_level, args.jobs, batch.init_worker, (args.solver, threads)):
+            name = "{} #{} ({})".format(result['file'], result['index']+1, result.get('title', ''))
+            if 'error' in result:
+                failed += 1
+                print("{}: {}".format(name, result['error']), file=sys.stderr)
+                continue
+            out.write(result['level'] + '\n')
+            out.flush()
+            print("{}: removed {} of {} hints in {:.2f} s".format(
+                name, result['removed'], result['hints'], result['time']
+            ), file=sys.stderr)
+            if not args.quiet:
+                for hint in result['essential']:
+                    print("  essential: " + hint, file=sys.stderr)
+    finally:
+        if out is not sys.stdout:
+            out.close()
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,832 @@
+# Copyright (C) 2014-2016 Oleh Prypin <blaxpirit@gmail.com>
+# 
+# This file is part of SixCells.
+# 
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""Headless model of a Hexcells level.
+The solver and the level files work with it directly; the Qt scene is just a view over it."""
+
+from __future__ import division, print_function
+
+import itertools
+import collections
+import mmap
+import struct
+
+from util import *
+
+
+
+_flower_deltas = [ # order: (clockwise, closest) starting from north
+    ( 0, -2), ( 0, -4), ( 1, -3),
+    ( 1, -1), ( 2, -2), ( 2,  0),
+    ( 1,  1), ( 2,  2), ( 1,  3),
+    ( 0,  2), ( 0,  4), (-1,  3),
+    (-1,  1), (-2,  2), (-2,  0),
+    (-1, -1), (-2, -2), (-1, -3),
+]
+_neighbors_deltas = _flower_deltas[::3] # order: clockwise starting from north
+_columns_deltas = _neighbors_deltas[-1], _neighbors_deltas[0], _neighbors_deltas[1]
+
+_col_angle_deltas = {-60: (1, 1), 0: (0, 1), 60: (-1, 1)}
+# Which line of cells an item at (x, y) is on, for each direction of columns
+_line_keys = {-60: lambda x, y: x-y, 0: lambda x, y: x, 60: lambda x, y: x+y}
+
+def _line_of(angle, coord):
+    return angle, _line_keys[angle](*coord)
+
+# The places whose adjacency can change when something is put at (0, 0) or taken from there
+_around_deltas = [(0, 0)] + _flower_deltas
+
+
+class layout_property(object):
+    """Attribute that is calculated and stored upon first access,
+    and forgotten as soon as anything changes in the level."""
+    def __init__(self, fget):
+        self.__doc__ = fget.__doc__
+        self.fget = fget
+        self.attr = fget.__name__
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+        generation = obj._layout_generation()
+        if obj._generation != generation:
+            obj._cache = {}
+            obj._generation = generation
+        try:
+            return obj._cache[self.attr]
+        except KeyError:
+            value = obj._cache[self.attr] = self.fget(obj)
+            return value
+
+
+class Item(object):
+    __slots__ = ['level', 'coord', 'id', '_show_info', '_cache', '_generation']
+
+    def __init__(self, show_info):
+        self.level = None
+        self.coord = None
+        self._show_info = show_info
+        self._cache = {}
+        self._generation = None
+
+    def _layout_generation(self):
+        if self.level is not None:
+            return self.level.generation
+
+    def changed(self):
+        "Forget everything that was derived from this item"
+        self._cache = {}
+        if self.level is not None:
+            self.level.changed()
+
+    @property
+    def show_info(self):
+        return self._show_info
+    @show_info.setter
+    def show_info(self, value):
+        self._show_info = value
+        self.changed()
+
+    @property
+    def placed(self):
+        return self.level is not None
+
+    def _find_neighbors(self, deltas, cls):
+        if self.level is None:
+            return
+        x, y = self.coord
+        grid = self.level.grid
+        for dx, dy in deltas:
+            it = grid.get((x + dx, y + dy))
+            if isinstance(it, cls):
+                yield it
+
+
+class Cell(Item):
+    "Hexagonal cell"
+    __slots__ = ['_kind', '_display', 'revealed', '_adjacent']
+
+    unknown = Entity('Cell.unknown')
+    empty = Entity('Cell.empty')
+    full = Entity('Cell.full')
+
+    def __init__(self, kind=unknown, show_info=0, revealed=False):
+        Item.__init__(self, show_info)
+        self._kind = kind
+        self._display = Cell.unknown
+        self.revealed = revealed
+        # (neighbors, flower neighbors, columns), kept by the level until something is placed near
+        self._adjacent = None
+
+    @property
+    def kind(self):
+        return self._kind
+    @kind.setter
+    def kind(self, value):
+        self._kind = value
+        self.changed()
+
+    @property
+    def display(self):
+        return self._display
+    @display.setter
+    def display(self, value):
+        if self.level is not None:
+            if self._display is not Cell.full and value is Cell.full:
+                self.level.remaining -= 1
+            if self._display is Cell.full and value is not Cell.full:
+                self.level.remaining += 1
+        self._display = value
+        if self.level is not None and self.level.session is not None:
+            self.level.session.update(self)
+
+    def _adjacency(self):
+        if self._adjacent is None:
+            columns = []
+            for col in self._find_neighbors(_columns_deltas, Column):
+                sgn = col.angle//60
+                if sgn == col.coord.x-self.coord.x:
+                    columns.append(col)
+            self._adjacent = (
+                list(self._find_neighbors(_neighbors_deltas, Cell)),
+                list(self._find_neighbors(_flower_deltas, Cell)),
+                columns,
+            )
+        return self._adjacent
+
+    @property
+    def neighbors(self):
+        return self._adjacency()[0]
+    @property
+    def flower_neighbors(self):
+        return self._adjacency()[1]
+    @property
+    def columns(self):
+        return self._adjacency()[2]
+
+    @layout_property
+    def members(self):
+        if self.show_info:
+            if self.kind is Cell.empty:
+                return self.neighbors
+            if self.kind is Cell.full:
+                return self.flower_neighbors
+
+    def is_neighbor(self, other):
+        return other in self.neighbors
+
+    @layout_property
+    def value(self):
+        if self.show_info:
+            return sum(1 for it in self.members if it.kind is Cell.full)
+
+    @layout_property
+    def together(self):
+        if self.show_info == 2:
+            full_items = {it for it in self.members if it.kind is Cell.full}
+            return all_grouped(full_items, key=Cell.is_neighbor)
+
+    def __repr__(self):
+        r = [self.display]
+        if self.display is not self.kind:
+            r.append('({})'.format(repr(self.kind).split('.')[1]))
+        if self.coord is not None:
+            r.append(tuple(self.coord))
+        return '<{}>'.format(' '.join(str(p) for p in r))
+
+
+class Column(Item):
+    "Column number marker"
+    __slots__ = ['_angle', '_members']
+
+    def __init__(self, angle=0, show_info=False):
+        Item.__init__(self, show_info)
+        # Kept by the level until a cell is put on the column's line or taken from it
+        self._members = None
+        self.angle = angle
+
+    @property
+    def angle(self):
+        return self._angle
+    @angle.setter
+    def angle(self, value):
+        if value not in (-60, 0, 60):
+            raise ValueError(value)
+        level = self.level
+        if level is not None:
+            level._unindex(self)
+        self._angle = value
+        if level is not None:
+            level._index(self)
+        self.changed()
+
+    @property
+    def cell(self):
+        return self.members[0]
+
+    @property
+    def members(self):
+        if self.level is None:
+            return
+        if self._members is None:
+            # All the cells of the line after the column
+            cells = self.level._lines.get(_line_of(self.angle, self.coord), {})
+            self._members = [cells[y] for y in sorted(cells) if y > self.coord.y]
+        return self._members
+
+    @layout_property
+    def value(self):
+        return sum(1 for it in self.members if it.kind is Cell.full)
+
+    @layout_property
+    def together(self):
+        if self.show_info:
+            groups = itertools.groupby(self.members, key=lambda it: it.kind is Cell.full)
+            return sum(1 for full, _ in groups if full) <= 1
+
+    def __repr__(self):
+        return '<Column {} {}>'.format(self.angle, tuple(self.coord) if self.coord is not None else '')
+
+
+class Level(object):
+    "All the items of a level, indexed by their coordinates, and the information about the level"
+    def __init__(self):
+        self.title = self.author = self.information = ''
+        self.grid = dict()
+        self.remaining = 0
+        # The solver's session, which follows the displayed cells
+        self.session = None
+        self.generation = 0
+        self._cache = {}
+        self._generation = None
+        self._clear_index()
+
+    def _layout_generation(self):
+        return self.generation
+
+    def changed(self):
+        self.generation += 1
+
+    def _clear_index(self):
+        # (angle, line) -> {y: cell} for every line of cells in each direction of columns
+        self._lines = {}
+        # (angle, line) -> the columns at that angle on that line
+        self._line_columns = {}
+        # min_x, min_y, max_x, max_y of the items, None if there are none, or False if not known
+        self._bounds = None
+
+    def _index(self, item):
+        "Add an item that was just put at its coordinates to the indexes"
+        x, y = item.coord
+        self._forget_adjacency(item.coord)
+        if isinstance(item, Cell):
+            for angle in _line_keys:
+                line = _line_of(angle, item.coord)
+                self._lines.setdefault(line, {})[y] = item
+                for col in self._line_columns.get(line, ()):
+                    col._members = None
+        else:
+            self._line_columns.setdefault(_line_of(item.angle, item.coord), set()).add(item)
+            item._members = None
+        bounds = self._bounds
+        if bounds is None:
+            self._bounds = (x, y, x, y)
+        elif bounds:
+            min_x, min_y, max_x, max_y = bounds
+            self._bounds = (min(min_x, x), min(min_y, y), max(max_x, x), max(max_y, y))
+
+    def _unindex(self, item):
+        "Take an item that is at its coordinates, or was until now, out of the indexes"
+        x, y = item.coord
+        self._forget_adjacency(item.coord)
+        if isinstance(item, Cell):
+            item._adjacent = None
+            for angle in _line_keys:
+                line = _line_of(angle, item.coord)
+                cells = self._lines.get(line)
+                if cells and cells.get(y) is item:
+                    del cells[y]
+                    for col in self._line_columns.get(line, ()):
+                        col._members = None
+        else:
+            self._line_columns.get(_line_of(item.angle, item.coord), set()).discard(item)
+            item._members = None
+        if self._bounds:
+            min_x, min_y, max_x, max_y = self._bounds
+            if x in (min_x, max_x) or y in (min_y, max_y):
+                self._bounds = False
+
+    def columns_through(self, coord):
+        "The columns that have a cell at these coordinates among their members, or would have"
+        x, y = coord
+        return [
+            col for angle in _line_keys for col in self._line_columns.get(_line_of(angle, coord), ())
+            if col.coord.y < y
+        ]
+
+    def _forget_adjacency(self, coord):
+        "Forget what the cells at these coordinates and around them are next to"
+        x, y = coord
+        grid = self.grid
+        for dx, dy in _around_deltas:
+            it = grid.get((x + dx, y + dy))
+            if isinstance(it, Cell):
+                it._adjacent = None
+
+    def place(self, item, coord):
+        "Put the item at the specified coordinates, taking it from its previous place, if any"
+        if item.level is not None:
+            item.level.remove(item)
+        item.coord = Point(*coord)
+        item.level = self
+        self.grid[item.coord] = item
+        self._index(item)
+        self.changed()
+
+    def place_all(self, items):
+        """Put new items (that aren't in a level) at their coordinates: pairs of (item, coord).
+        Unlike placing them one by one, everything derived from the level is forgotten only once."""
+        grid = self.grid
+        for item, coord in items:
+            item.coord = coord = Point(*coord)
+            item.level = self
+            old = grid.get(coord)
+            if old is not None:
+                self._unindex(old)
+                old.level = None
+            grid[coord] = item
+            self._index(item)
+        self.changed()
+
+    def remove(self, item):
+        if item.level is not self:
+            return
+        if self.grid.get(item.coord) is item:
+            del self.grid[item.coord]
+        self._unindex(item)
+        item.level = None
+        self.changed()
+
+    def clear(self):
+        for it in list(self.grid.values()):
+            it.level = None
+            if isinstance(it, Cell):
+                it._adjacent = None
+            else:
+                it._members = None
+        self.grid = dict()
+        self._clear_index()
+        self.session = None
+        self.changed()
+
+    def all(self, types=(Cell, Column)):
+        return (it for it in self.grid.values() if isinstance(it, types))
+
+    @layout_property
+    def all_cells(self):
+        return list(self.all(Cell))
+
+    @layout_property
+    def all_columns(self):
+        return list(self.all(Column))
+
+    @property
+    def bounds(self):
+        "(min_x, min_y, max_x, max_y) of all the items, or None if there are none"
+        if self._bounds is False:
+            # Only taking an item from the edge makes them unknown
+            if self.grid:
+                min_x, max_x = minmax([x for x, y in self.grid])
+                min_y, max_y = minmax([y for x, y in self.grid])
+                self._bounds = (min_x, min_y, max_x, max_y)
+            else:
+                self._bounds = None
+        return self._bounds
+
+    def contains(self, x, y):
+        "Are these coordinates within the bounds of the level?"
+        bounds = self.bounds
+        if bounds is None:
+            return False
+        min_x, min_y, max_x, max_y = bounds
+        return min_x <= x <= max_x and min_y <= y <= max_y
+
+    def prepare(self):
+        """Cover all the cells that are not revealed and number the items,
+        as they are at the start of the game."""
+        remaining = 0
+        for i, cell in enumerate(self.all_cells):
+            cell.id = i
+            if cell.kind is Cell.full and not cell.revealed:
+                remaining += 1
+            cell._display = cell.kind if cell.revealed else Cell.unknown
+        for i, col in enumerate(self.all_columns):
+            col.id = i
+        self.remaining = remaining
+        self.session = None
+
+
+
+hexcells_ui_area = [
+    '     *************************   ',
+    '     *#######################*   ',
+    '    *########################*   ',
+    '    *########################*   ',
+    '   *#########################*   ',
+    '   ##########################*   ',
+    '  *##########################****',
+    ' *###############################',
+    ' *###############################',
+    '*################################',
+    '*################################'
+] + [
+    '#'*33
+]*22
+
+level_center = (16, 16)
+
+# How bad it is for an item to be over a place of hexcells_ui_area: '#' is free, '*' is at the edge of the UI.
+# In thousandths, so that the sums are exact
+_ui_penalties = {Cell: {'*': 900, ' ': 1000}, Column: {'*': 1, ' ': 850}}
+
+def _area_mask(rows, c):
+    "A number with bit y*64+x set if the character at x in row y is c"
+    return sum(1 << (y*64 + x) for y, row in enumerate(rows) for x, char in enumerate(row) if char == c)
+
+def save(level, display=False, padding=True):
+    ret = None
+
+    grid = level.grid
+    all_cells = [(x, y) for (x, y), it in grid.items() if isinstance(it, Cell)]
+    min_x, min_y, max_x, max_y = level.bounds or (0, 0, 0, 0)
+    if padding:
+        mid_x, mid_y = (min_x + max_x)//2, (min_y + max_y)//2
+        max_tx = max_ty = 32
+
+        if max_x - min_x > max_tx:
+            ret = "This level is too wide to fit into Hexcells format."
+        if max_y - min_y > max_tx:
+            ret = "This level is too high to fit into Hexcells format."
+        if ret:
+            ret += '\n' + "The data will be malformed, but still readable by SixCells."
+            max_tx = max_x - min_x
+            max_ty = max_y - min_y
+
+        mid_t = (0 + max_tx)//2, (0 + max_ty)//2
+        mid_d = mid_t[0] - mid_x, mid_t[1] - mid_y
+
+        ui_area = list(hexcells_ui_area)
+        d = len(level.information.splitlines())*2 - 2
+        if d > 0:
+            ui_area[-d:] = [' '*33]*d
+
+        # The places of the UI and the items of each kind, as bits of one number, a row every 64 bits
+        # (bit 0 being (min_x, min_y) for the items): what they overlap at an offset is counted
+        # with a shift, an `and` and a popcount
+        items = {Cell: 0, Column: 0}
+        for (x, y), it in grid.items():
+            items[Cell if isinstance(it, Cell) else Column] |= 1 << ((y - min_y)*64 + x - min_x)
+        ui_masks = {c: _area_mask(ui_area, c) for c in '* '}
+        # The sum of squared distances of the cells from mid_t, for any offset, from sums over the cells
+        n = len(all_cells)
+        sum_x, sum_xx = sum(x for x, y in all_cells), sum(x*x for x, y in all_cells)
+        sum_y, sum_yy = sum(y for x, y in all_cells), sum(y*y for x, y in all_cells)
+
+        possibilities = []
+        for dy in range(-min_y, -min_y + max_ty - (max_y - min_y) + 1):
+            for dx in range(-min_x, -min_x + max_tx - (max_x - min_x) + 1):
+                overlaps = 0
+                if not ret:
+                    shift = (dy + min_y)*64 + dx + min_x
+                    for kind, bits in items.items():
+                        for c, penalty in _ui_penalties[kind].items():
+                            overlaps += penalty * bin(bits << shift & ui_masks[c]).count('1')
+                ax, ay = dx - mid_t[0], dy - mid_t[1]
+                dist = (
+                    (sum_xx + 2*ax*sum_x + n*ax*ax + sum_yy + 2*ay*sum_y + n*ay*ay)/(n or 1)+
+                    distance(mid_d, (dx, dy), squared=True)/2
+                )
+                possibilities.append((overlaps, dist, (dy, dx)))
+        assert possibilities
+        overlaps, _, (dy, dx) = min(possibilities)
+        global level_center
+        level_center = (16-dx, 16-dy)
+        if overlaps > 800:
+            ret = "This level (barely) fits, but may overlap some UI elements of Hexcells."
+    else:
+        dx, dy = -min_x, -min_y
+        max_tx, max_ty = max_x+dx, max_y+dy
+
+    result = _text(level, dx, dy, max_tx+1, max_ty+1, display)
+    if padding:
+        return result, ret
+    else:
+        return result
+
+def _text(level, dx, dy, width, height, display=False):
+    "The level in .hexcells format, moved by (dx, dy) onto a grid of the given size"
+    grid = level.grid
+    result = [[['.', '.'] for x in range(width)] for y in range(height)]
+    for (x, y), it in grid.items():
+        r = result[y+dy][x+dx]
+        if isinstance(it, Column):
+            r[0] = {-60: '\\', 0: '|', 60: '/'}[int(it.angle)]
+        else:
+            kind = it.display if display and it.display is not Cell.unknown else it.kind
+            r[0] = 'x' if kind is Cell.full else 'o'
+        if it.value is not None:
+            if it.together is not None:
+                r[1] = 'c' if it.together else 'n'
+            else:
+                r[1] = '+'
+        if isinstance(it, Cell) and (it.revealed or (display and it.display is not Cell.unknown)):
+            r[0] = r[0].upper()
+    result = [''.join(''.join(part) for part in line) for line in result]
+
+    headers = [
+        'Hexcells level v1',
+        level.title,
+        level.author,
+        ('\n' if '\n' not in level.information else '') + level.information,
+    ]
+
+    return '\n'.join(headers + result)
+
+# What `parse` makes of a level: its information, and the items as plain tuples:
+# cells: (coord, kind, show_info, revealed); columns: (coord, angle, show_info)
+LevelData = collections.namedtuple('LevelData', 'title author information cells columns')
+
+_cell_kinds = {'o': Cell.empty, 'O': Cell.empty, 'x': Cell.full, 'X': Cell.full}
+_column_angles = {'\\': -60, '|': 0, '/': 60}
+_grid_kinds = set(_cell_kinds) | set(_column_angles) | {'.'}
+_grid_values = set('.+cn')
+
+def parse(text):
+    """Read a level in the .hexcells format into a LevelData, without making any items.
+    Raise ValueError if it's malformed."""
+    lines = iter(text.strip().splitlines())
+
+    try:
+        header = next(lines).strip()
+        if header != 'Hexcells level v1':
+            raise ValueError("Can read only Hexcells level v1")
+
+        title = next(lines).strip()
+        author = next(lines).strip()
+        information = '\n'.join(line for line in [next(lines).strip(), next(lines).strip()] if line)
+    except StopIteration:
+        raise ValueError("Level data stopped abruptly")
+
+    cells = []
+    columns = []
+    for y, line in enumerate(lines):
+        line = line.strip().replace(' ', '')
+        # Every place is 2 characters: the kind of item and how its number is shown
+        kinds, values = line[0:len(line)//2*2:2], line[1::2]
+        wrong = (set(kinds) - _grid_kinds) | (set(values) - _grid_values)
+        if wrong:
+            raise ValueError("Unexpected character {!r} in line {} of the level".format(min(wrong), y+6))
+        if kinds.count('.') == len(kinds):
+            continue
+        for x, kind in enumerate(kinds):
+            if kind == '.':
+                continue
+            value = values[x]
+            if kind in _column_angles:
+                columns.append(((x, y), _column_angles[kind], value != '+'))
+            else:
+                show_info = 0 if value == '.' else 1 if value == '+' else 2
+                cells.append(((x, y), _cell_kinds[kind], show_info, kind.isupper()))
+
+    return LevelData(title, author, information, cells, columns)
+
+def build(data, level=None):
+    """Make the items of a LevelData and put them into a Level (a new one, if not given).
+    The level is prepared for playing: only the revealed cells are displayed."""
+    if level is None:
+        level = Level()
+    level.title, level.author, level.information = data.title, data.author, data.information
+    level.place_all(
+        [(Cell(kind, show_info, revealed), coord) for coord, kind, show_info, revealed in data.cells] +
+        [(Column(angle, show_info), coord) for coord, angle, show_info in data.columns]
+    )
+    level.prepare()
+    return level
+
+def load(text, level=None):
+    """Read a level in the .hexcells format into a Level (a new one, if not given).
+    The level is prepared for playing: only the revealed cells are displayed."""
+    return build(parse(text), level)
+
+
+class LevelPack(object):
+    """An index of a text that may contain multiple levels in .hexcells format.
+    Only where each level is and its title are kept; a level's text is read when it's asked for.
+    `data` is the UTF-8 encoded text, or anything that can be searched and sliced like it, e.g. an mmap."""
+    header = b'Hexcells level v1'
+
+    def __init__(self, data):
+        self.data = data
+        self.offsets = [] # (start, end) of every level's text
+        self.titles = []
+        find = data.find
+        pos = 0
+        while True:
+            i = find(self.header, pos)
+            if i < 0:
+                break
+            line_start = data.rfind(b'\n', 0, i) + 1
+            line_end = find(b'\n', i)
+            if line_end < 0:
+                line_end = len(data)
+            pos = line_end
+            if data[line_start:line_end].strip() != self.header:
+                continue
+            if self.offsets:
+                self.offsets[-1] = (self.offsets[-1][0], line_start)
+            # The title is on the next line; the 4 lines after the header are never a header
+            title_end = find(b'\n', line_end+1)
+            self.titles.append(data[line_end+1:title_end if title_end >= 0 else len(data)].strip().decode('utf-8'))
+            for _ in range(4):
+                if pos < 0:
+                    break
+                pos = find(b'\n', pos+1)
+            if pos < 0:
+                pos = len(data)
+            self.offsets.append((line_start, len(data)))
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def __getitem__(self, index):
+        "Text of the level at this index"
+        start, end = self.offsets[index]
+        return self.data[start:end].decode('utf-8')
+
+    def parse(self, index):
+        return parse(self[index])
+
+    def level(self, index):
+        return build(self.parse(index))
+
+def split_levels(text):
+    """Split a text that may contain multiple levels in .hexcells format.
+    Return a list of pairs: (level text, level title)."""
+    pack = LevelPack(text.encode('utf-8'))
+    return [(pack[i], title) for i, title in enumerate(pack.titles)]
+
+
+# The packed format: a binary file of many levels, any of which can be read without reading the others.
+# All numbers are little-endian.
+#  - 'HEXPACK1', then the number of levels N (uint32)
+#  - N+1 offsets (uint32) in the metadata block: where each level's metadata starts, and where it ends
+#  - N grid records of the same size: the 33x33 places of the level, row by row,
+#    each one a 5-bit code from `_packed_items`, 8 places in 5 bytes
+#  - the metadata block: title, author and information of every level in UTF-8, separated by newlines
+packed_magic = b'HEXPACK1'
+packed_size = 33
+_packed_record = (packed_size**2 + 7)//8 * 5
+
+_packed_items = [None] + [
+    (Cell, kind, revealed, show_info)
+    for kind in [Cell.empty, Cell.full] for revealed in [False, True] for show_info in [0, 1, 2]
+] + [
+    (Column, angle, show_info)
+    for angle in [-60, 0, 60] for show_info in [False, True]
+]
+_packed_codes = {item: code for code, item in enumerate(_packed_items)}
+
+def _pack_grid(level):
+    codes = [0]*(_packed_record//5*8)
+    for (x, y), it in level.grid.items():
+        if not (0 <= x < packed_size and 0 <= y < packed_size):
+            raise ValueError("This level doesn't fit into {0}x{0} places".format(packed_size))
+        if isinstance(it, Cell):
+            item = (Cell, it.kind, bool(it.revealed), it.show_info)
+        else:
+            item = (Column, int(it.angle), bool(it.show_info))
+        codes[y*packed_size + x] = _packed_codes[item]
+    result = []
+    for i in range(0, len(codes), 8):
+        group = 0
+        for code in reversed(codes[i:i+8]):
+            group = group << 5 | code
+        result.append(struct.pack('<Q', group)[:5])
+    return b''.join(result)
+
+def _unpack_grid(data):
+    "The cells and the columns of a grid record, as in LevelData"
+    cells = []
+    columns = []
+    for i in range(0, _packed_record, 5):
+        group, = struct.unpack('<Q', data[i:i+5] + b'\0\0\0')
+        place = i//5*8
+        while group:
+            code = group & 31
+            if code:
+                if code >= len(_packed_items) or place >= packed_size**2:
+                    raise ValueError("Malformed packed level")
+                item = _packed_items[code]
+                coord = (place % packed_size, place // packed_size)
+                if item[0] is Cell:
+                    _, kind, revealed, show_info = item
+                    cells.append((coord, kind, show_info, revealed))
+                else:
+                    _, angle, show_info = item
+                    columns.append((coord, angle, show_info))
+            group >>= 5
+            place += 1
+    return cells, columns
+
+def save_packed(levels, f):
+    "Write Levels into a binary file object in the packed format; return how many there were"
+    records = []
+    metadata = []
+    offsets = [0]
+    for level in levels:
+        records.append(_pack_grid(level))
+        metadata.append('\n'.join([level.title, level.author, level.information]).encode('utf-8'))
+        offsets.append(offsets[-1] + len(metadata[-1]))
+    f.write(packed_magic + struct.pack('<I', len(records)))
+    f.write(struct.pack('<{}I'.format(len(offsets)), *offsets))
+    for data in records + metadata:
+        f.write(data)
+    return len(records)
+
+class PackedLevels(object):
+    """Levels in the packed format, read from `data` (bytes or anything like them, e.g. an mmap)
+    only when they're asked for. Works like LevelPack."""
+    def __init__(self, data):
+        if data[:len(packed_magic)] != packed_magic:
+            raise ValueError("Not a packed level file")
+        self.data = data
+        try:
+            count, = struct.unpack_from('<I', data, len(packed_magic))
+            table = len(packed_magic) + 4
+            self.offsets = struct.unpack_from('<{}I'.format(count+1), data, table)
+        except struct.error:
+            raise ValueError("Packed level file stopped abruptly")
+        self.records = table + 4*(count+1)
+        self.metadata = self.records + count*_packed_record
+        if len(data) < self.metadata + self.offsets[-1]:
+            raise ValueError("Packed level file stopped abruptly")
+        self.titles = [self._metadata(index)[0] for index in range(count)]
+
+    def _metadata(self, index):
+        start, end = self.offsets[index:index+2]
+        title, author, information = self.data[self.metadata+start:self.metadata+end].decode('utf-8').split('\n', 2)
+        return title, author, information
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def __len__(self):
+        return len(self.titles)
+
+    def __getitem__(self, index):
+        "Text of the level at this index, in .hexcells format"
+        return _text(self.level(index), 0, 0, packed_size, packed_size)
+
+    def parse(self, index):
+        "The level at this index as a LevelData"
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        start = self.records + index*_packed_record
+        cells, columns = _unpack_grid(self.data[start:start+_packed_record])
+        return LevelData(*self._metadata(index) + (cells, columns))
+
+    def level(self, index):
+        "The level at this index, prepared like `load` does"
+        return build(self.parse(index))
+
+def open_pack(fn):
+    """Index a file of levels, in .hexcells or the packed format, without reading all of it into memory.
+    Return a LevelPack or PackedLevels."""
+    with open(fn, 'rb') as f:
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, EnvironmentError): # Empty file, or not a regular file
+            data = f.read()
+    if data[:len(packed_magic)] == packed_magic:
+        return PackedLevels(data)
+    return LevelPack(data)
@@ -23,12 +23,14 @@ from __future__ import division, print_function
 import sys
 import os.path
 import contextlib
+import threading
 try:
     import sqlite3
 except ImportError:
     pass
 
 import common
+import model
 from common import *
 try:
     from solver import *
@@ -37,7 +39,7 @@ except ImportError:
 
 from qt import Signal
 from qt.core import QMargins, QRectF, QTimer
-from qt.gui import QBrush, QIcon, QKeySequence, QPainter, QPen, QPolygonF, QTransform
+from qt.gui import QBrush, QColor, QIcon, QKeySequence, QPainter, QPen, QPolygonF, QTransform
 from qt.widgets import QHBoxLayout, QLabel, QShortcut, QTabBar, QVBoxLayout, QWidget
 
 
@@ -60,7 +62,6 @@ class Cell(common.Cell):
         self.flower = False
         self.hidden = False
         self.guess = None
-        self._display = Cell.unknown
 
     def upd(self, first=False):
         common.Cell.upd(self, first)
@@ -102,19 +103,14 @@ class Cell(common.Cell):
                 self.scene().mistakes += 1
     
     
-    @setter_property
+    @property
+    def display(self):
+        return self.model.display
+    @display.setter
     def display(self, value):
-        rem = 0
-        try:
-            if self.display is not Cell.full and value is Cell.full:
-                rem = -1
-            if self.display is Cell.full and value is not Cell.full:
-                rem = 1
-        except AttributeError:
-            pass
-        yield value
-        if rem and self.placed:
-            self.scene().remaining += rem
+        self.model.display = value
+        if self.placed:
+            self.scene().text_changed.emit() # the number of remaining cells may have changed
         self.guess = None
         self.flower = False
         self.extra_text = ''
@@ -131,9 +127,6 @@ class Cell(common.Cell):
     def hidden(self, value):
         self._text.setOpacity(0.2 if value else 1)
         self.update()
-        
-    def reset_cache(self):
-        pass
 
 
 
@@ -160,9 +153,6 @@ class Column(common.Column):
         elif e.button() == qt.RightButton:
             self.hidden = not self.hidden
             self.beam = False
-
-    def reset_cache(self):
-        pass
     
 
 
@@ -176,8 +166,33 @@ def _flower_poly():
     return result
 _flower_poly = _flower_poly()
 
+def _probability_color(p):
+    "Black if the cell is certainly black, blue if it's certainly blue, and in between"
+    a, b = Color.black, Color.blue
+    return QColor(
+        int(round(a.red() + (b.red()-a.red())*p)),
+        int(round(a.green() + (b.green()-a.green())*p)),
+        int(round(a.blue() + (b.blue()-a.blue())*p)),
+        200
+    )
+
+def _probability_text(p):
+    "A percentage that is 0 or 100 only if the cell is certainly black or blue"
+    if 0 < p < 1:
+        return '{}%'.format(min(99, max(1, int(round(p*100)))))
+    return '{}%'.format(int(p*100))
+
+# A level pack shows tabs only for this many levels around the current one
+max_level_tabs = 50
+
 class Scene(common.Scene):
     text_changed = Signal()
+    # A solver step finished; with the solver's Profile of it
+    solved = Signal(object)
+    # The solver started or stopped
+    solving_changed = Signal(bool)
+    # The solver raised an exception
+    solve_failed = Signal(object)
 
     def __init__(self):
         common.Scene.__init__(self)
@@ -187,12 +202,38 @@ class Scene(common.Scene):
         self.remaining = 0
         self.mistakes = 0
         
-        self.solving = 0
+        # Solves a copy of the level, so nothing here is touched from its thread
+        self.solver = Worker()
+        self.solver_copy = None
+        self.solver.progress.connect(self._solve_progress)
+        self.solver.finished.connect(self._solve_finished)
+        self.solving_complete = False
         
         self.undo_history = []
 
-    @event_property
+        # Cell (of the model) -> how likely it is to be blue, or None if not shown
+        self.probabilities = None
+        # Counts its own copy of the level in the background, like the solver
+        self.counter = Worker()
+        self.counter.finished.connect(self._probabilities_counted)
+        self.counter_copy = None
+        # What was displayed in the copy when it was counted last or is being counted,
+        # so it's not counted again, especially if that took too long
+        self.counted_state = None
+        # They're counted again once the events of a change are processed
+        self.probabilities_timer = QTimer()
+        self.probabilities_timer.setSingleShot(True)
+        self.probabilities_timer.setInterval(0)
+        self.probabilities_timer.timeout.connect(self.update_probabilities)
+        self.text_changed.connect(self.probabilities_changed)
+        self.show_probabilities = False
+
+    @property
     def remaining(self):
+        return self.level.remaining
+    @remaining.setter
+    def remaining(self, value):
+        self.level.remaining = value
         self.text_changed.emit()
 
     @event_property
@@ -202,6 +243,39 @@ class Scene(common.Scene):
     def set_swap_buttons(self, value):
         self.swap_buttons = value
     
+    @event_property
+    def show_probabilities(self):
+        self.update_probabilities()
+
+    def probabilities_changed(self):
+        if self.show_probabilities:
+            self.probabilities_timer.start()
+
+    def update_probabilities(self):
+        """Start counting again in how many of the ways to complete the level each unknown cell is blue,
+        unless nothing changed since the last count.
+        If there are too many to count, nothing is shown."""
+        if self.show_probabilities and solve is not None and self.level.grid:
+            self.counter_copy = copy = LevelCopy.of(self.level, self.counter_copy)
+            displays = copy.displays(self.level)
+            state = (copy, displays)
+            if state == self.counted_state:
+                return
+            self.counted_state = state
+            self.counter.start(count_in_background, copy, displays)
+        else:
+            self.counter.cancel()
+            self.counted_state = None
+        self.probabilities = None
+        self.update()
+
+    def _probabilities_counted(self, result):
+        if isinstance(result, Exception):
+            self.solve_failed.emit(result)
+        elif result is not None:
+            self.probabilities = {self.level.grid[coord]: p for coord, p in result.items()}
+            self.update()
+    
     def drawForeground(self, g, rect):
         g.setBrush(Color.flower)
         g.setPen(no_pen)
@@ -228,65 +302,78 @@ class Scene(common.Scene):
                 poly = poly.intersected(QPolygonF(rect))
                 g.drawConvexPolygon(poly)
 
-    @cached_property
-    def all_cells(self):
-        return list(self.all(Cell))
+        if self.probabilities:
+            cells = [(it, self.probabilities[it.model]) for it in self.all(Cell) if it.model in self.probabilities]
+            g.setPen(no_pen)
+            for it, p in cells:
+                g.setBrush(_probability_color(p))
+                g.drawPolygon(common._cell_inner.translated(it.scenePos()))
+            g.setPen(QPen(Color.light_text))
+            font = g.font()
+            font.setPixelSize(30)
+            g.setFont(font)
+            for it, p in cells:
+                g.save()
+                # The text is laid out at a larger scale, fonts don't work well at the size of a cell
+                g.translate(it.scenePos())
+                g.scale(0.01, 0.01)
+                g.drawText(QRectF(-50, -50, 100, 100), qt.AlignCenter, _probability_text(p))
+                g.restore()
 
-    @cached_property
-    def all_columns(self):
-        return list(self.all(Column))
+    @property
+    def solving(self):
+        return self.solver.running
 
-    def reset_cache(self):
-        for attr in ['all_cells', 'all_columns']:
-            try:
-                delattr(self, attr)
-            except AttributeError: pass
-    
     def solve_step(self):
-        """Derive everything that can be concluded from the current state.
-        Return whether progress has been made."""
+        """Start deriving everything that can be concluded from the current state, in the background.
+        The found cells are shown as guesses."""
+        self._start_solving(False)
+    
+    def solve_complete(self):
+        """Start solving in the background until stuck.
+        The found cells are uncovered as they arrive."""
+        self._start_solving(True)
+
+    def _start_solving(self, complete):
         if self.solving:
             return
-        
         self.confirm_guesses()
-        self.solving += 1
-        app.processEvents()
-        progress = False
+        if not self.level.grid:
+            return
+        self.solver_copy = copy = LevelCopy.of(self.level, self.solver_copy)
+        self.solving_complete = complete
+        self.solver.start(solve_in_background, self.solver.report, copy, copy.displays(self.level), complete)
+        self.solving_changed.emit(True)
+
+    def stop_solving(self):
+        "Cancel the solver; nothing more that it finds is shown"
+        if self.solving:
+            self.solver.cancel()
+            self.solving_changed.emit(False)
+
+    def _solve_progress(self, step):
+        found, profile = step
         undo_step = []
-        for cell, value in solve(self):
+        for coord, value in found:
+            cell = self.grid[coord]
             assert cell.kind is value
-            cell.guess = value
+            if cell.display is not Cell.unknown:
+                continue
+            if self.solving_complete:
+                cell.guess = None
+                cell.display = value
+            else:
+                cell.guess = value
             cell.upd()
-            progress = True
             undo_step.append(cell)
         self.undo_history.append(undo_step)
-        self.solving -= 1
-        
-        return progress
-    
-    def solve_complete(self):
-        """Continue solving until stuck.
-        Return whether the entire level could be uncovered."""
-        self.solving = 1
-        while self.solving:
-            self.confirm_guesses()
-            
-            progress = True
-            while progress:
-                progress = False
-                for cell, value in solve_simple(self):
-                    progress = True
-                    assert cell.kind is value
-                    cell.display = cell.kind
-                    cell.upd()
-            self.solving -= 1
-            if not self.solve_step():
-                break
-            self.solving += 1
-        
-        self.solving = 0
-        # If it identified all blue cells, it'll have the rest uncovered as well
-        return self.remaining == 0
+        if profile is not None:
+            self.solved.emit(profile)
+
+    def _solve_finished(self, result):
+        self.solving_changed.emit(False)
+        if isinstance(result, Exception):
+            self.solve_failed.emit(result)
 
     def clear_guesses(self):
         for cell in self.all(Cell):
@@ -386,6 +473,7 @@ class MainWindow(common.MainWindow):
     title = "SixCells Player"
     Cell = Cell
     Column = Column
+    open_filter = "Hexcells Level (*.hexcells *.hexpack)"
     
     def __init__(self, playtest=False):
         common.MainWindow.__init__(self)
@@ -406,6 +494,7 @@ class MainWindow(common.MainWindow):
         self.levels_bar = QTabBar()
         layout.addWidget(self.levels_bar)
         self.levels_bar.currentChanged.connect(self.level_change)
+        self.pack = None
         
         top_layout = QHBoxLayout()
         layout.addLayout(top_layout)
@@ -435,6 +524,8 @@ class MainWindow(common.MainWindow):
         layout.addWidget(self.information_label)
 
         self.scene.playtest = self.playtest = playtest
+        self.scene.solved.connect(self.show_profile)
+        self.statusBar().hide()
         
         
         menu = self.menuBar().addMenu("&File")
@@ -485,6 +576,21 @@ class MainWindow(common.MainWindow):
         menu.addSeparator()
         
         menu.addAction("&Solve Completely", self.scene.solve_complete)
+        self.stop_solving_action = action = menu.addAction("S&top Solving", self.scene.stop_solving, QKeySequence('Esc'))
+        action.setEnabled(False)
+        self.scene.solving_changed.connect(action.setEnabled)
+        self.scene.solve_failed.connect(self.show_solve_error)
+        
+        menu.addSeparator()
+        
+        self.enable_statusbar_action = action = make_check_action("Show Solver S&tatistics", self, 'statusbar_visible')
+        action.setStatusTip("Show where the time went in the last solver step, in the status bar.")
+        menu.addAction(action)
+        
+        self.show_probabilities_action = action = make_check_action("Show &Probabilities", self, self.scene, 'show_probabilities')
+        action.setStatusTip("Show in how many of the ways to complete the level each cell is blue. "
+            "Nothing is shown while there are too many to count.")
+        menu.addAction(action)
 
         
         menu = self.menuBar().addMenu("&Preferences")
@@ -508,12 +614,22 @@ class MainWindow(common.MainWindow):
     
     config_format = '''
         swap_buttons = swap_buttons_action.isChecked(); swap_buttons_action.setChecked(v)
+        status_bar = enable_statusbar_action.isChecked(); enable_statusbar_action.setChecked(v)
+        probabilities = show_probabilities_action.isChecked(); show_probabilities_action.setChecked(v)
         antialiasing = view.antialiasing; view.antialiasing = v
         last_used_folder
         window_geometry_qt = save_geometry_qt(); restore_geometry_qt(v)
     '''
     
+    def show_profile(self, profile):
+        self.status = str(profile)
+
+    def show_solve_error(self, e):
+        self.statusBar().show()
+        self.status = "Couldn't solve: {}".format(e)
+    
     def close_file(self):
+        self.scene.stop_solving()
         if not self.playtest:
             total = 0
             revealed = 0
@@ -550,7 +666,6 @@ class MainWindow(common.MainWindow):
         self.scene.clear()
         self.scene.remaining = 0
         self.scene.mistakes = 0
-        self.scene.reset_cache()
         for it in [self.title_label, self.author_align_label, self.author_label, self.information_label]:
             it.hide()
         self.copy_action.setEnabled(False)
@@ -574,15 +689,8 @@ class MainWindow(common.MainWindow):
     def prepare(self):
         if not self.playtest:
             self.view.fit()
-        remaining = 0
-        for i, cell in enumerate(self.scene.all(Cell)):
-            cell.id = i
-            if cell.kind is Cell.full and not cell.revealed:
-                remaining += 1
-            cell._display = cell.kind if cell.revealed else Cell.unknown
-        for i, col in enumerate(self.scene.all(Column)):
-            col.id = i
-        self.scene.remaining = remaining
+        self.scene.level.prepare()
+        self.scene.text_changed.emit()
         self.scene.mistakes = 0
         author_text = ("by {}" if self.scene.author else "").format(self.scene.author)
         for txt, it in [
@@ -615,57 +723,151 @@ class MainWindow(common.MainWindow):
             self.view.setFocus()
             return True
     
+    def read_file(self, fn):
+        return model.open_pack(fn)
+
     def load(self, level):
-        while self.levels_bar.count():
-            self.levels_bar.removeTab(0)
-        self.levels_bar.hide()
-        levels = []
-        lines = level.splitlines()
-        start = None
-        skip = 0
-        for i, line in enumerate(lines + [None]):
-            if skip:
-                skip -= 1
-                continue
-            if line is None or line.strip() == 'Hexcells level v1':
-                if start is not None:
-                    level_lines = lines[start:i]
-                    levels.append(('\n'.join(level_lines), level_lines[1]))
-                start = i
-                skip = 4
+        if isinstance(level, basestring):
+            pack = model.LevelPack(level.encode('utf-8'))
+        else:
+            pack = level
+        if len(pack):
+            first = pack[0]
+        else:
+            # Not a level; let it fail with the usual message
+            first = level if isinstance(level, basestring) else pack.data[:].decode('utf-8', 'replace')
+        # The current pack stays if its level isn't closed or the new one can't be loaded
+        if not self.load_one(first):
+            if pack is not self.pack:
+                pack.close()
+            return False
+        if self.pack is not None and self.pack is not pack:
+            self.pack.close()
+        self.pack = pack
         self.current_level = 0
-        if len(levels) > 1:
+        self.first_tab = None
+        if len(pack) > 1:
+            self.update_levels_bar()
             self.levels_bar.show()
-            self.load_one(levels[0][0])
-            for level, title in levels:
-                self.levels_bar.addTab(title)
-                self.levels_bar.setTabData(self.levels_bar.count()-1, level)
         else:
-            self.load_one(level)
-
-    def level_change(self, index):
-        if index >= 0 and index != self.current_level:
-            level = self.levels_bar.tabData(index)
-            if level:
-                if self.load_one(level):
-                    self.current_level = index
-                else:
-                    self.levels_bar.setCurrentIndex(self.current_level)
+            self.clear_levels_bar()
+            self.levels_bar.hide()
+        return True
 
+    def clear_levels_bar(self):
+        self.levels_bar.blockSignals(True)
+        while self.levels_bar.count():
+            self.levels_bar.removeTab(self.levels_bar.count()-1)
+        self.levels_bar.blockSignals(False)
+
+    def update_levels_bar(self):
+        # Only the levels around the current one get a tab, so huge packs don't make huge tab bars
+        first = max(0, min(self.current_level - max_level_tabs//2, len(self.pack) - max_level_tabs))
+        if first != self.first_tab:
+            self.clear_levels_bar()
+            self.levels_bar.blockSignals(True)
+            for index in range(first, min(first + max_level_tabs, len(self.pack))):
+                title = self.pack.titles[index]
+                if first > 0 and index == first or index == first + max_level_tabs - 1 and index < len(self.pack) - 1:
+                    # There are more levels past this tab
+                    title = "... " + title if index == first else title + " ..."
+                self.levels_bar.setTabData(self.levels_bar.addTab(title), index)
+            self.levels_bar.blockSignals(False)
+            self.first_tab = first
+        self.levels_bar.blockSignals(True)
+        self.levels_bar.setCurrentIndex(self.current_level - first)
+        self.levels_bar.blockSignals(False)
+
+    def level_change(self, tab):
+        if tab < 0:
+            return
+        index = self.levels_bar.tabData(tab)
+        if index is not None and index != self.current_level:
+            if self.load_one(self.pack[index]):
+                self.current_level = index
+        self.update_levels_bar()
 
     def closeEvent(self, e):
         if not self.close_file():
             e.ignore()
             return
-        self.scene.solving = 0
 
         save_config_to_file(self, self.config_format, 'sixcells', 'player.cfg')
 
 
 
+class LevelCopy(object):
+    """A copy of a level, starting at the top left, for a Worker to solve in its thread.
+    It's kept while the layout of the level stays the same, and so is its solver session
+    with everything that it remembers. What is displayed in the level is passed to the
+    thread (see `displays`), which shows the same in the copy (see `update`).
+    Only one thread at a time uses the copy, the one that holds `lock`."""
+    def __init__(self, level):
+        grid = level.grid
+        self.generation = level.generation
+        self.offset = (min(x for x, y in grid), min(y for x, y in grid))
+        self.text = model.save(level, display=True, padding=False)
+        self.level = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def of(cls, level, copy):
+        "Return the copy, or a new one if there's none or the layout of the level changed"
+        if copy is None or copy.generation != level.generation:
+            copy = cls(level)
+        return copy
+
+    def displays(self, level):
+        "What is displayed in the (original) level: a list of (coordinate in the copy, kind)"
+        ox, oy = self.offset
+        return [((cell.coord.x-ox, cell.coord.y-oy), cell.display) for cell in level.all_cells]
+
+    def update(self, displays):
+        "Display the same as in the original level, from the thread that holds the lock"
+        if self.level is None:
+            self.level = model.load(self.text)
+        grid = self.level.grid
+        for coord, kind in displays:
+            cell = grid[coord]
+            if cell.display is not kind:
+                cell.display = kind
+
+
+def solve_in_background(cancelled, report, copy, displays, complete):
+    """Solve the copy of the level (see LevelCopy), reporting every step as ([(coordinate, kind)], profile or None),
+    with the coordinates of the original level."""
+    with copy.lock:
+        copy.update(displays)
+        ox, oy = copy.offset
+        def callback(found, profile):
+            report(cancelled, ([((cell.coord.x+ox, cell.coord.y+oy), kind) for cell, kind in found], profile))
+        if complete:
+            solve_complete(copy.level, cancelled, callback)
+        else:
+            session = get_session(copy.level)
+            callback(session.solve(), session.profile)
+
+
+def count_in_background(cancelled, copy, displays):
+    """Count the probabilities of the copy of the level (see LevelCopy and solver.probabilities).
+    Its session is kept, and with it the counts of the parts of the level that didn't change.
+    Return {coordinate: probability} with the coordinates of the original level, or None."""
+    with copy.lock:
+        copy.update(displays)
+        result = probabilities(copy.level)
+    if result is None:
+        return None
+    ox, oy = copy.offset
+    return {(cell.coord.x+ox, cell.coord.y+oy): p for cell, p in result.items()}
+
+
 def main(f=None):
     global window
     
+    if solve is not None:
+        # Remember what the solver found, also between runs of the game
+        deduction_cache.database = lambda: db_connection('sixcells.sqlite3')
+    
     window = MainWindow()
     window.show()
     
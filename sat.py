@@ -0,0 +1,433 @@
+# Copyright (C) 2014-2016 Oleh Prypin <blaxpirit@gmail.com>
+#
+# This file is part of SixCells.
+#
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""A small CDCL SAT solver in pure Python, with cardinality constraints and solving under assumptions"""
+
+from __future__ import division, print_function
+
+import heapq
+
+
+class Cardinality(object):
+    "At least `low` and at most `high` of the literals are true, if the guard is true (or None)"
+    __slots__ = ['lits', 'low', 'high', 'guard', 'true', 'false']
+
+    def __init__(self, lits, low, high, guard):
+        self.lits = lits
+        self.low = low
+        self.high = high
+        self.guard = guard
+        # How many of the literals are assigned true and false
+        self.true = self.false = 0
+
+
+# Kinds of events in `Solver.card_occurs`
+_TRUE, _FALSE, _GUARD = range(3)
+
+
+def luby(i):
+    "The i-th element (from 0) of the Luby sequence: 1 1 2 1 1 2 4 1 1 2 ..."
+    size, power = 1, 0
+    while size < i+1:
+        power += 1
+        size = 2*size + 1
+    while size-1 != i:
+        size = (size-1) // 2
+        power -= 1
+        i = i % size
+    return 2**power
+
+
+class Solver(object):
+    """Variables are numbered from 1. A literal is a variable (meaning it's true) or its negation.
+    Clauses and cardinality constraints can be added between solves,
+    and what was learned in a solve is kept for the next ones.
+    Things that change between solves (e.g. which constraints are active)
+    are best given as assumptions."""
+
+    restart_base = 64
+    # Cardinality constraints with at least this many literals are encoded as clauses
+    totalizer_size = 40
+    var_decay = 0.95
+
+    def __init__(self):
+        self.nvars = 0
+        # Literal -> 1 (true), -1 (false) or 0 (unassigned)
+        self.values = {0: 0}
+        self.levels = [0]
+        # The clause that implied the variable's value (its first literal is the implied one),
+        # None for decisions
+        self.reasons = [None]
+        self.activity = [0.0]
+        self.polarity = [False]
+        # Literal -> clauses where it's one of the first two literals (which are watched)
+        self.watches = {}
+        # Literal -> (cardinality constraint, event) to update when the literal becomes true
+        self.card_occurs = {}
+        self.learnts = []
+        self.new_cards = []
+        self.trail = []
+        self.trail_lim = []
+        self.qhead = 0
+        self.heap = []
+        self.var_inc = 1.0
+        self.ok = True
+        self.conflicts = 0
+        # After a successful solve: the value of every variable (indexed by variable)
+        self.model = None
+
+    def new_var(self):
+        self.nvars += 1
+        v = self.nvars
+        self.values[v] = self.values[-v] = 0
+        self.levels.append(0)
+        self.reasons.append(None)
+        self.activity.append(0.0)
+        self.polarity.append(False)
+        for lit in [v, -v]:
+            self.watches[lit] = []
+            self.card_occurs[lit] = []
+        heapq.heappush(self.heap, (0.0, v))
+        return v
+
+    def value(self, lit):
+        "1 if the literal is true, -1 if false, 0 if unassigned"
+        return self.values[lit]
+
+    def add_clause(self, lits):
+        "At least one of the literals is true. Return False if the solver became unsatisfiable."
+        if not self.ok:
+            return False
+        clause = []
+        for lit in lits:
+            value = self.value(lit)
+            if value > 0 or -lit in clause:
+                # Already satisfied (constraints are only added at level 0)
+                return True
+            if value == 0 and lit not in clause:
+                clause.append(lit)
+        if not clause:
+            self.ok = False
+        elif len(clause) == 1:
+            self._enqueue(clause[0], None)
+        else:
+            self.watches[clause[0]].append(clause)
+            self.watches[clause[1]].append(clause)
+        return self.ok
+
+    def add_cardinality(self, lits, low, high, guard=None):
+        """At least `low` and at most `high` of the literals are true (if the guard literal is true).
+        A literal may be repeated to count it several times."""
+        lits = list(lits)
+        n = len(lits)
+        if n >= self.totalizer_size:
+            # Long constraints explain their propagations with long clauses, which makes learning slow.
+            # Count the true or the false literals, whichever needs the fewer outputs.
+            if max(high+1, low) <= max(n-low+1, n-high):
+                outputs = self._totalizer(lits, high+1)
+            else:
+                outputs = self._totalizer([-lit for lit in lits], n-low+1)
+                low, high = n-high, n-low
+            extra = [-guard] if guard is not None else []
+            if high < len(outputs):
+                self.add_clause([-outputs[high]] + extra)
+            if low > 0:
+                self.add_clause([outputs[low-1]] + extra)
+            return
+        card = Cardinality(lits, low, high, guard)
+        for lit in card.lits:
+            self.card_occurs[lit].append((card, _TRUE))
+            self.card_occurs[-lit].append((card, _FALSE))
+            value = self.value(lit)
+            if value > 0:
+                card.true += 1
+            elif value < 0:
+                card.false += 1
+        if guard is not None:
+            self.card_occurs[guard].append((card, _GUARD))
+        self.new_cards.append(card)
+
+    def _totalizer(self, lits, cap):
+        """Add new variables counting the true literals, at most `cap` of them.
+        Return them: the i-th (from 0) is true if and only if at least i+1 of the literals are true."""
+        if len(lits) == 1:
+            return lits
+        mid = len(lits) // 2
+        a = self._totalizer(lits[:mid], cap)
+        b = self._totalizer(lits[mid:], cap)
+        outputs = [self.new_var() for i in range(min(len(a)+len(b), cap))]
+        m = len(outputs)
+        for i in range(len(a)+1):
+            for j in range(len(b)+1):
+                # i of the left and j of the right are true -> i+j are true
+                if 0 < i+j <= m:
+                    self.add_clause([outputs[i+j-1]] + ([-a[i-1]] if i else []) + ([-b[j-1]] if j else []))
+                # Not i+1 of the left and not j+1 of the right -> not i+j+1
+                if i+j < m:
+                    self.add_clause([-outputs[i+j]] + ([a[i]] if i < len(a) else []) + ([b[j]] if j < len(b) else []))
+        return outputs
+
+    def _enqueue(self, lit, reason):
+        v = abs(lit)
+        self.values[lit] = 1
+        self.values[-lit] = -1
+        self.levels[v] = len(self.trail_lim)
+        self.reasons[v] = reason
+        self.trail.append(lit)
+        # The counts are updated right away, so that undoing them is always symmetric
+        for card, event in self.card_occurs[lit]:
+            if event == _TRUE:
+                card.true += 1
+            elif event == _FALSE:
+                card.false += 1
+
+    def _check(self, card):
+        """Propagate the cardinality constraint.
+        Return a conflicting clause (all its literals are false) or None."""
+        guard = card.guard
+        if guard is not None:
+            if self.values[guard] <= 0:
+                return None
+            extra = [-guard]
+        else:
+            extra = []
+        n = len(card.lits)
+        value = self.values.__getitem__
+        if card.true > card.high:
+            return [-lit for lit in card.lits if value(lit) > 0] + extra
+        if card.false > n - card.low:
+            return [lit for lit in card.lits if value(lit) < 0] + extra
+        if card.true + card.false == n:
+            return None
+        if card.true == card.high:
+            # The rest are false
+            because = [-lit for lit in card.lits if value(lit) > 0] + extra
+            for lit in card.lits:
+                if value(lit) == 0:
+                    self._enqueue(-lit, [-lit] + because)
+        elif card.false == n - card.low:
+            # The rest are true
+            because = [lit for lit in card.lits if value(lit) < 0] + extra
+            for lit in card.lits:
+                if value(lit) == 0:
+                    self._enqueue(lit, [lit] + because)
+        return None
+
+    def _propagate(self):
+        "Return a conflicting clause or None"
+        values = self.values
+        while self.qhead < len(self.trail):
+            p = self.trail[self.qhead]
+            self.qhead += 1
+
+            for card, event in self.card_occurs[p]:
+                conflict = self._check(card)
+                if conflict is not None:
+                    return conflict
+
+            # The clauses watching -p need another literal to watch
+            false_lit = -p
+            watchers = self.watches[false_lit]
+            i = j = 0
+            while i < len(watchers):
+                clause = watchers[i]
+                i += 1
+                if not clause:
+                    # Deleted
+                    continue
+                if clause[0] == false_lit:
+                    clause[0], clause[1] = clause[1], false_lit
+                if values[clause[0]] > 0:
+                    watchers[j] = clause
+                    j += 1
+                    continue
+                for k in range(2, len(clause)):
+                    if values[clause[k]] >= 0:
+                        clause[1], clause[k] = clause[k], false_lit
+                        self.watches[clause[1]].append(clause)
+                        break
+                else:
+                    watchers[j] = clause
+                    j += 1
+                    if values[clause[0]] < 0:
+                        # Conflict: keep the rest of the watchers
+                        while i < len(watchers):
+                            watchers[j] = watchers[i]
+                            i += 1
+                            j += 1
+                        del watchers[j:]
+                        return clause
+                    self._enqueue(clause[0], clause)
+            del watchers[j:]
+        return None
+
+    def _cancel_until(self, level):
+        if len(self.trail_lim) <= level:
+            return
+        start = self.trail_lim[level]
+        for lit in reversed(self.trail[start:]):
+            v = abs(lit)
+            self.values[lit] = self.values[-lit] = 0
+            self.reasons[v] = None
+            self.polarity[v] = lit > 0
+            for card, event in self.card_occurs[lit]:
+                if event == _TRUE:
+                    card.true -= 1
+                elif event == _FALSE:
+                    card.false -= 1
+            heapq.heappush(self.heap, (-self.activity[v], v))
+        del self.trail[start:]
+        del self.trail_lim[level:]
+        self.qhead = len(self.trail)
+
+    def _bump(self, v):
+        self.activity[v] += self.var_inc
+        if self.activity[v] > 1e100:
+            self.activity = [a*1e-100 for a in self.activity]
+            self.var_inc *= 1e-100
+            self.heap = [(-self.activity[u], u) for u in range(1, self.nvars+1) if not self.values[u]]
+            heapq.heapify(self.heap)
+        if not self.values[v]:
+            heapq.heappush(self.heap, (-self.activity[v], v))
+
+    def _analyze(self, conflict):
+        """Find the first unique implication point.
+        Return the learned clause (its first literal is the one to assert) and the level to go back to."""
+        level = len(self.trail_lim)
+        seen = set()
+        learnt = [None]
+        counter = 0
+        clause = conflict
+        p = None
+        index = len(self.trail) - 1
+        while True:
+            for q in (clause if p is None else clause[1:]):
+                v = abs(q)
+                if v not in seen and self.levels[v] > 0:
+                    seen.add(v)
+                    self._bump(v)
+                    if self.levels[v] >= level:
+                        counter += 1
+                    else:
+                        learnt.append(q)
+            while abs(self.trail[index]) not in seen:
+                index -= 1
+            p = self.trail[index]
+            index -= 1
+            clause = self.reasons[abs(p)]
+            counter -= 1
+            if counter == 0:
+                break
+        learnt[0] = -p
+
+        if len(learnt) == 1:
+            return learnt, 0
+        # The literal of the highest level is watched too
+        best = max(range(1, len(learnt)), key=lambda i: self.levels[abs(learnt[i])])
+        learnt[1], learnt[best] = learnt[best], learnt[1]
+        return learnt, self.levels[abs(learnt[1])]
+
+    def _reduce(self):
+        "Forget the longer half of the learned clauses, except the ones that are reasons"
+        self.learnts.sort(key=len)
+        keep = len(self.learnts) // 2
+        for clause in self.learnts[keep:]:
+            if self.reasons[abs(clause[0])] is not clause:
+                # Removed from the watches when they're visited
+                del clause[:]
+        self.learnts = [clause for clause in self.learnts if clause]
+
+    def _pick(self):
+        "Choose an unassigned variable to decide, or return None if there is none"
+        heap = self.heap
+        while heap:
+            _, v = heapq.heappop(heap)
+            if not self.values[v]:
+                return v
+        for v in range(1, self.nvars+1):
+            if not self.values[v]:
+                return v
+        return None
+
+    def solve(self, assumptions=()):
+        """Find an assignment where all the assumptions (literals) are true.
+        Return whether there is one; if so, it's in `model`."""
+        self.model = None
+        if not self.ok:
+            return False
+        self._cancel_until(0)
+        for card in self.new_cards:
+            if self._check(card) is not None:
+                self.ok = False
+                return False
+        self.new_cards = []
+        if self._propagate() is not None:
+            self.ok = False
+            return False
+
+        assumptions = list(assumptions)
+        max_learnts = max(1000, self.nvars)
+        restarts = 0
+        budget = self.restart_base * luby(restarts)
+        while True:
+            conflict = self._propagate()
+            if conflict is not None:
+                self.conflicts += 1
+                budget -= 1
+                if not self.trail_lim:
+                    self.ok = False
+                    return False
+                learnt, level = self._analyze(conflict)
+                self._cancel_until(level)
+                if len(learnt) == 1:
+                    self._enqueue(learnt[0], None)
+                else:
+                    self.watches[learnt[0]].append(learnt)
+                    self.watches[learnt[1]].append(learnt)
+                    self.learnts.append(learnt)
+                    self._enqueue(learnt[0], learnt)
+                self.var_inc /= self.var_decay
+                continue
+
+            if budget <= 0:
+                restarts += 1
+                budget = self.restart_base * luby(restarts)
+                self._cancel_until(0)
+                continue
+            if len(self.learnts) - len(self.trail) > max_learnts:
+                self._reduce()
+
+            level = len(self.trail_lim)
+            if level < len(assumptions):
+                lit = assumptions[level]
+                value = self.value(lit)
+                if value < 0:
+                    self._cancel_until(0)
+                    return False
+                self.trail_lim.append(len(self.trail))
+                if value == 0:
+                    self._enqueue(lit, None)
+                continue
+
+            v = self._pick()
+            if v is None:
+                self.model = [self.values[v] for v in range(self.nvars+1)]
+                self._cancel_until(0)
+                return True
+            self.trail_lim.append(len(self.trail))
+            self._enqueue(v if self.polarity[v] else -v, None)
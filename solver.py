@@ -21,234 +21,1807 @@
 
 from __future__ import division, print_function
 
+import sys
+import collections
 import itertools
+import hashlib
+import json
+import timeit
+import threading
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 
-from pulp import GLPK, LpProblem, LpMinimize, LpVariable, lpSum, value
+from pulp import GLPK, LpProblem, LpMinimize, LpVariable, LpAffineExpression, lpSum, value
+from pulp import LpConstraintEQ, LpConstraintLE, LpConstraintGE, LpContinuous, LpStatusOptimal
+try:
+    import highspy
+except ImportError:
+    highspy = None
 
-from common import *
+from model import Cell, Column
+from util import all_grouped
+import sat
 
 
-# Should return the solver that will be
-# invoked by PuLP to solve the MILPs.
+####################################################
+#   -- Backends --
+####################################################
+
+# The MILPs are built with PuLP, and a backend solves them.
+# A backend loads a problem once, and then it is solved several times,
+# only with different objectives. After each solve the values
+# of the variables are available through PuLP's `value`.
+# Between solves the loaded problem can be changed: constraints can be
+# added and removed by name, and the bounds of variables can be changed.
+# The SAT backend is different: it doesn't optimize, it only finds solutions
+# where some variables have the given values (see `Session._sat_backbone`).
+
+# What the solver did so far, e.g. stats['lp_solves'] is the number of times
+# a backend solved a problem. Reset it by clearing.
+stats = collections.Counter()
+# Backends solve in the threads of get_pool() too
+_stats_lock = threading.Lock()
+
+def _count(name):
+    with _stats_lock:
+        stats[name] += 1
+
+class PulpBackend(object):
+    """Let PuLP invoke a solver.
+    For every solve PuLP writes the problem into a file and starts the solver's process."""
+    def __init__(self, name, solver):
+        self.name = name
+        self.solver = solver
+
+    def available(self):
+        return self.solver is None or self.solver.available()
+
+    def __str__(self):
+        if self.solver is None:
+            return "PuLP's default solver"
+        return "{} from {}".format(self.name, self.solver.path)
+
+    def load(self, problem):
+        return PulpModel(problem, self.solver)
+
+class PulpModel(object):
+    def __init__(self, problem, solver):
+        self.problem = problem
+        self.solver = solver
+
+    def solve(self, objective):
+        "Minimize the objective; return whether an optimal solution was found"
+        # A variable that isn't in any constraint (they get removed) or the objective
+        # makes CBC reject the problem, so it's mentioned in the objective
+        objective = LpAffineExpression(objective)
+        for v in self.problem.variables():
+            if v not in objective:
+                objective.addterm(v, 0)
+        self.problem.setObjective(objective)
+        _count('lp_solves')
+        return self.problem.solve(self.solver) == LpStatusOptimal
+
+    def add(self, name, constraint):
+        self.problem.addConstraint(constraint, name)
+
+    def remove(self, name):
+        del self.problem.constraints[name]
+
+    def set_bounds(self, variable, low, high):
+        variable.bounds(low, high)
+
+
+class HighsBackend(object):
+    """Solve in-process with HiGHS.
+    The problem stays in memory between solves, only the objective is replaced."""
+    name = 'highs'
+
+    def available(self):
+        return highspy is not None
+
+    def __str__(self):
+        return "HiGHS (in-process)"
+
+    def load(self, problem):
+        return HighsModel(problem)
+
+class HighsModel(object):
+    def __init__(self, problem):
+        self.problem = problem
+        self.variables = problem.variables()
+        self.index = {v.name: i for i, v in enumerate(self.variables)}
+
+        self.highs = h = highspy.Highs()
+        h.setOptionValue('output_flag', False)
+        # This heuristic costs more than solving these small problems.
+        # (Older versions of HiGHS don't have it and just return an error status.)
+        h.setOptionValue('mip_heuristic_run_feasibility_jump', False)
+        inf = highspy.kHighsInf
+
+        n = len(self.variables)
+        h.addVars(n,
+            [-inf if v.lowBound is None else v.lowBound for v in self.variables],
+            [inf if v.upBound is None else v.upBound for v in self.variables],
+        )
+        integer = [i for i, v in enumerate(self.variables) if v.cat != LpContinuous]
+        h.changeColsIntegrality(len(integer), integer, [highspy.HighsVarType.kInteger]*len(integer))
+
+        # Names of the constraints, in the order of HiGHS' rows
+        self.rows = []
+        for name, constraint in problem.constraints.items():
+            self._add_row(name, constraint)
+
+    def _add_row(self, name, constraint):
+        # The constraint is `sum(coefficient*variable) + constant <sense> 0`
+        inf = highspy.kHighsInf
+        indices = [self.index[v.name] for v in constraint]
+        coefficients = [constraint[v] for v in constraint]
+        rhs = -constraint.constant
+        lower, upper = {
+            LpConstraintEQ: (rhs, rhs),
+            LpConstraintLE: (-inf, rhs),
+            LpConstraintGE: (rhs, inf),
+        }[constraint.sense]
+        self.highs.addRow(lower, upper, len(indices), indices, coefficients)
+        self.rows.append(name)
+
+    def add(self, name, constraint):
+        self.problem.addConstraint(constraint, name)
+        self._add_row(name, constraint)
+
+    def remove(self, name):
+        del self.problem.constraints[name]
+        index = self.rows.index(name)
+        self.highs.deleteRows(1, [index])
+        del self.rows[index]
+
+    def set_bounds(self, variable, low, high):
+        variable.bounds(low, high)
+        self.highs.changeColBounds(self.index[variable.name], low, high)
+
+    def solve(self, objective):
+        "Minimize the objective; return whether an optimal solution was found"
+        self.problem.setObjective(objective)
+        _count('lp_solves')
+        costs = [0]*len(self.variables)
+        for v, coefficient in self.problem.objective.items():
+            costs[self.index[v.name]] = coefficient
+        h = self.highs
+        h.changeColsCost(len(costs), list(range(len(costs))), costs)
+        h.run()
+        if h.getModelStatus() != highspy.HighsModelStatus.kOptimal:
+            return False
+        for v, x in zip(self.variables, h.getSolution().col_value):
+            v.varValue = x if v.cat == LpContinuous else round(x)
+        return True
+
+
+class SatBackend(object):
+    """Solve with the built-in SAT solver (see sat.py).
+    What the solver learned stays with the problem between solves."""
+    name = 'sat'
+
+    def available(self):
+        return True
+
+    def __str__(self):
+        return "SAT (built-in)"
+
+    def load(self, problem):
+        return SatModel(problem)
+
+class SatModel(object):
+    def __init__(self, problem):
+        self.problem = problem
+        self.sat = sat.Solver()
+        # Variable name -> (LpVariable, SAT variable)
+        self.index = collections.OrderedDict()
+        # Variable name -> the literal it's fixed to
+        self.fixed = {}
+        # Name of a constraint -> (LpConstraint, the literal that turns its clauses on)
+        self.rows = {}
+        # Names of the constraints that are in the problem.
+        # Removed constraints stay in the SAT solver, turned off.
+        self.active = set()
+        for v in problem.variables():
+            self._variable(v)
+        for name, constraint in problem.constraints.items():
+            self._add_row(name, constraint)
+
+    def _variable(self, v):
+        try:
+            return self.index[v.name][1]
+        except KeyError:
+            pass
+        x = self.sat.new_var()
+        self.index[v.name] = (v, x)
+        if v.lowBound is not None and v.lowBound == v.upBound:
+            self.fixed[v.name] = x if v.lowBound else -x
+        return x
+
+    def _add_row(self, name, constraint):
+        self.active.add(name)
+        try:
+            if self.rows[name][0] is constraint:
+                return
+        except KeyError:
+            pass
+        # All the variables are 0/1, so a term -x is written as (1-x) - 1, i.e. the negated literal.
+        # Then the constraint says how many of the literals are true.
+        lits = []
+        rhs = -constraint.constant
+        if rhs != int(rhs) or any(coefficient != int(coefficient) for coefficient in constraint.values()):
+            raise ValueError("Only integer coefficients are supported")
+        rhs = int(rhs)
+        for v, coefficient in constraint.items():
+            x = self._variable(v)
+            coefficient = int(coefficient)
+            if coefficient > 0:
+                lits.extend([x]*coefficient)
+            else:
+                lits.extend([-x]*-coefficient)
+                rhs -= coefficient
+        n = len(lits)
+        low, high = {
+            LpConstraintEQ: (rhs, rhs),
+            LpConstraintLE: (0, rhs),
+            LpConstraintGE: (rhs, n),
+        }[constraint.sense]
+
+        guard = self.sat.new_var()
+        self.rows[name] = (constraint, guard)
+        if low <= 0 and high >= n:
+            pass
+        elif low > high or low > n or high < 0:
+            self.sat.add_clause([-guard])
+        elif low == 1 and high >= n:
+            self.sat.add_clause(lits + [-guard])
+        elif low <= 0 and high == n-1 and len(set(lits)) == n:
+            self.sat.add_clause([-x for x in lits] + [-guard])
+        else:
+            self.sat.add_cardinality(lits, max(0, low), min(n, high), guard)
+
+    def add(self, name, constraint):
+        self.problem.addConstraint(constraint, name)
+        self._add_row(name, constraint)
+
+    def remove(self, name):
+        del self.problem.constraints[name]
+        self.active.discard(name)
+
+    def set_bounds(self, variable, low, high):
+        variable.bounds(low, high)
+        x = self._variable(variable)
+        if low == high:
+            self.fixed[variable.name] = x if low else -x
+        else:
+            self.fixed.pop(variable.name, None)
+
+    def solve(self, values):
+        """Find a solution where the given variables have the given values (a dict {variable: 0 or 1}).
+        Return whether there is one"""
+        _count('lp_solves')
+        assumptions = [self.rows[name][1] for name in self.active]
+        assumptions.extend(self.fixed.values())
+        for v, x in values.items():
+            x = self._variable(v) if x else -self._variable(v)
+            assumptions.append(x)
+        if not self.sat.solve(assumptions):
+            return False
+        model = self.sat.model
+        for v, x in self.index.values():
+            v.varValue = 1 if model[x] > 0 else 0
+        return True
+
+
+# In order of preference
+backends = collections.OrderedDict((backend.name, backend) for backend in [
+    HighsBackend(),
+    PulpBackend('glpk', GLPK(None, msg=False, options=['--cuts'])),
+    # There may be no glpsol. Let PuLP try to find another solver.
+    PulpBackend('default', None),
+    SatBackend(),
+])
+
+# Should return the backend that will solve the MILPs.
 def get_solver():
     global solver
     try:
         return solver
     except NameError: pass
 
-    solver = GLPK(None, msg=False, options=['--cuts'])
-    if solver.available():
-        print("Using solver from:", solver.path)
-        return solver
+    for solver in backends.values():
+        if solver.available():
+            print("Using solver:", solver, file=sys.stderr)
+            return solver
 
-    # There may be no glpsol. Let PuLP try to find another solver.
-    print("Couldn't find 'glpsol' solver; a default may be found")
-    solver = None
-
-
-def solve(scene):
-    cells   = scene.all_cells
-    columns = scene.all_columns
-    known   = [cell for cell in cells if cell.display is not Cell.unknown]
-    unknown = [cell for cell in cells if cell.display is Cell.unknown]
-    
-    ####################################################
-    #   -- Equivalence Class Optimisation --
-    ####################################################
-    
-    # We say, two unknown cells are equivalent if they are subject
-    # to the same constraints (not just equal, but the same)
-    # if a cell can be blue/black then an equivalent cell has those
-    # options too, since they can switch places without affecting constraints
-    # *Unless* there are togetherness constraints involved (see below).
-    # Idea: Have one variable for each class with range 0 to the size of the class
-    # This models the number of cells in the class that are blue.
-    # The cells of the class are blue (black)
-    # iff we can prove the variable assumes its max (min)
-    
-    # cell_constraints: Maps a cell to all relevant
-    # constraints (cells and columns) that it is a member of
-    cell_constraints = collections.defaultdict(set)
-    for cur in itertools.chain(known, columns):
-        # Ignore uninformative constraints
-        if cur.value is None:
-            continue
+def set_solver(name):
+    "Choose the backend by name instead of the preferred available one"
+    global solver
+    backend = backends[name]
+    if not backend.available():
+        raise ValueError("Solver '{}' is not available".format(name))
+    solver = backend
+
+
+class Profile(object):
+    """What happened in one call of `Session.solve`, to find out where the time goes.
+    Times are in seconds."""
+    def __init__(self):
+        # Whether the result was remembered from before, see `deduction_cache`
+        self.cached = False
+        # Phase -> time spent in it. 'constraints' is building the constraints and the MILP,
+        # if it happened during this call
+        self.times = collections.OrderedDict((phase, 0.0) for phase in ['total', 'constraints', 'classes', 'components'])
+        # Unknown cells (the variables that aren't fixed), their equivalence classes and components
+        self.variables = self.classes = self.components = 0
+        # Kind of information ('column', 'cell', 'flower', '{n}', '-n-', 'total') -> number of
+        # constraints that come from it and need solving
+        self.constraints = collections.Counter()
+        # The time of each LP solve
+        self.lp_solves = []
+        # Number of cells found
+        self.found = 0
+
+    def __str__(self):
+        if self.cached:
+            return "Found {} cells in {:.2f} s (remembered)".format(self.found, self.times['total'])
+        return "Found {} cells in {:.2f} s: constraints {:.2f} s, classes {:.2f} s, components {:.2f} s, {} LP solves {:.2f} s"\
+            " | {} variables, {} classes, {} components | {}".format(
+            self.found, self.times['total'], self.times['constraints'], self.times['classes'], self.times['components'],
+            len(self.lp_solves), sum(self.lp_solves), self.variables, self.classes, self.components,
+            ", ".join('{} {}'.format(n, kind) for kind, n in sorted(self.constraints.items())),
+        )
+
+
+class Session(object):
+    """The state of the solver for a level, kept between solves.
+    When a cell is displayed or covered again (undo), only its variable and
+    the constraints that involve it are changed, instead of building everything again.
+    There are two tiers of deductions: `propagate` looks at one constraint at a time,
+    and only at the constraints touched by the latest changes; `solve` uses the MILP."""
+
+    def __init__(self, level, component_cache=None):
+        start = timeit.default_timer()
+        self.level = level
+        self.generation = level.generation
+        cells = level.all_cells
+
+        # For every cell there is a binary variable, which is blue iff the cell is.
+        # Displayed cells have their variable fixed to the known value.
+        self.variables = {cell: LpVariable('v'+str(i), 0, 1, 'Integer') for i, cell in enumerate(cells)}
+        # Additional variables that some constraints need (see `together_encoding`)
+        self.extra_variables = []
+        # Cell -> the value its variable is fixed to
+        self.known = {}
+
+        # cell_constraints: Maps a cell to all relevant
+        # constraints (cells and columns) that it is a member of
+        self.cell_constraints = collections.defaultdict(set)
+        # Name -> [LpConstraint, the set of cells in it, how many of them are unknown]
+        self.rows = {}
+        # Cell -> names of the rows the cell appears in
+        self.cell_rows = collections.defaultdict(list)
+        # Cell or column -> names of the rows it produced, and the other way around
+        self.rows_of = {}
+        self.row_source = {}
+        self.row_names = ('r{}'.format(i) for i in itertools.count())
+        # Counts of parts of the level, see `count`
+        self.count_cache = {}
+        # What the MILP found in parts of the level (see `_solve`), by what's in them (see `_content`).
+        # It's passed on to the next session of the same level (e.g. after its layout changed),
+        # which then doesn't need to solve the parts that stayed the same.
+        # Only kept in memory, the keys refer to the cells themselves.
+        self.component_cache = component_cache if component_cache is not None else DeductionCache(size=10000)
+        # The MILP is loaded only when it's needed for the first time
+        self.problem = self.model = None
+
+        # Constraints (cells and columns) to look at in the next propagation, in order
+        self.queue = collections.OrderedDict()
+        # The same for `solve_simple`
+        self.simple_queue = collections.OrderedDict()
+        # Cell -> kind, found by propagation but not displayed yet
+        self.pending = {}
+        # Constraint -> [number of its unknown members, number of full ones],
+        # counting what is displayed or pending as known
+        self.counts = {}
+        # Tier -> how many cells it found
+        self.hits = collections.Counter()
+        # See `state_key`
+        self.layout_key = None
+        # Profile of the last `solve`
+        self.profile = None
+
+        # The total number of blue cells is known
+        total = level.remaining + sum(1 for cell in cells if cell.display is Cell.full)
+        self.total_row = None
+        if cells:
+            self._add_rows(None, [(lpSum(self.variables.values()) == total, cells)])
+            [self.total_row] = self.rows_of[None]
+        for col in level.all_columns:
+            self._add_rows(col, self._constraints_of(col))
+            self.queue[col] = self.simple_queue[col] = True
+        for cell in cells:
+            self.update(cell)
+        # Counted in the profile of the first solve
+        self.build_time = timeit.default_timer() - start
+
+    def _load(self):
+        "Put the constraints that need solving into a problem and load it into the backend"
+        self.problem = problem = LpProblem('HexcellsMILP', LpMinimize)
+
+        # Default solver can't handle no objective, so invent one:
+        self.spam = LpVariable('spam', 0, 1, 'binary')
+        problem += (self.spam == 1)
+
+        for v in itertools.chain(self.variables.values(), self.extra_variables):
+            problem.addVariable(v)
+        for name, (constraint, involved, unknown) in self.rows.items():
+            # Constraints without unknown cells are satisfied, they don't need to be solved
+            if unknown:
+                problem.addConstraint(constraint, name)
+
+        self.model = get_solver().load(problem)
+
+    def _constraints_of(self, cur):
+        """Produce (constraint, cells involved) for the information of a column or a displayed cell"""
+        get_var = self.variables.get
+        if isinstance(cur, Cell):
+            cell = cur
+            # If the displays a number, the sum of its neighbourhood (radius 1 or 2) is known
+            if cell.value is None:
+                return
+            yield lpSum(get_var(neighbour) for neighbour in cell.members) == cell.value, cell.members
+
+            # Additional togetherness information available?
+            # Note: Only relevant if value between 2 and 4.
+            # In fact: The following code would do nonsense for 0,1,5,6!
+            if cell.together is not None and cell.value >= 2 and cell.value <= 4:
+                # Note: Cells are ordered clockwise.
+                # Convenience: Have it wrap around.
+                m = cell.members+cell.members
+
+                if cell.together:
+                    # note how togetherness is equivalent to the following
+                    # two patterns not occuring: "-X-" and the "X-X"
+                    # in other words: No lonely blue cell and no lonely gap
+                    for i in range(len(cell.members)):
+                        # No lonely cell condition:
+                        # Say m[i] is a blue.
+                        # Then m[i-1] or m[i+1] must be blue.
+                        # That means: -m[i-1] +m[i] -m[i+1] <= 0
+                        # Note that m[i+1] and m[i-1] only count
+                        # if they are real neighbours.
+                        cond = lpSum([get_var(m[i])])
+                        involved = [m[i]]
+                        if m[i].is_neighbor(m[i-1]):
+                            cond -= get_var(m[i-1])
+                            involved.append(m[i-1])
+                        if m[i].is_neighbor(m[i+1]):
+                            cond -= get_var(m[i+1])
+                            involved.append(m[i+1])
+
+                        # no isolated cell
+                        yield cond <= 0, involved
+                        # no isolated gap (works by a similar argument)
+                        yield cond >= -1, involved
+                else:
+                    # -n-: any circular range of n cells contains at most n-1 blues.
+                    for i in range(len(cell.members)):
+                        # the range m[i], ..., m[i+n-1] may not all be blue if they are consecutive
+                        if all(m[i+j].is_neighbor(m[i+j+1]) for j in range(cell.value-1)):
+                            involved = m[i:i+cell.value]
+                            yield lpSum(get_var(x) for x in involved) <= cell.value-1, involved
+        else:
+            col = cur
+            # The sum of all cells in that column is the column value
+            yield lpSum(get_var(cell) for cell in col.members) == col.value, col.members
+
+            # Additional information (together/seperated) available?
+            if col.together is not None:
+                if col.together and together_encoding == 'windows':
+                    # For {n}: the blue cells are one of the windows of n cells in a row.
+                    # A variable for each window tells whether it's the one,
+                    # and a cell is blue iff one of the windows that contain it is.
+                    # That is a linear number of constraints (but more variables).
+                    # The windows connect all the cells, so every constraint involves all of them.
+                    windows = []
+                    for start in range(len(col.members)-col.value+1):
+                        v = LpVariable('w'+str(len(self.extra_variables)), 0, 1, LpContinuous)
+                        self.extra_variables.append(v)
+                        windows.append(v)
+                    yield lpSum(windows) == 1, col.members
+                    for i, cell in enumerate(col.members):
+                        yield get_var(cell) == lpSum(windows[max(0, i-col.value+1):i+1]), col.members
+                elif col.together:
+                    # For {n}: cells that are at least n appart cannot be both blue.
+                    # Example: For {3}, the configurations X??X, X???X, X????X, ... are impossible.
+                    for span in range(col.value, len(col.members)):
+                        for start in range(len(col.members)-span):
+                            involved = [col.members[start], col.members[start+span]]
+                            yield lpSum(get_var(x) for x in involved) <= 1, involved
+                else:
+                    # For -n-, the sum of any range of n cells may contain at most n-1 blues
+                    for offset in range(len(col.members)-col.value+1):
+                        involved = col.members[offset:offset+col.value]
+                        yield lpSum(get_var(x) for x in involved) <= col.value-1, involved
+
+    def _add_rows(self, cur, constraints):
+        names = self.rows_of[cur] = []
+        for constraint, involved in constraints:
+            name = next(self.row_names)
+            involved = set(involved)
+            unknown = sum(1 for cell in involved if cell not in self.known)
+            self.rows[name] = [constraint, involved, unknown]
+            for cell in involved:
+                self.cell_rows[cell].append(name)
+            # Constraints without unknown cells are satisfied, they don't need to be solved
+            if unknown and self.model is not None:
+                self.model.add(name, constraint)
+            names.append(name)
+            self.row_source[name] = cur
+        if cur is not None:
+            for x in cur.members:
+                self.cell_constraints[x].add(cur)
+            states = [self._state(x) for x in cur.members]
+            self.counts[cur] = [states.count(Cell.unknown), states.count(Cell.full)]
+
+    def _remove_rows(self, cur):
+        for name in self.rows_of.pop(cur):
+            constraint, involved, unknown = self.rows.pop(name)
+            del self.row_source[name]
+            if unknown and self.model is not None:
+                self.model.remove(name)
+            for cell in involved:
+                self.cell_rows[cell].remove(name)
         for x in cur.members:
-            cell_constraints[x].add(cur)
-    
-    # Cells are now equivalent iff their cell_constraints match.
-    # The leftmost cell in the collection is the representative,
-    # i.e. rep_of[cell] points to the leftmost cell that is equivalent to cell.
-    # note that this is well-defined since cells are equivalent to themselves.
-    # rep_of[cell] is the representative of the equivalence class of cell.
-    rep_of = {}
-    for cell1 in unknown:
-        cc1 = cell_constraints[cell1]
-        for cell2 in unknown:
-            if cc1 == cell_constraints[cell2]:
-                rep_of[cell1] = cell2
-    
-    # since cells subject to togetherness constraints cannot swap places (they are a special case)
-    # they must be their own representative and cannot be considered equivalent
-    # to anyone but themselves.
-    for cell in unknown:
-        for constraint in cell_constraints[cell]:
-           if constraint.together is not None:
-                rep_of[cell] = cell
-    
-    # from now on it will suffice to find information on equivalence classes
-    # a class is a pair of one representative and the size of the class
-    classes = {rep: sum(1 for cell in unknown if rep_of[cell] is rep) for rep in unknown if rep_of[rep] is rep}
-    
-    ####################################################
-    #     -- The MILP Problem (managed by PuLP) --
-    ####################################################
-    
-    solver = get_solver()
-    problem = LpProblem('HexcellsMILP', LpMinimize)
-    
-    # For every equivalence class of cells there is a integer variable,
-    # modeling the number of blue cells in that class.
-    # The class is blue (or black) iff we can prove that the variable
-    # is necessarily the size of the class (or 0)
-    # This Dictionary maps a cell id to the respective variable.
-    dic = {rep.id: LpVariable('v'+str(rep.id), 0, size, 'Integer') for rep, size in classes.items()}
-    
-    # Convenience: Maps a cell to the corresponding variable or constant:
-    # Note that the cells of a class will appear in the same constraints,
-    # so we ignore every cell but the representative.
-    def get_var(cell):
-        if cell.display is not Cell.unknown: #cell is constant
-            return 1 if cell.display is Cell.full else 0
-        elif rep_of[cell] is cell: #cell is representative
-            return dic[cell.id]
-        else: # cell is non representative
-            return 0
-    
-    # The number of remaining blue cells is known
-    problem += lpSum(get_var(cell) for cell in unknown) == scene.remaining
-    
-    # Constraints from column number information
-    for col in columns:
-        # The sum of all cells in that column is the column value
-        problem += lpSum(get_var(cell) for cell in col.members) == col.value
-        
-        # Additional information (together/seperated) available?
-        if col.together is not None:
-            if col.together:
-                # For {n}: cells that are at least n appart cannot be both blue.
-                # Example: For {3}, the configurations X??X, X???X, X????X, ... are impossible.
-                for span in range(col.value, len(col.members)):
-                    for start in range(len(col.members)-span):
-                        problem += lpSum([get_var(col.members[start]), get_var(col.members[start+span])]) <= 1
+            self.cell_constraints[x].discard(cur)
+        del self.counts[cur]
+        self.queue.pop(cur, None)
+        self.simple_queue.pop(cur, None)
+
+    def update(self, cell):
+        """Bring the session up to date with the display of the cell:
+        fix its variable and add its information if it's displayed,
+        or roll that back if it was covered again."""
+        if self.level is not cell.level or self.generation != self.level.generation:
+            # The layout changed, this session will be thrown away
+            return
+        fixed = None if cell.display is Cell.unknown else 1 if cell.display is Cell.full else 0
+        if self.known.get(cell) == fixed:
+            return
+        if cell in self.known:
+            # Covered again. Roll back everything that was done when it was displayed
+            if cell in self.rows_of:
+                self._remove_rows(cell)
+            self._count(cell, Cell.full if self.known[cell] else Cell.empty, -1)
+            del self.known[cell]
+            self._set_bounds(self.variables[cell], 0, 1)
+            for name in self.cell_rows[cell]:
+                row = self.rows[name]
+                row[2] += 1
+                if row[2] == 1 and self.model is not None:
+                    self.model.add(name, row[0])
+            # What was propagated may have depended on this cell, so look at it again
+            for other, kind in self.pending.items():
+                self._count(other, kind, -1)
+                self._touch(other)
+            self.pending = {}
+            self._touch(cell)
+        if fixed is not None:
+            self.known[cell] = fixed
+            self._set_bounds(self.variables[cell], fixed, fixed)
+            for name in self.cell_rows[cell]:
+                row = self.rows[name]
+                row[2] -= 1
+                if row[2] == 0 and self.model is not None:
+                    self.model.remove(name)
+            # If propagation already assumed this, the constraints around it are done
+            if self.pending.get(cell) is cell.display:
+                del self.pending[cell]
+            else:
+                if cell in self.pending:
+                    self._count(cell, self.pending.pop(cell), -1)
+                self._count(cell, cell.display, 1)
+                self._touch(cell)
+            if cell.value is not None:
+                self._add_rows(cell, self._constraints_of(cell))
+                self.queue[cell] = self.simple_queue[cell] = True
+
+    def _set_bounds(self, variable, low, high):
+        if self.model is not None:
+            self.model.set_bounds(variable, low, high)
+        else:
+            variable.bounds(low, high)
+
+    def _state(self, cell):
+        "Cell.full, Cell.empty or Cell.unknown: what is displayed or found by propagation"
+        try:
+            return self.pending[cell]
+        except KeyError:
+            pass
+        try:
+            return Cell.full if self.known[cell] else Cell.empty
+        except KeyError:
+            return Cell.unknown
+
+    def _count(self, cell, kind, sign):
+        "Count the cell as known (sign=1) or unknown again (sign=-1) in the constraints that contain it"
+        for constraint in self.cell_constraints[cell]:
+            counts = self.counts[constraint]
+            counts[0] -= sign
+            if kind is Cell.full:
+                counts[1] += sign
+
+    def _touch(self, cell):
+        "Look again at the constraints that contain the cell"
+        for constraint in self.cell_constraints[cell]:
+            self.queue[constraint] = self.simple_queue[constraint] = True
+
+    def propagate(self):
+        """Tier 1: find what follows from single constraints, starting with the ones
+        touched since the last time, and following the consequences until nothing more follows.
+        Return a list of (cell, kind)."""
+        # The consequences are followed by assuming the found cells' kinds
+        assumed = self.pending
+        # Report again what was found before but hasn't been displayed
+        found = [(cell, kind) for cell, kind in assumed.items() if cell.display is Cell.unknown]
+
+        while self.queue:
+            cur, _ = self.queue.popitem(last=False)
+            unknown, full = self.counts[cur]
+            if not unknown:
+                continue
+            need = cur.value - full
+            if 0 < need < unknown and cur.together is None:
+                # Just the count, and it doesn't decide anything
+                continue
+            for cell, kind in _deduce(cur, self._state):
+                if cell in assumed:
+                    continue
+                assumed[cell] = kind
+                found.append((cell, kind))
+                self.hits['propagation'] += 1
+                self._count(cell, kind, 1)
+                self._touch(cell)
+        return found
+
+    def solve_simple(self):
+        """Find the constraints whose unknown cells must all be blue or all black, by their counts.
+        Only the constraints touched since the last time are looked at.
+        Yield (cell, kind); the cells may be displayed during the iteration."""
+        # The counts take what propagation found as known, so report it too
+        for cell, kind in list(self.pending.items()):
+            if cell.display is Cell.unknown:
+                yield cell, kind
+        saturated = []
+        while self.simple_queue:
+            cur, _ = self.simple_queue.popitem(last=False)
+            unknown, full = self.counts[cur]
+            if not unknown:
+                continue
+            need = cur.value - full
+            if need == 0:
+                kind = Cell.empty
+            elif need == unknown:
+                kind = Cell.full
             else:
-                # For -n-, the sum of any range of n cells may contain at most n-1 blues
-                for offset in range(len(col.members)-col.value+1):
-                    problem += lpSum(get_var(col.members[offset+i]) for i in range(col.value)) <= col.value-1
-    
-    # Constraints from cell number information
-    for cell in known:
-        # If the displays a number, the sum of its neighbourhood (radius 1 or 2) is known
-        if cell.value is not None:
-            problem += lpSum(get_var(neighbour) for neighbour in cell.members) == cell.value
-        
-        # Additional togetherness information available?
-        # Note: Only relevant if value between 2 and 4.
-        # In fact: The following code would do nonsense for 0,1,5,6!
-        if cell.together is not None and cell.value >= 2 and cell.value <= 4:
-            # Note: Cells are ordered clockwise.
-            # Convenience: Have it wrap around.
-            m = cell.members+cell.members
-            
-            if cell.together:
-                # note how togetherness is equivalent to the following
-                # two patterns not occuring: "-X-" and the "X-X"
-                # in other words: No lonely blue cell and no lonely gap
-                for i in range(len(cell.members)):
-                    # No lonely cell condition:
-                    # Say m[i] is a blue.
-                    # Then m[i-1] or m[i+1] must be blue.
-                    # That means: -m[i-1] +m[i] -m[i+1] <= 0
-                    # Note that m[i+1] and m[i-1] only count
-                    # if they are real neighbours.
-                    cond = get_var(m[i])
-                    if m[i].is_neighbor(m[i-1]):
-                        cond -= get_var(m[i-1])
-                    if m[i].is_neighbor(m[i+1]):
-                        cond -= get_var(m[i+1])
-                        
-                    # no isolated cell
-                    problem += cond <= 0
-                    # no isolated gap (works by a similar argument)
-                    problem += cond >= -1
+                continue
+            saturated.append(cur)
+            for x in [x for x in cur.members if self._state(x) is Cell.unknown]:
+                yield x, kind
+        # Whatever wasn't displayed will be found again next time
+        for cur in saturated:
+            if cur in self.counts and self.counts[cur][0]:
+                self.simple_queue[cur] = True
+
+    def state_key(self):
+        """A string that identifies the level together with what is displayed in it,
+        no matter where the level is placed."""
+        if self.layout_key is None:
+            grid = self.level.grid
+            self.origin = (min(x for x, y in grid), min(y for x, y in grid)) if grid else (0, 0)
+            ox, oy = self.origin
+            layout = []
+            for (x, y), it in sorted(grid.items()):
+                if isinstance(it, Cell):
+                    code = ('x' if it.kind is Cell.full else 'o') + str(it.show_info)
+                else:
+                    code = str(it.angle) + ('c' if it.show_info else '+')
+                layout.append('{},{}{}'.format(x-ox, y-oy, code))
+            self.layout_key = hashlib.sha1(';'.join(layout).encode('utf-8')).hexdigest()
+            self.sorted_cells = sorted(self.level.all_cells, key=lambda cell: cell.coord)
+        display = ''.join(
+            '.' if cell.display is Cell.unknown else 'x' if cell.display is Cell.full else 'o'
+            for cell in self.sorted_cells
+        )
+        return self.layout_key + hashlib.sha1(display.encode('utf-8')).hexdigest()
+
+    def solve(self):
+        """Tier 2: find the unknown cells whose kind follows from the displayed information.
+        Return a list of (cell, kind).
+        The results are remembered in `deduction_cache`.
+        What happened is described in `profile`."""
+        start = timeit.default_timer()
+        self.profile = profile = Profile()
+        profile.times['constraints'] += self.build_time
+        self.build_time = 0
+
+        # `_solve` always finds what the full problem allows, but the result could
+        # still differ with the backend or the encoding, so they're part of the key
+        key = '{}:{}:{}'.format(get_solver().name, together_encoding, self.state_key())
+        cached = deduction_cache.get(key)
+        if cached is not None:
+            ox, oy = self.origin
+            found = [
+                (self.level.grid[x+ox, y+oy], Cell.full if kind == 'x' else Cell.empty)
+                for x, y, kind in cached
+            ]
+            self.hits['milp'] += len(found)
+            profile.cached = True
+        else:
+            found = self._solve()
+            ox, oy = self.origin
+            deduction_cache.put(key, [
+                (cell.coord.x-ox, cell.coord.y-oy, 'x' if kind is Cell.full else 'o')
+                for cell, kind in found
+            ])
+        profile.found = len(found)
+        profile.times['total'] = timeit.default_timer() - start
+        return found
+
+    def _solve(self):
+        profile = self.profile
+        timer = timeit.default_timer
+        start = timer()
+        if self.model is None:
+            self._load()
+        profile.constraints = self._constraint_kinds()
+        profile.times['constraints'] += timer() - start
+
+        unknown = [cell for cell in self.level.all_cells if cell.display is Cell.unknown]
+        if not unknown:
+            return []
+        start = timer()
+        classes = self._classes(unknown)
+        profile.times['classes'] = timer() - start
+        start = timer()
+        components, free = self._components(unknown)
+        profile.times['components'] = timer() - start
+        profile.variables, profile.classes, profile.components = len(unknown), len(classes), len(components)
+
+        ####################################################
+        #   -- Connected Components --
+        ####################################################
+
+        # Cells of different components share no constraints, except for
+        # the total number of blue cells. The components are solved without
+        # the total, and what the solutions found on the way say is remembered
+        # (see `_seen`): with which numbers of blue cells in the component
+        # each class had a blue cell and a black cell. Solutions of the
+        # components put together are a solution of the full problem if their
+        # numbers of blue cells (and some number of the free cells, which are
+        # in no constraint) add up to the total.
+        # A cell that is known in its component is known in the full problem too.
+        # A class that can be both ways in solutions that add up like that isn't
+        # known either. Only the classes for which no such solutions were seen
+        # are tried in the full problem, so the result is the same as its own.
+        # A component that was solved before has the same result, see `component_cache`.
+        remaining = self.level.remaining
+        keys = [self._content(cells, names) for cells, names in components]
+        full_key = (frozenset(keys), frozenset(free), remaining)
+        found = self.component_cache.get(full_key)
+        if found is not None:
+            self.hits['milp'] += len(found)
+            return found
+
+        found = []
+        undecided = list(classes.items())
+        # With a single component the full problem is just as small
+        if len(components) > 1:
+            component_of = {cell: i for i, (cells, names) in enumerate(components) for cell in cells}
+            component_classes = [[] for component in components]
+            for key, cells in classes.items():
+                if cells[0] in component_of:
+                    component_classes[component_of[cells[0]]].append((key, cells))
+
+            results = [self.component_cache.get(key) for key in keys]
+            todo = [i for i, result in enumerate(results) if result is None]
+            # With threads, the components that weren't solved before are solved at once.
+            # Otherwise they're solved together, as one problem without the total:
+            # that needs fewer solves, and its solutions are solutions of each of them.
+            jobs = [[i] for i in todo] if threads > 1 else [todo] if todo else []
+            def solve(job):
+                cells = [cell for i in job for cell in components[i][0]]
+                names = [name for i in job for name in components[i][1]]
+                solutions = []
+                result = self._backbone(*self._component_problem(cells, names) + (
+                    [c for i in job for c in component_classes[i]], solutions
+                ))
+                return result, solutions
+            if len(jobs) > 1:
+                solved = get_pool().map(solve, jobs)
             else:
-                # -n-: any circular range of n cells contains at most n-1 blues.
-                for i in range(len(cell.members)):
-                    # the range m[i], ..., m[i+n-1] may not all be blue if they are consecutive
-                    if all(m[i+j].is_neighbor(m[i+j+1]) for j in range(cell.value-1)):
-                        problem += lpSum(get_var(m[i+j]) for j in range(cell.value)) <= cell.value-1
-
-    # First, get any solution.
-    # Default solver can't handle no objective, so invent one:
-    spam = LpVariable('spam', 0, 1, 'binary')
-    problem += (spam == 1)
-    problem.setObjective(spam) # no optimisation function yet
-    problem.solve(solver)
-    
-    def get_true_false_classes():
-        true_set  = set()
-        false_set = set()
-        
-        for rep, size in classes.items():
-            if value(get_var(rep)) == 0:
-                false_set.add(rep)
-            elif value(get_var(rep)) == size:
-                true_set.add(rep)
-        return true_set, false_set
-    
-    # get classes that are fully true or false
-    # they are candidates for solvable classes
-    true, false = get_true_false_classes()
-    
-    while true or false:
-        # Now try to vary as much away from the
-        # initial solution as possible:
-        # We try to make the variables True, that were False before
-        # and vice versa. If no change could be achieved, then
-        # the remaining variables have their unique possible value.
-        problem.setObjective(lpSum(get_var(t) for t in true)-lpSum(get_var(f) for f in false))
-        problem.solve(solver)
-        
-        # all true variables stayed true and false stayed false?
-        # Then they have their unique value and we are done!
-        if value(problem.objective) == sum(classes[rep] for rep in true):
-            for tf_set, kind in [(true, Cell.full), (false, Cell.empty)]:
-                for rep in tf_set:
-                    for cell in unknown:
-                        if rep_of[cell] is rep:
-                            yield cell, kind
-            return
-        
-        true_new, false_new = get_true_false_classes()
-        
-        # remember only those classes that subbornly kept their pure trueness/falseness
-        true &= true_new
-        false &= false_new
-
-
-
-def solve_simple(scene):
-    for cur in itertools.chain(scene.all_cells, scene.all_columns):
-        if isinstance(cur, Cell) and cur.display is Cell.unknown:
-            continue
-        if cur.value is not None and any(x.display is Cell.unknown for x in cur.members):
-            # Fill up remaining fulls
-            if cur.value == sum(1 for x in cur.members if x.display is not Cell.empty):
-                for x in cur.members:
-                    if x.display is Cell.unknown:
-                        yield x, Cell.full
-            # Fill up remaining empties
-            if len(cur.members)-cur.value == sum(1 for x in cur.members if x.display is not Cell.full):
+                solved = [solve(job) for job in jobs]
+            for job, (result, solutions) in zip(jobs, solved):
+                for i in job:
+                    cells = set(components[i][0])
+                    results[i] = (
+                        [(cell, kind) for cell, kind in result if cell in cells],
+                        _seen(solutions, component_classes[i])
+                    )
+                    self.component_cache.put(keys[i], results[i])
+
+            # The numbers of blue cells (as bits) that solutions of each component had
+            counts = [_counts_seen(seen) for _, seen in results]
+            free_counts = (1 << len(free)+1) - 1
+            if _add_counts([free_counts] + counts) >> remaining & 1:
+                undecided = []
+                for i, (result, seen) in enumerate(results):
+                    fit = _fitting(_add_counts([free_counts] + counts[:i] + counts[i+1:]), remaining, len(components[i][0]))
+                    found.extend(result)
+                    known = {cell for cell, kind in result}
+                    for key, cells in component_classes[i]:
+                        if cells[0] in known:
+                            continue
+                        blue, black = seen.get(key, (0, 0))
+                        if not (blue & fit and black & fit):
+                            undecided.append((key, cells))
+                if free:
+                    fit = _fitting(_add_counts(counts), remaining, len(free))
+                    # Some of the free cells can be blue, and some can be black
+                    if not (fit & ~1 and fit & ~(1 << len(free))):
+                        undecided.append((frozenset(), free))
+            # Otherwise no solutions that were seen add up, the full problem decides everything
+
+        if undecided:
+            found.extend(self._backbone(self.problem, self.model, self.spam, undecided))
+        self.component_cache.put(full_key, found)
+
+        self.hits['milp'] += len(found)
+        return found
+
+    def _content(self, cells, names):
+        """Describe the problem of some cells and constraints by what's in it,
+        in a way that doesn't depend on the session (see `component_cache`).
+        Return (cells, the information that the constraints come from, encoding)."""
+        sources = {self.row_source[name] for name in names}
+        return (frozenset(cells), frozenset(
+            (cur, cur.value, cur.together, tuple(cur.members), tuple(self.known.get(x) for x in cur.members))
+            for cur in sources
+        ), together_encoding)
+
+    def count(self):
+        """Count the ways to complete the level: the assignments of the unknown cells that agree
+        with all the displayed information and with the number of remaining blue cells.
+        Return the number of them and {cell: in how many of them the cell is blue},
+        or None if counting takes too long (see `max_count_branches`)."""
+        unknown = [cell for cell in self.level.all_cells if cell.display is Cell.unknown]
+        state = {cell: Cell.full if fixed else Cell.empty for cell, fixed in self.known.items()}
+        if len(self.count_cache) > count_cache_size:
+            self.count_cache = {}
+        counter = _Counter(self.cell_constraints, state, self.count_cache)
+
+        # Cells that aren't in any constraints can be blue in any combination,
+        # so only the cells in constraints need counting.
+        # Parts of the level that share no constraints are counted separately,
+        # by how many blue cells they have. Then the counts are put together
+        # so that there are as many blue cells in total as remain.
+        free = [cell for cell in unknown if not self.cell_constraints[cell]]
+        try:
+            nodes = [
+                counter.count(*group)
+                for group in counter.groups([cell for cell in unknown if self.cell_constraints[cell]])
+            ]
+        except _TooHard:
+            return None
+        parts = [node.counts for node in nodes]
+        parts.append([_count_combinations(len(free), k) for k in range(len(free)+1)])
+
+        # For each part, the counts of all the other parts together
+        before = [[1]]
+        for counts in parts[:-1]:
+            before.append(_convolve(before[-1], counts))
+        after = [[1]]
+        for counts in reversed(parts[1:]):
+            after.append(_convolve(after[-1], counts))
+        after.reverse()
+        others = [_convolve(a, b) for a, b in zip(before, after)]
+
+        # What a count of a part is worth: the number of ways to have the rest of the remaining blue cells elsewhere
+        remaining = self.level.remaining
+        def worth(counts, others):
+            return [others[remaining-k] if 0 <= remaining-k < len(others) else 0 for k in range(len(counts))]
+
+        total = sum(n*x for n, x in zip(parts[-1], worth(parts[-1], others[-1])))
+        blue = counter.blue_counts([(node, worth(node.counts, rest)) for node, rest in zip(nodes, others)])
+        # k of n free cells are blue in C(n, k) ways, and a given one of them in C(n-1, k-1) of them
+        free_blue = sum(
+            _count_combinations(len(free)-1, k-1) * x
+            for k, x in enumerate(worth(parts[-1], others[-1])) if k
+        )
+        for cell in free:
+            blue[cell] = free_blue
+        return total, {cell: blue.get(cell, 0) for cell in unknown}
+
+    def _constraint_kinds(self):
+        "Count the constraints that need solving by the kind of information they come from"
+        kinds = collections.Counter()
+        for cur, names in self.rows_of.items():
+            # The first constraint is the sum, the rest are about togetherness
+            for i, name in enumerate(names):
+                if not self.rows[name][2]:
+                    continue
+                if cur is None:
+                    kind = 'total'
+                elif i == 0:
+                    kind = 'column' if isinstance(cur, Column) else 'flower' if cur.kind is Cell.full else 'cell'
+                else:
+                    kind = '{n}' if cur.together else '-n-'
+                kinds[kind] += 1
+        return kinds
+
+    def _classes(self, unknown):
+        cell_constraints = self.cell_constraints
+
+        ####################################################
+        #   -- Equivalence Class Optimisation --
+        ####################################################
+
+        # We say, two unknown cells are equivalent if they are subject
+        # to the same constraints (not just equal, but the same)
+        # if a cell can be blue/black then an equivalent cell has those
+        # options too, since they can switch places without affecting constraints
+        # *Unless* there are togetherness constraints involved (see below).
+        # Idea: Look at the number of cells in the class that are blue.
+        # The cells of the class are blue (black)
+        # iff we can prove that number assumes its max (min)
+
+        # Cells are now equivalent iff their cell_constraints match.
+        # So the cells are grouped in one pass, using the set of constraints
+        # (frozen, to be hashable) as the key of the class.
+        # since cells subject to togetherness constraints cannot swap places (they are a special case)
+        # they get the cell itself as the key and cannot be considered equivalent
+        # to anyone but themselves.
+        # classes maps the key of a class to its cells
+        classes = collections.OrderedDict()
+        for cell in unknown:
+            constraints = cell_constraints[cell]
+            if any(constraint.together is not None for constraint in constraints):
+                key = cell
+            else:
+                key = frozenset(constraints)
+            try:
+                classes[key].append(cell)
+            except KeyError:
+                classes[key] = [cell]
+        return classes
+
+    def _components(self, unknown):
+        """Split the unknown cells into groups that share no constraints
+        (other than the total number of blue cells).
+        Return a list of pairs (cells, names of their constraints),
+        and the list of cells that aren't in any constraints."""
+        # Union-find: parent[cell] leads to the cell that stands for its component
+        parent = {cell: cell for cell in unknown}
+        def find(cell):
+            while parent[cell] is not cell:
+                parent[cell] = parent[parent[cell]]
+                cell = parent[cell]
+            return cell
+
+        active = []
+        for name, (constraint, involved, unknown_count) in self.rows.items():
+            if not unknown_count or name == self.total_row:
+                continue
+            cells = [cell for cell in involved if cell not in self.known]
+            active.append((name, cells[0]))
+            root = find(cells[0])
+            for cell in cells[1:]:
+                other = find(cell)
+                if other is not root:
+                    parent[other] = root
+
+        components = collections.OrderedDict()
+        free = []
+        for cell in unknown:
+            if not self.cell_constraints[cell]:
+                free.append(cell)
+                continue
+            root = find(cell)
+            try:
+                components[root][0].append(cell)
+            except KeyError:
+                components[root] = ([cell], [])
+        for name, cell in active:
+            components[find(cell)][1].append(name)
+        return list(components.values()), free
+
+    def _component_problem(self, cells, names):
+        "Make a separate problem out of some of the cells and constraints"
+        problem = LpProblem('HexcellsComponent', LpMinimize)
+        spam = LpVariable('spam', 0, 1, 'binary')
+        problem += (spam == 1)
+        for cell in cells:
+            problem.addVariable(self.variables[cell])
+        for name in names:
+            problem.addConstraint(self.rows[name][0], name)
+        return problem, get_solver().load(problem), spam
+
+    def _solve_model(self, model, arg):
+        start = timeit.default_timer()
+        result = model.solve(arg)
+        self.profile.lp_solves.append(timeit.default_timer() - start)
+        return result
+
+    def _backbone(self, problem, model, spam, classes, solutions=None):
+        """Find the classes whose cells are all blue or all black in every solution of the problem.
+        classes is a list of pairs: (key, cells).
+        If `solutions` is a list, the solutions found on the way are added to it (see `_blues`).
+        Return a list of (cell, kind)."""
+        if isinstance(model, SatModel):
+            return self._sat_backbone(model, classes, solutions)
+        classes = collections.OrderedDict(classes)
+        variables = {key: [self.variables[cell] for cell in cells] for key, cells in classes.items()}
+
+        ####################################################
+        #     -- The MILP Problem (managed by PuLP) --
+        ####################################################
+
+        # First, get any solution.
+        if not self._solve_model(model, spam): # no optimisation function yet
+            return []
+
+        def get_true_false_classes():
+            true_set  = set()
+            false_set = set()
+
+            blues = self._blues(classes, variables, solutions)
+            for key, cells in classes.items():
+                blue = blues[key]
+                if blue == 0:
+                    false_set.add(key)
+                elif blue == len(cells):
+                    true_set.add(key)
+            return true_set, false_set
+
+        # get classes that are fully true or false
+        # they are candidates for solvable classes
+        true, false = get_true_false_classes()
+
+        while true or false:
+            # Now try to vary as much away from the
+            # initial solution as possible:
+            # We try to make the variables True, that were False before
+            # and vice versa. If no change could be achieved, then
+            # the remaining variables have their unique possible value.
+            if not self._solve_model(model,
+                lpSum(v for t in true for v in variables[t])-lpSum(v for f in false for v in variables[f])
+            ):
+                return []
+
+            # all true variables stayed true and false stayed false?
+            # Then they have their unique value and we are done!
+            if value(problem.objective) == sum(len(classes[key]) for key in true):
+                self._blues(classes, variables, solutions)
+                return [
+                    (cell, kind)
+                    for tf_set, kind in [(true, Cell.full), (false, Cell.empty)]
+                    for key in tf_set
+                    for cell in classes[key]
+                ]
+
+            true_new, false_new = get_true_false_classes()
+
+            # remember only those classes that subbornly kept their pure trueness/falseness
+            true &= true_new
+            false &= false_new
+        return []
+
+    def _sat_backbone(self, model, classes, solutions=None):
+        "The same as `_backbone`, but by asking the SAT solver whether each class can be the other way"
+        classes = collections.OrderedDict(classes)
+        variables = {key: [self.variables[cell] for cell in cells] for key, cells in classes.items()}
+
+        if not self._solve_model(model, {}):
+            return []
+        self._blues(classes, variables, solutions)
+
+        # Classes whose cells have the same value in every solution found so far -> that value
+        candidates = collections.OrderedDict()
+        for key in classes:
+            values = {value(v) for v in variables[key]}
+            if len(values) == 1:
+                candidates[key] = values.pop()
+
+        # Cells of a class can swap places, so if one of them can have the other value, any of them can
+        for key in list(candidates):
+            if key in candidates and self._solve_model(model, {variables[key][0]: 1-candidates[key]}):
+                self._blues(classes, variables, solutions)
+                for other, x in list(candidates.items()):
+                    if any(value(v) != x for v in variables[other]):
+                        del candidates[other]
+
+        return [
+            (cell, kind)
+            for x, kind in [(1, Cell.full), (0, Cell.empty)]
+            for key, y in candidates.items() if y == x
+            for cell in classes[key]
+        ]
+
+    @staticmethod
+    def _blues(classes, variables, solutions):
+        """Return {key of a class: the number of its blue cells} in the current solution,
+        which is also added to `solutions` if that's a list."""
+        blues = {key: int(round(sum(value(v) for v in variables[key]))) for key in classes}
+        if solutions is not None:
+            solutions.append(blues)
+        return blues
+
+
+def _seen(solutions, classes):
+    """What the solutions (see `Session._blues`) say about the classes, which are a list of (key, cells):
+    key -> [the numbers of blue cells among all the classes (as bits) of the solutions
+    where a cell of the class was blue, the same where one was black]"""
+    seen = {key: [0, 0] for key, cells in classes}
+    for blues in solutions:
+        bit = 1 << sum(blues[key] for key, cells in classes)
+        for key, cells in classes:
+            if blues[key]:
+                seen[key][0] |= bit
+            if blues[key] < len(cells):
+                seen[key][1] |= bit
+    return seen
+
+def _counts_seen(seen):
+    "The numbers of blue cells (as bits) that the solutions described by `_seen` had"
+    result = 0
+    for blue, black in seen.values():
+        result |= blue | black
+    return result
+
+def _add_counts(counts):
+    "The numbers of blue cells (as bits) that parts with the given ones (as bits) can have together"
+    result = 1
+    for mask in counts:
+        total = 0
+        k = 0
+        while mask >> k:
+            if mask >> k & 1:
+                total |= result << k
+            k += 1
+        result = total
+    return result
+
+def _fitting(others, total, n):
+    "Which numbers (as bits) of blue cells of a part of n cells leave a number that the others can have"
+    return sum(1 << k for k in range(min(n, total)+1) if others >> (total-k) & 1)
+
+
+# How the MILP says that the blue cells of a {n} column are together:
+# 'pairs': any two cells that are at least n apart can't both be blue (a quadratic number of constraints)
+# 'windows': the blue cells are one of the windows of n cells (a linear number of constraints)
+together_encoding = 'pairs'
+together_encodings = ['pairs', 'windows']
+
+# Number of threads that solve components of a level at once
+threads = multiprocessing.cpu_count()
+
+_pool = None
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPool(threads)
+    return _pool
+
+
+####################################################
+#   -- Deduction Cache --
+####################################################
+
+class DeductionCache(object):
+    """Remembers what the MILP found in a state of a level (see Session.solve),
+    so that coming back to the same state doesn't need solving again.
+    The most recently used results are kept in memory. If `database` is set,
+    every result is also stored in the `deductions` table of an SQLite database;
+    it should be a function that returns a context manager giving a connection.
+    The table keeps only the `database_size` most recently stored results.
+    It can be used from several threads."""
+    def __init__(self, size=1000, database_size=100000):
+        self.size = size
+        self.memory = collections.OrderedDict()
+        self.database = None
+        self.database_size = database_size
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        "Return a list of (x, y, kind) relative to the level's top left, or None"
+        with self.lock:
+            result = self.memory.pop(key, None)
+        if result is None:
+            if self.database is not None:
+                try:
+                    with self.database() as con:
+                        for [found] in con.execute('SELECT `found` FROM `deductions` WHERE `state` = ?', (key,)):
+                            result = [tuple(it) for it in json.loads(found)]
+                except Exception:
+                    pass
+            if result is None:
+                return
+        self._remember(key, result)
+        return result
+
+    def _remember(self, key, result):
+        with self.lock:
+            self.memory[key] = result
+            while len(self.memory) > self.size:
+                self.memory.popitem(last=False)
+
+    def put(self, key, result):
+        self._remember(key, result)
+        if self.database is not None:
+            try:
+                with self.database() as con:
+                    with con:
+                        con.execute('CREATE TABLE IF NOT EXISTS `deductions` (`state` TEXT PRIMARY KEY, `found` TEXT)')
+                        con.execute('INSERT OR REPLACE INTO `deductions` (`state`, `found`) VALUES (?, ?)', (key, json.dumps(result)))
+                        # A replaced row gets a new rowid too, so the oldest rows have the lowest ones
+                        con.execute('DELETE FROM `deductions` WHERE `rowid` <= (SELECT MAX(`rowid`) FROM `deductions`) - ?', (self.database_size,))
+            except Exception:
+                pass
+
+deduction_cache = DeductionCache()
+
+
+def get_session(level):
+    "Get the solver session of the level, starting a new one if there is none or the layout changed"
+    session = level.session
+    if session is None or session.generation != level.generation:
+        session = level.session = Session(level, session and session.component_cache)
+    return session
+
+def solve(level, callback=None):
+    """Find the unknown cells whose kind follows from the displayed information.
+    Return a list of (cell, kind). If given, callback(profile) is called afterwards with the `Profile`."""
+    session = get_session(level)
+    found = session.solve()
+    if callback is not None:
+        callback(session.profile)
+    return found
+
+def propagate(level):
+    return get_session(level).propagate()
+
+def probabilities(level):
+    """For every unknown cell, the fraction of the ways to complete the level where it's blue.
+    Return a dict {cell: probability}, or None if counting takes too long."""
+    result = get_session(level).count()
+    if result is None:
+        return None
+    total, blue = result
+    if not total:
+        return {}
+    return {cell: n/total for cell, n in blue.items()}
+
+
+####################################################
+#   -- Propagation --
+####################################################
+
+# Don't try more than this many placements of blue cells in one constraint
+max_placements = 1000
+
+def _count_combinations(n, k):
+    result = 1
+    for i in range(min(k, n-k)):
+        result = result*(n-i)//(i+1)
+    return result
+
+def _together(cur, blue, position):
+    """Would the information of this cell or column say {n} if these cells were blue?
+    `position` maps the members of a column to their indices."""
+    if isinstance(cur, Column):
+        # The cells are in a row iff they span as many positions as there are of them
+        positions = [position[it] for it in blue]
+        return not positions or max(positions)-min(positions) < len(positions)
+    return all_grouped(blue, key=Cell.is_neighbor)
+
+def _placements(cur, state):
+    """The sets of blue members that the information of a cell or column allows,
+    given what is known (see `_deduce`). Return a list of sets of cells,
+    or None if there are more than `max_placements` of them to try."""
+    members = cur.members
+    unknown = [x for x in members if state(x) is Cell.unknown]
+    full = {x for x in members if state(x) is Cell.full}
+    need = cur.value - len(full)
+    if not 0 <= need <= len(unknown):
+        return []
+    options = []
+    if isinstance(cur, Column) and cur.together:
+        # The blue cells are n members in a row
+        for start in range(len(members)-cur.value+1):
+            blue = set(members[start:start+cur.value])
+            if full <= blue and all(state(x) is not Cell.empty for x in blue):
+                options.append(blue)
+    else:
+        if _count_combinations(len(unknown), need) > max_placements:
+            return None
+        position = {it: i for i, it in enumerate(members)}
+        for chosen in itertools.combinations(unknown, need):
+            blue = full.union(chosen)
+            if cur.together is None or _together(cur, blue, position) == cur.together:
+                options.append(blue)
+    return options
+
+def _deduce(cur, state):
+    """Find what follows from the information of a single cell or column.
+    `state(cell)` tells what is known about a cell: Cell.full, Cell.empty or Cell.unknown.
+    Return a list of (cell, kind)."""
+    members = cur.members
+    unknown = [x for x in members if state(x) is Cell.unknown]
+    if not unknown:
+        return []
+    need = cur.value - sum(1 for x in members if state(x) is Cell.full)
+
+    # Saturation: the remaining cells are all blue or all black
+    if need == 0:
+        return [(x, Cell.empty) for x in unknown]
+    if need == len(unknown):
+        return [(x, Cell.full) for x in unknown]
+    if cur.together is None:
+        return []
+
+    # {n} and -n-: go through the placements of the blue cells that are possible
+    options = _placements(cur, state)
+    if not options:
+        return []
+
+    always = set.intersection(*options)
+    ever = set.union(*options)
+    return [(x, Cell.full) for x in unknown if x in always] + [(x, Cell.empty) for x in unknown if x not in ever]
+
+
+def solve_simple(level):
+    return get_session(level).solve_simple()
+
+
+####################################################
+#   -- Counting --
+####################################################
+
+# Give up counting after trying this many cells both ways
+max_count_branches = 2000
+# The cache of counts is cleared when it gets bigger than this
+count_cache_size = 100000
+
+class _TooHard(Exception):
+    pass
+
+def _convolve(a, b):
+    "Multiply two polynomials given by their coefficients"
+    result = [0]*(len(a)+len(b)-1)
+    for i, x in enumerate(a):
+        if x:
+            for j, y in enumerate(b):
+                result[i+j] += x*y
+    return result
+
+def _add_into(target, counts):
+    for k, n in enumerate(counts):
+        target[k] += n
+
+def _product(counts):
+    "Multiply the counts of groups that are independent"
+    result = [1]
+    for it in counts:
+        result = _convolve(result, it)
+    return result
+
+class _Node(object):
+    "How a group of cells was counted"
+    __slots__ = ['counts', 'branches']
+
+    def __init__(self, counts, branches):
+        # How many assignments there are with 0, 1, 2... blue cells
+        self.counts = counts
+        # For each way a cell can be: (the cells that are then blue,
+        # the nodes of the groups that the rest of the cells split into)
+        self.branches = branches
+
+class _Counter(object):
+    """Counts the assignments of cells that agree with the information of the cells and columns.
+    A count is a list: how many assignments there are with 0, 1, 2... blue cells.
+    Counts are remembered by the cells and the part of the information that concerns them,
+    so a part of the level that is the same as before isn't counted again."""
+    def __init__(self, cell_constraints, state, cache):
+        self.cell_constraints = cell_constraints
+        # Cell -> Cell.full or Cell.empty, for the displayed cells and the ones assumed so far
+        self.state = state
+        # Key (see `_key`) -> _Node
+        self.cache = cache
+        self.branches = 0
+        # Constraint -> its members, the number of the blue ones and of the ones that aren't assigned
+        self.members = {}
+        self.full = {}
+        self.unknown = {}
+        for constraints in cell_constraints.values():
+            for cur in constraints:
+                if cur not in self.members:
+                    members = self.members[cur] = cur.members
+                    self.full[cur] = sum(1 for x in members if state.get(x) is Cell.full)
+                    self.unknown[cur] = sum(1 for x in members if x not in state)
+
+    def groups(self, cells):
+        """Split the cells into groups that share no constraints.
+        Return a list of pairs: (cells, constraints)."""
+        cell_constraints = self.cell_constraints
+        left = set(cells)
+        seen = set()
+        groups = []
+        for cell in cells:
+            if cell not in left:
+                continue
+            left.discard(cell)
+            group = [cell]
+            constraints = []
+            for x in group:
+                for cur in cell_constraints[x]:
+                    if cur in seen:
+                        continue
+                    seen.add(cur)
+                    constraints.append(cur)
+                    for y in self.members[cur]:
+                        if y in left:
+                            left.discard(y)
+                            group.append(y)
+            groups.append((group, constraints))
+        return groups
+
+    def _key(self, cells, constraints):
+        key = []
+        for cur in constraints:
+            if cur.together is None:
+                # Only the number of blue cells that are still needed matters
+                key.append((cur, self.full[cur]))
+            else:
+                key.append((cur, tuple(self.state.get(x) for x in self.members[cur])))
+        return frozenset(cells), frozenset(key)
+
+    def count(self, cells, constraints):
+        """Count the assignments of the cells, which must be connected by the constraints.
+        Return a _Node."""
+        key = self._key(cells, constraints)
+        try:
+            return self.cache[key]
+        except KeyError:
+            pass
+        self.branches += 1
+        if self.branches > max_count_branches:
+            raise _TooHard()
+
+        # Try both ways the cell that is in the most constraints
+        cell_constraints = self.cell_constraints
+        cell = max(cells, key=lambda cell: len(cell_constraints[cell]))
+        counts = []
+        branches = []
+        for kind in [Cell.empty, Cell.full]:
+            assigned = self._assign(cell, kind)
+            if assigned is None:
+                continue
+            try:
+                blue = [x for x in assigned if self.state[x] is Cell.full]
+                left = [x for x in cells if x not in self.state]
+                children = [self.count(*group) for group in self.groups(left)]
+            finally:
+                self._undo(assigned)
+            branch_counts = [0]*len(blue) + _product(child.counts for child in children)
+            if not any(branch_counts):
+                continue
+            branches.append((blue, children))
+            if len(counts) < len(branch_counts):
+                counts.extend([0]*(len(branch_counts)-len(counts)))
+            for k, n in enumerate(branch_counts):
+                counts[k] += n
+        while counts and not counts[-1]:
+            counts.pop()
+        node = self.cache[key] = _Node(counts, branches)
+        return node
+
+    def blue_counts(self, outers):
+        """Find in how many assignments each cell is blue.
+        `outers` is a list of pairs: a node and what each of its counts is worth,
+        i.e. how many ways there are to complete the level with that many blue cells in its group.
+        Return a dict {cell: count}."""
+        # The nodes are visited after all the nodes whose branches lead to them,
+        # so that their worth is complete by then
+        order = []
+        seen = set()
+        stack = [(node, False) for node, _ in outers]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                order.append(node)
+                continue
+            if node in seen:
+                continue
+            seen.add(node)
+            stack.append((node, True))
+            for _, children in node.branches:
+                stack.extend((child, False) for child in children)
+        order.reverse()
+
+        worth = {}
+        for node, outer in outers:
+            _add_into(worth.setdefault(node, [0]*len(node.counts)), outer)
+        result = collections.defaultdict(int)
+        for node in order:
+            outer = worth.pop(node)
+            for blue, children in node.branches:
+                shifted = outer[len(blue):]
+                if blue:
+                    n = sum(a*b for a, b in zip(shifted, _product(child.counts for child in children)))
+                    for cell in blue:
+                        result[cell] += n
+                for i, child in enumerate(children):
+                    others = _product(other.counts for j, other in enumerate(children) if j != i)
+                    _add_into(worth.setdefault(child, [0]*len(child.counts)), [
+                        sum(x*shifted[k+m] for m, x in enumerate(others))
+                        for k in range(len(child.counts))
+                    ])
+        return result
+
+    def _assign(self, cell, kind):
+        """Assume the kind of the cell and whatever follows from single constraints.
+        Return the list of the assumed cells, or None if something contradicts that."""
+        state = self.state
+        full = self.full
+        unknown = self.unknown
+        assigned = []
+        queue = collections.OrderedDict()
+        def assign(cell, kind):
+            state[cell] = kind
+            assigned.append(cell)
+            for cur in self.cell_constraints[cell]:
+                unknown[cur] -= 1
+                if kind is Cell.full:
+                    full[cur] += 1
+                queue[cur] = None
+        assign(cell, kind)
+        while queue:
+            cur, _ = queue.popitem(last=False)
+            need = cur.value - full[cur]
+            if not 0 <= need <= unknown[cur]:
+                self._undo(assigned)
+                return None
+            if not unknown[cur]:
+                if cur.together is not None and not self._together(cur):
+                    self._undo(assigned)
+                    return None
+                continue
+            if need == 0:
+                kind = Cell.empty
+            elif need == unknown[cur]:
+                kind = Cell.full
+            else:
+                continue
+            for x in self.members[cur]:
+                if x not in state:
+                    assign(x, kind)
+        return assigned
+
+    def _undo(self, assigned):
+        for cell in assigned:
+            kind = self.state.pop(cell)
+            for cur in self.cell_constraints[cell]:
+                self.unknown[cur] += 1
+                if kind is Cell.full:
+                    self.full[cur] -= 1
+
+    def _together(self, cur):
+        "Does the information about togetherness agree with the cells of the constraint, which are all assigned?"
+        # The same as what the MILP is told, see `Session._constraints_of`
+        if isinstance(cur, Cell) and not 2 <= cur.value <= 4:
+            return True
+        members = self.members[cur]
+        position = {it: i for i, it in enumerate(members)}
+        return _together(cur, {x for x in members if self.state[x] is Cell.full}, position) == cur.together
+
+
+def solve_complete(level, cancelled=None, callback=None):
+    """Reveal everything that can be deduced, like "Solve Completely" in the player.
+    Propagation is used as long as it finds something, the MILP only when it's stuck.
+    Return the number of steps that needed the full solver.
+    The level is solved if it has no remaining blue cells afterwards.
+    How many cells each tier found is counted in `level.session.hits`.
+    If `cancelled` (a threading.Event) is given, solving stops after the step during which it was set.
+    If given, callback(found, profile) is called after every step, before the found cells are displayed;
+    the profile is None for steps done by propagation."""
+    session = get_session(level)
+    steps = 0
+    while cancelled is None or not cancelled.is_set():
+        found = session.propagate()
+        profile = None
+        if not found:
+            found = session.solve()
+            profile = session.profile
+            if not found:
+                return steps
+            steps += 1
+        if callback is not None:
+            callback(found, profile)
+        for cell, kind in found:
+            cell.display = kind
+    return steps
+
+
+####################################################
+#   -- Rating --
+####################################################
+
+# The kinds of deductions, from the weakest, and how hard each of them is for a person
+rating_tiers = collections.OrderedDict([
+    # The unknown members of a constraint must all be blue or all black
+    ('saturation', 1),
+    # What a single {n} or -n- allows
+    ('pattern', 2),
+    # Two constraints that share unknown cells, taken together
+    ('pair', 4),
+    # Everything at once, including the number of remaining blue cells
+    ('global', 8),
+])
+
+class Rating(object):
+    """How hard a level is, from solving it in steps where each step uses the weakest
+    kind of deduction (see `rating_tiers`) that finds anything, and uncovers all it finds."""
+    def __init__(self):
+        # (tier, number of cells found) for every step
+        self.steps = []
+        # Whether the whole level could be uncovered
+        self.solved = False
+
+    @property
+    def score(self):
+        "The average hardness of the steps, between 1 (only saturation) and 8 (only global)"
+        if not self.steps:
+            return 0
+        return sum(rating_tiers[tier] for tier, n in self.steps) / len(self.steps)
+
+    @property
+    def hardest(self):
+        "The hardest tier that any step needed"
+        tiers = {tier for tier, n in self.steps}
+        for tier in reversed(rating_tiers):
+            if tier in tiers:
+                return tier
+
+    def tiers(self):
+        "Tier -> (number of steps, number of cells found)"
+        result = collections.OrderedDict((tier, (0, 0)) for tier in rating_tiers)
+        for tier, n in self.steps:
+            steps, cells = result[tier]
+            result[tier] = (steps+1, cells+n)
+        return result
+
+    def __str__(self):
+        return "{} {:.2f} ({}) | {}".format(
+            "Solved" if self.solved else "Stuck", self.score, self.hardest,
+            ", ".join("{} {} steps/{} cells".format(tier, steps, cells) for tier, (steps, cells) in self.tiers().items()),
+        )
+
+def _deduce_pair(a, b, state, placements):
+    """Find what follows from the information of two cells or columns together,
+    given what is known (see `_deduce`) and the placements of each of them (see `_placements`).
+    Return a list of (cell, kind)."""
+    if None in placements:
+        return []
+    shared = {x for x in a.members if state(x) is Cell.unknown}.intersection(b.members)
+    # Placements of each constraint grouped by which of the shared cells are blue.
+    # For every group: the cells that are blue in all of its placements, and the ones blue in any
+    groups = []
+    for options in placements:
+        group = {}
+        for blue in options:
+            key = frozenset(blue & shared)
+            try:
+                always, ever = group[key]
+                group[key] = (always & blue, ever | blue)
+            except KeyError:
+                group[key] = (blue, blue)
+        groups.append(group)
+    # Placements of the two agree iff they have the same shared cells blue
+    keys = [key for key in groups[0] if key in groups[1]]
+    if not keys:
+        return []
+    always = set.intersection(*(groups[0][key][0] | groups[1][key][0] for key in keys))
+    ever = set.union(*(groups[0][key][1] | groups[1][key][1] for key in keys))
+    unknown = collections.OrderedDict((x, True) for x in a.members + b.members if state(x) is Cell.unknown)
+    return [(x, Cell.full) for x in unknown if x in always] + [(x, Cell.empty) for x in unknown if x not in ever]
+
+class StepSolver(object):
+    """Solves a level in steps, where each step uses the weakest of the given `tiers`
+    (see `rating_tiers`) that finds anything.
+    A tier looks only at the constraints whose members changed since it last looked at them,
+    so the cells must be displayed through `display`."""
+    def __init__(self, level, tiers=rating_tiers):
+        self.session = session = get_session(level)
+        self.tiers = [tier for tier in rating_tiers if tier in tiers]
+        # Tier -> the constraints to look at the next time
+        self.touched = {tier: set(session.counts) for tier in rating_tiers}
+
+    def display(self, cell, kind):
+        cell.display = kind
+        changed = set(self.session.cell_constraints[cell])
+        changed.add(cell)
+        for constraints in self.touched.values():
+            constraints.update(changed)
+
+    def step(self):
+        """Find what the weakest tier can deduce.
+        Return the tier and a list of (cell, kind), which is empty if nothing can be deduced."""
+        for tier in self.tiers:
+            # Constraints that were removed (their cell was covered again) or have no unknown cells say nothing
+            constraints = [cur for cur in self.touched[tier] if self.session.counts.get(cur, (0,))[0]]
+            self.touched[tier] = set()
+            found = getattr(self, '_'+tier)(constraints)
+            if found:
+                return tier, found
+        return self.tiers[-1], []
+
+    def _saturation(self, constraints):
+        state = self.session._state
+        found = collections.OrderedDict()
+        for cur in constraints:
+            unknown, full = self.session.counts[cur]
+            need = cur.value - full
+            if need == 0 or need == unknown:
+                kind = Cell.empty if need == 0 else Cell.full
                 for x in cur.members:
-                    if x.display is Cell.unknown:
-                        yield x, Cell.empty
+                    if state(x) is Cell.unknown:
+                        found[x] = kind
+        return list(found.items())
+
+    def _pattern(self, constraints):
+        found = collections.OrderedDict()
+        for cur in constraints:
+            if cur.together is not None:
+                found.update(_deduce(cur, self.session._state))
+        return list(found.items())
+
+    def _pair(self, constraints):
+        state = self.session._state
+        # Every pair of constraints that share an unknown cell, where at least one of them was touched
+        pairs = set()
+        for a in constraints:
+            for x in a.members:
+                if state(x) is Cell.unknown:
+                    for b in self.session.cell_constraints[x]:
+                        if b is not a:
+                            pairs.add(frozenset([a, b]))
+        found = collections.OrderedDict()
+        placements = {}
+        for pair in pairs:
+            for cur in pair:
+                if cur not in placements:
+                    placements[cur] = _placements(cur, state)
+            a, b = pair
+            found.update(_deduce_pair(a, b, state, [placements[a], placements[b]]))
+        return list(found.items())
+
+    def _global(self, constraints):
+        return self.session.solve()
+
+def rate(level, cancelled=None):
+    """Rate how hard the level is to solve. Return a `Rating`.
+    The level is solved as far as possible, like with `solve_complete`.
+    If `cancelled` (a threading.Event) is given, rating stops after the step during which it was set."""
+    solver = StepSolver(level)
+    rating = Rating()
+    while cancelled is None or not cancelled.is_set():
+        tier, found = solver.step()
+        if not found:
+            break
+        rating.steps.append((tier, len(found)))
+        for cell, kind in found:
+            solver.display(cell, kind)
+    rating.solved = level.remaining == 0
+    return rating
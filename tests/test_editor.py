@@ -0,0 +1,52 @@
+# Copyright (C) 2014-2016 Oleh Prypin <blaxpirit@gmail.com>
+# 
+# This file is part of SixCells.
+# 
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import division, print_function
+
+import os
+import sys
+import time
+
+import pytest
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+editor = pytest.importorskip('editor')
+
+
+def wait(condition, timeout):
+    "Process events until the condition holds or the time is up; return the condition"
+    end = time.time() + timeout
+    while not condition() and time.time() < end:
+        editor.app.processEvents()
+        time.sleep(0.01)
+    return condition()
+
+
+@pytest.mark.skipif(editor.solver is None, reason="the solver isn't available")
+def test_check_doesnt_change_level():
+    window = editor.MainWindow()
+    window.check_action.setChecked(True)
+    assert window.load_file(os.path.join(here, 'benchmark-levels', 'medium-sparse.hexcells'))
+    assert wait(lambda: window.check_label.text() not in ('', "Checking..."), 60)
+    # Anything that would count as a change restarts the timer, give it time to go off
+    wait(lambda: False, window.check_timer.interval()/1000 + 0.5)
+    assert not window.any_changes
+    assert not window.check_timer.isActive()
@@ -0,0 +1,104 @@
+# Copyright (C) 2014-2016 Oleh Prypin <blaxpirit@gmail.com>
+# 
+# This file is part of SixCells.
+# 
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import division, print_function
+from __future__ import division, print_function
+
+import io
+import os
+import sys
+import glob
+
+import pytest
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+import model
+
+
+def benchmark_levels():
+    return [open(fn).read() for fn in sorted(glob.glob(os.path.join(here, 'benchmark-levels', '*.hexcells')))]
+
+def same_data(a, b):
+    assert (a.title, a.author, a.information) == (b.title, b.author, b.information)
+    assert sorted(a.cells) == sorted(b.cells)
+    assert sorted(a.columns) == sorted(b.columns)
+
+
+def test_packed_round_trip(tmpdir):
+    texts = benchmark_levels()
+    levels = [model.load(text) for text in texts]
+    f = io.BytesIO()
+    assert model.save_packed(levels, f) == len(levels)
+    fn = str(tmpdir.join('levels.hexpack'))
+    with open(fn, 'wb') as out:
+        out.write(f.getvalue())
+
+    for pack in [model.PackedLevels(f.getvalue()), model.open_pack(fn)]:
+        assert len(pack) == len(texts)
+        assert pack.titles == [level.title for level in levels]
+        for index, (text, level) in enumerate(zip(texts, levels)):
+            same_data(pack.parse(index), model.parse(text))
+            # The text of a packed level reads the same, and saves the same as the original
+            same_data(model.parse(pack[index]), model.parse(text))
+            assert model.save(pack.level(index)) == model.save(level)
+        with pytest.raises(IndexError):
+            pack.parse(len(texts))
+        pack.close()
+
+def test_packed_errors():
+    level = model.load(benchmark_levels()[0])
+    f = io.BytesIO()
+    model.save_packed([level], f)
+    data = f.getvalue()
+    with pytest.raises(ValueError):
+        model.PackedLevels(b'Hexcells level v1\n' + data)
+    for end in [len(model.packed_magic) + 2, len(data) - 1]:
+        with pytest.raises(ValueError):
+            model.PackedLevels(data[:end])
+
+    too_wide = model.Level()
+    too_wide.place(model.Cell(model.Cell.full), (model.packed_size, 0))
+    with pytest.raises(ValueError):
+        model.save_packed([too_wide], io.BytesIO())
+
+
+def test_parse():
+    text = benchmark_levels()[0]
+    data = model.parse(text)
+    assert data.title.startswith("Benchmark")
+    # Every item that isn't '.' is a cell or a column
+    places = sum(1 for line in text.splitlines()[5:] for kind in line.strip()[0::2] if kind != '.')
+    assert len(data.cells) + len(data.columns) == places
+    assert model.load(text).all_cells
+
+@pytest.mark.parametrize('text, message', [
+    ("", "stopped abruptly"),
+    ("Hexcells level v2\nTitle\nAuthor\n\n\n", "Hexcells level v1"),
+    ("Hexcells level v1\nTitle\nAuthor\n", "stopped abruptly"),
+    ("Hexcells level v1\nTitle\nAuthor\n\n\n..x...\n..o?..\n", "'?' in line 7"),
+    ("Hexcells level v1\nTitle\nAuthor\n\n\n..x...\n..o!..\n", "'!' in line 7"),
+    ("Hexcells level v1\nTitle\nAuthor\n\n\n..y.\n", "'y' in line 6"),
+])
+def test_parse_errors(text, message):
+    with pytest.raises(ValueError) as e:
+        model.parse(text)
+    assert message in str(e.value)
+    with pytest.raises(ValueError):
+        model.load(text)
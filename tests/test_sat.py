@@ -0,0 +1,126 @@
+# Copyright (C) 2014-2016 Oleh Prypin <blaxpirit@gmail.com>
+# 
+# This file is part of SixCells.
+# 
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import division, print_function
+from __future__ import division, print_function
+
+import os
+import sys
+import random
+import itertools
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import sat
+
+
+def random_constraints(rnd, n):
+    "Clauses and (maybe guarded) cardinality constraints over the variables 1..n"
+    constraints = []
+    for i in range(rnd.randint(0, 8)):
+        if rnd.random() < 0.4:
+            lits = [rnd.choice([1, -1]) * rnd.randint(1, n) for j in range(rnd.randint(1, 3))]
+            constraints.append(('clause', lits))
+        else:
+            k = rnd.randint(1, n)
+            lits = [rnd.choice([1, -1]) * v for v in rnd.sample(range(1, n+1), k)]
+            if rnd.random() < 0.2:
+                # A repeated literal counts several times
+                lits.append(lits[0])
+            low = rnd.randint(0, len(lits))
+            high = rnd.randint(low, len(lits))
+            guard = rnd.choice([1, -1]) * rnd.randint(1, n) if rnd.random() < 0.3 else None
+            constraints.append(('cardinality', lits, low, high, guard))
+    return constraints
+
+def add(solver, constraint):
+    if constraint[0] == 'clause':
+        solver.add_clause(constraint[1])
+    else:
+        solver.add_cardinality(*constraint[1:])
+
+def satisfied(assignment, constraints, assumptions):
+    "assignment is a list of bools for the variables 1..n"
+    def true(lit):
+        return assignment[abs(lit)-1] == (lit > 0)
+    for constraint in constraints:
+        if constraint[0] == 'clause':
+            if not any(true(lit) for lit in constraint[1]):
+                return False
+        else:
+            lits, low, high, guard = constraint[1:]
+            if guard is not None and not true(guard):
+                continue
+            if not low <= sum(true(lit) for lit in lits) <= high:
+                return False
+    return all(true(lit) for lit in assumptions)
+
+def check(solver, n, constraints, assumptions):
+    "Compare a solve with trying every assignment"
+    expected = any(satisfied(a, constraints, assumptions) for a in itertools.product([False, True], repeat=n))
+    result = solver.solve(assumptions)
+    assert result == expected, (constraints, assumptions)
+    if result:
+        assert satisfied([solver.model[v] > 0 for v in range(1, n+1)], constraints, assumptions)
+
+
+# With a small totalizer_size, cardinality constraints are encoded as clauses
+@pytest.mark.parametrize('totalizer_size', [sat.Solver.totalizer_size, 2])
+def test_against_brute_force(totalizer_size):
+    rnd = random.Random(totalizer_size)
+    for i in range(400):
+        n = rnd.randint(1, 8)
+        solver = sat.Solver()
+        solver.totalizer_size = totalizer_size
+        for v in range(n):
+            solver.new_var()
+        constraints = random_constraints(rnd, n)
+        for constraint in constraints:
+            add(solver, constraint)
+        # What was learned in one solve must not spoil the ones under other assumptions
+        for j in range(4):
+            assumptions = [rnd.choice([1, -1]) * v for v in rnd.sample(range(1, n+1), rnd.randint(0, min(3, n)))]
+            check(solver, n, constraints, assumptions)
+
+def test_constraints_between_solves():
+    rnd = random.Random(1)
+    for i in range(200):
+        n = rnd.randint(1, 8)
+        solver = sat.Solver()
+        for v in range(n):
+            solver.new_var()
+        constraints = []
+        for constraint in random_constraints(rnd, n):
+            constraints.append(constraint)
+            add(solver, constraint)
+            check(solver, n, constraints, [])
+
+def test_guard():
+    solver = sat.Solver()
+    a, b, c, guard = [solver.new_var() for i in range(4)]
+    solver.add_cardinality([a, b, c], 3, 3, guard)
+    solver.add_clause([-a])
+    assert solver.solve([-guard])
+    assert not solver.solve([guard])
+    assert solver.solve()
+    assert solver.model[guard] < 0
+
+def test_luby():
+    assert [sat.luby(i) for i in range(15)] == [1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8]
@@ -0,0 +1,120 @@
+# Copyright (C) 2014-2016 Oleh Prypin <blaxpirit@gmail.com>
+# 
+# This file is part of SixCells.
+# 
+# SixCells is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+# 
+# SixCells is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+# 
+# You should have received a copy of the GNU General Public License
+# along with SixCells.  If not, see <http://www.gnu.org/licenses/>.
+
+
+from __future__ import division, print_function
+from __future__ import division, print_function
+
+import os
+import sys
+import glob
+import random
+import itertools
+
+import pytest
+
+here = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, here)
+
+import model
+from model import Cell
+from util import all_grouped
+solver = pytest.importorskip('solver')
+
+
+def random_states(count, unknown, hints=1):
+    """Benchmark levels with all but a few random cells displayed,
+    keeping only about this fraction of the numbers and columns"""
+    rnd = random.Random(unknown)
+    fns = sorted(glob.glob(os.path.join(here, 'benchmark-levels', '*.hexcells')))
+    for i in range(count):
+        level = model.load(open(rnd.choice(fns)).read())
+        for item in list(level.all_cells) + list(level.all_columns):
+            if rnd.random() >= hints:
+                if isinstance(item, Cell):
+                    item.show_info = 0
+                else:
+                    level.remove(item)
+        cells = [cell for cell in level.all_cells if cell.display is Cell.unknown]
+        keep = set(rnd.sample(cells, min(unknown, len(cells))))
+        for cell in cells:
+            if cell not in keep:
+                cell.display = cell.kind
+        yield level
+
+def holds(cur, kind):
+    "Does the information of the cell or column agree with the cells being of these kinds?"
+    full = [x for x in cur.members if kind[x] is Cell.full]
+    if len(full) != cur.value:
+        return False
+    if cur.together is None:
+        return True
+    if isinstance(cur, Cell):
+        return all_grouped(set(full), key=Cell.is_neighbor) == cur.together
+    groups = itertools.groupby(cur.members, key=lambda x: kind[x] is Cell.full)
+    return (sum(1 for full, _ in groups if full) <= 1) == cur.together
+
+def brute_force(level):
+    "Count the ways to complete the level and in how many of them each unknown cell is blue"
+    unknown = [cell for cell in level.all_cells if cell.display is Cell.unknown]
+    info = [cell for cell in level.all_cells if cell.display is not Cell.unknown and cell.show_info]
+    info += list(level.all_columns)
+    kind = {cell: cell.display for cell in level.all_cells}
+    total = 0
+    blue = {cell: 0 for cell in unknown}
+    for chosen in itertools.combinations(unknown, level.remaining):
+        for cell in unknown:
+            kind[cell] = Cell.empty
+        for cell in chosen:
+            kind[cell] = Cell.full
+        if all(holds(cur, kind) for cur in info):
+            total += 1
+            for cell in chosen:
+                blue[cell] += 1
+    return total, blue
+
+
+# With fewer hints, some cells aren't in any constraint
+@pytest.mark.parametrize('unknown, hints', [(6, 1), (12, 1), (16, 1), (12, 0.3)])
+def test_count_against_brute_force(unknown, hints):
+    for level in random_states(8, unknown, hints):
+        total, blue = brute_force(level)
+        assert total
+        assert solver.get_session(level).count() == (total, blue)
+        assert solver.probabilities(level) == {cell: n/total for cell, n in blue.items()}
+
+def test_count_after_changes():
+    # The counts that a session remembers must not be used for other states
+    for level in random_states(4, 14):
+        session = solver.get_session(level)
+        session.count()
+        cells = [cell for cell in level.all_cells if cell.display is Cell.unknown]
+        for cell in cells[:4]:
+            cell.display = cell.kind
+            assert session.count() == brute_force(level)
+        for cell in cells[:4]:
+            cell.display = Cell.unknown
+        assert session.count() == brute_force(level)
+
+# Parts of the level that share no constraints are solved separately, then put together
+@pytest.mark.parametrize('unknown, hints', [(12, 1), (16, 0.6), (16, 0.3), (6, 0.2), (10, 0.1)])
+def test_solve_against_brute_force(unknown, hints):
+    for level in random_states(20, unknown, hints):
+        total, blue = brute_force(level)
+        expected = {(cell, Cell.full) for cell, n in blue.items() if n == total}
+        expected |= {(cell, Cell.empty) for cell, n in blue.items() if n == 0}
+        assert set(solver.solve(level)) == expected